@@ -1,6 +1,19 @@
 from django.apps import AppConfig
+from django.conf import settings
+from django.core.checks import Tags, register
+from django.db.backends.signals import connection_created
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from .cache import check_shared_cache
+
+        register(check_shared_cache, Tags.caches)
+
+        if settings.PERFORMANCE_METRICS:
+            from .metrics import install_query_timer
+            connection_created.connect(install_query_timer)
@@ -0,0 +1,246 @@
+from calendar import timegm
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.views import View
+from django_filters.utils import translate_validation
+from rest_framework import exceptions
+from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.request import Request
+from rest_framework.views import exception_handler
+
+from .authentication import CachedTokenAuthentication
+from .cache import tag_cache, ingredient_cache
+from .conditional import make_etag, recipes_version, reference_version
+from .filters import RecipeFilter
+from .metrics import serialize_timer
+from .pagination import CustomPagination
+from .permissions import IsAuthorAdminOrReadOnly
+from .renderers import ORJSONRenderer
+from .serializers import RecipeReadSerializer, UserSubscribeListSerializer
+from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
+                    UserSubscriptionsViewSet, get_cached_object,
+                    get_subscriptions_queryset, list_ingredients)
+from recipes.models import Ingredient, Recipe, Tag
+
+
+# Заголовки ответа обработчика исключений DRF, которые нужны клиенту;
+# Content-Type и остальные задает render.
+EXCEPTION_HEADERS = ('WWW-Authenticate', 'Retry-After', 'Allow')
+
+
+class AsyncReadView(View):
+    """ Асинхронное представление для чтения в формате JSON.
+
+    Обрабатывает только GET-запросы, ожидающие JSON: выборки выполняются
+    через async ORM, синхронные части (аутентификация, версии для
+    ETag, сериализаторы) - в потоке через sync_to_async. Остальные
+    методы и браузерная версия API передаются синхронному
+    представлению sync_view."""
+    sync_view = None
+    renderer = ORJSONRenderer()
+    permission_classes = (AllowAny,)
+    authentication_classes = (CachedTokenAuthentication,)
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+        view.csrf_exempt = True
+        return view
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method != 'GET' or self.wants_browsable_api(request):
+            return await sync_to_async(type(self).sync_view)(
+                request, *args, **kwargs)
+        request = Request(request, authenticators=[
+            authentication() for authentication
+            in self.authentication_classes])
+        request.accepted_media_type = self.renderer.media_type
+        self.request = request
+        try:
+            await sync_to_async(self.initial)(request)
+            return await self.get(request, *args, **kwargs)
+        except Exception as exc:
+            return self.handle_exception(request, exc)
+
+    @staticmethod
+    def wants_browsable_api(request):
+        accept = request.headers.get('Accept', '')
+        return 'text/html' in accept and 'application/json' not in accept
+
+    def initial(self, request):
+        """ Аутентификация и проверка прав, как в APIView.initial."""
+        request.user
+        for permission_class in self.permission_classes:
+            if not permission_class().has_permission(request, self):
+                if request.authenticators and not (
+                        request.successful_authenticator):
+                    raise exceptions.NotAuthenticated()
+                raise exceptions.PermissionDenied()
+
+    def handle_exception(self, request, exc):
+        if isinstance(exc, (exceptions.NotAuthenticated,
+                            exceptions.AuthenticationFailed)):
+            exc.auth_header = self.authentication_classes[
+                0]().authenticate_header(request)
+        response = exception_handler(exc, {'request': request, 'view': self})
+        if response is None:
+            raise exc
+        return self.render(response.data, response.status_code, {
+            header: response[header] for header in EXCEPTION_HEADERS
+            if response.has_header(header)})
+
+    def render(self, data, status=200, headers=None):
+        response = HttpResponse(self.renderer.render(data), status=status,
+                                content_type=self.renderer.media_type)
+        for header, value in (headers or {}).items():
+            response[header] = value
+        response['Vary'] = 'Accept'
+        return response
+
+    async def get_version(self, request, **kwargs):
+        """ Версия ресурса для ETag и Last-Modified или None."""
+        return None
+
+    async def get_data(self, request, **kwargs):
+        raise NotImplementedError
+
+    async def get(self, request, **kwargs):
+        """ Ответ с проверкой условных заголовков, как в декораторе
+        django.views.decorators.http.condition."""
+        version = await self.get_version(request, **kwargs)
+        etag = last_modified = None
+        if version is not None:
+            etag = quote_etag(make_etag(request, *version.etag_values))
+            if version.last_modified is not None:
+                last_modified = timegm(
+                    version.last_modified.utctimetuple())
+        response = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = self.render(await self.get_data(request, **kwargs))
+        if last_modified and not response.has_header('Last-Modified'):
+            response.headers['Last-Modified'] = http_date(last_modified)
+        if etag:
+            response.headers.setdefault('ETag', etag)
+        return response
+
+    def get_serializer_context(self):
+        return {'request': self.request, 'format': None, 'view': self}
+
+    async def serialize(self, serializer_class, instance, **kwargs):
+        context = self.get_serializer_context()
+
+        def serialize():
+            serializer = serializer_class(instance, context=context, **kwargs)
+            with serialize_timer():
+                return serializer.data
+
+        return await sync_to_async(serialize)()
+
+    async def paginate(self, queryset, serializer_class):
+        paginator = CustomPagination()
+        page = await paginator.apaginate_queryset(queryset, self.request,
+                                                  self)
+        data = await self.serialize(serializer_class, page, many=True)
+        return paginator.get_paginated_response(data).data
+
+
+class AsyncRecipeListView(AsyncReadView):
+    """ Асинхронный список рецептов."""
+    sync_view = RecipeViewSet.as_view({'get': 'list', 'post': 'create'})
+    permission_classes = (IsAuthorAdminOrReadOnly,)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['image_variant'] = 'card'
+        return context
+
+    def filter_queryset(self, request):
+        filterset = RecipeFilter(request.query_params,
+                                 Recipe.objects.with_related(),
+                                 request=request)
+        if not filterset.is_valid():
+            raise translate_validation(filterset.errors)
+        return filterset.qs
+
+    async def get_version(self, request):
+        return await sync_to_async(recipes_version)(request)
+
+    async def get_data(self, request):
+        queryset = await sync_to_async(self.filter_queryset)(request)
+        return await self.paginate(queryset, RecipeReadSerializer)
+
+
+class AsyncRecipeDetailView(AsyncReadView):
+    """ Асинхронное получение рецепта."""
+    sync_view = RecipeViewSet.as_view({'get': 'retrieve',
+                                       'patch': 'partial_update',
+                                       'delete': 'destroy'})
+    permission_classes = (IsAuthorAdminOrReadOnly,)
+
+    async def get_version(self, request, pk):
+        return await sync_to_async(recipes_version)(request, pk)
+
+    async def get_data(self, request, pk):
+        recipe = await Recipe.objects.with_related().filter(pk=pk).afirst()
+        if recipe is None:
+            raise Http404
+        return await self.serialize(RecipeReadSerializer, recipe)
+
+
+class AsyncTagListView(AsyncReadView):
+    """ Асинхронный список тегов."""
+    sync_view = TagViewSet.as_view({'get': 'list'})
+
+    async def get_version(self, request):
+        return await sync_to_async(reference_version)(request, Tag)
+
+    async def get_data(self, request):
+        return await sync_to_async(tag_cache.all)()
+
+
+class AsyncTagDetailView(AsyncReadView):
+    """ Асинхронное получение тега."""
+    sync_view = TagViewSet.as_view({'get': 'retrieve'})
+
+    async def get_version(self, request, pk):
+        return await sync_to_async(reference_version)(request, Tag)
+
+    async def get_data(self, request, pk):
+        return await sync_to_async(get_cached_object)(tag_cache, pk)
+
+
+class AsyncIngredientListView(AsyncReadView):
+    """ Асинхронный список и поиск ингредиентов."""
+    sync_view = IngredientViewSet.as_view({'get': 'list'})
+
+    async def get_version(self, request):
+        return await sync_to_async(reference_version)(request, Ingredient)
+
+    async def get_data(self, request):
+        return await sync_to_async(list_ingredients)(request)
+
+
+class AsyncIngredientDetailView(AsyncReadView):
+    """ Асинхронное получение ингредиента."""
+    sync_view = IngredientViewSet.as_view({'get': 'retrieve'})
+
+    async def get_version(self, request, pk):
+        return await sync_to_async(reference_version)(request, Ingredient)
+
+    async def get_data(self, request, pk):
+        return await sync_to_async(get_cached_object)(ingredient_cache, pk)
+
+
+class AsyncSubscriptionsView(AsyncReadView):
+    """ Асинхронная лента подписок."""
+    sync_view = UserSubscriptionsViewSet.as_view({'get': 'list'})
+    permission_classes = (IsAuthenticated,)
+    cursor_ordering = UserSubscriptionsViewSet.cursor_ordering
+
+    async def get_data(self, request):
+        return await self.paginate(get_subscriptions_queryset(request),
+                                   UserSubscribeListSerializer)
@@ -0,0 +1,157 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+from users.models import User
+
+TOKEN_CACHE_KEY = 'auth_token:{digest}'
+TOKEN_VERSION_KEY = 'auth_token:version:{digest}'
+# Только поля для аутентификации и проверки прав: хеш пароля и личные
+# данные в кеш не попадают. Остальные поля загруженного из кеша User
+# отложены, читаются из базы при обращении и не перезаписываются
+# при его сохранении. Порядок - как в модели, его ожидает User.from_db.
+CACHED_FIELDS = tuple(
+    field.attname for field in User._meta.concrete_fields
+    if field.attname in {'id', 'email', 'username', 'is_active', 'is_staff'})
+
+
+class TokenCache:
+    """ Кеш токен -> пользователь для аутентификации без запроса к базе.
+
+    Первый уровень - ограниченный по размеру LRU в памяти процесса
+    со временем жизни TOKEN_CACHE_TIMEOUT. Второй, необязательный,
+    уровень - общий кеш Django, включается TOKEN_CACHE_SHARED_TIMEOUT.
+    Хранятся значения полей пользователя, а не сам объект, поэтому
+    запросы не делят один экземпляр User.
+
+    Запись хранит версию токена из кеша Django, которая сверяется при
+    каждом попадании: invalidate меняет версию, и записи токена
+    устаревают во всех процессах, использующих этот кеш. Версия и запись
+    общего кеша читаются одним get_many."""
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def keys(key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return (TOKEN_VERSION_KEY.format(digest=digest),
+                TOKEN_CACHE_KEY.format(digest=digest))
+
+    def get(self, key):
+        """ Текущая версия записей токена и запись или None, если ее нет
+        или она устарела. Вытесненная из кеша версия создается заново,
+        поэтому старые записи не оживают."""
+        version_key, shared_key = self.keys(key)
+        data = self.get_local(key)
+        shared = data is None and settings.TOKEN_CACHE_SHARED_TIMEOUT
+        values = cache.get_many([version_key, shared_key] if shared
+                                else [version_key])
+        version = values.get(version_key)
+        if version is None:
+            version = time.time_ns()
+            if not cache.add(version_key, version, timeout=None):
+                version = cache.get(version_key, version)
+        if shared:
+            data = values.get(shared_key)
+            if data is not None:
+                self.set_local(key, data)
+        if data is not None and data[0] != version:
+            self.delete(key)
+            data = None
+        return version, data
+
+    def get_local(self, key):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, data = entry
+            if expires_at > now:
+                self._entries.move_to_end(key)
+                return data
+            del self._entries[key]
+        return None
+
+    def set_local(self, key, data):
+        if not settings.TOKEN_CACHE_SIZE:
+            return
+        expires_at = time.monotonic() + settings.TOKEN_CACHE_TIMEOUT
+        with self._lock:
+            self._entries[key] = (expires_at, data)
+            self._entries.move_to_end(key)
+            while len(self._entries) > settings.TOKEN_CACHE_SIZE:
+                self._entries.popitem(last=False)
+
+    def set(self, key, data):
+        self.set_local(key, data)
+        if settings.TOKEN_CACHE_SHARED_TIMEOUT:
+            cache.set(self.keys(key)[1], data,
+                      settings.TOKEN_CACHE_SHARED_TIMEOUT)
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if settings.TOKEN_CACHE_SHARED_TIMEOUT:
+            cache.delete_many([self.keys(key)[1] for key in keys])
+
+    def invalidate(self, *keys):
+        """ Сбрасывает записи токенов во всех процессах."""
+        now = time.time_ns()
+        cache.set_many({self.keys(key)[0]: now for key in keys},
+                       timeout=None)
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+
+def dump_credentials(version, user, token):
+    return (version, token.created,
+            tuple(getattr(user, field) for field in CACHED_FIELDS))
+
+
+def load_credentials(key, data):
+    _, created, values = data
+    user = User.from_db('default', CACHED_FIELDS, values)
+    token = Token(key=key, user=user, created=created)
+    token._state.adding = False
+    token._state.db = 'default'
+    return user, token
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication с кешем токенов.
+
+    Попадание стоит одного обращения к кешу Django (версия токена и,
+    с общим кешем, запись), промах - того же обращения и запроса токена
+    с пользователем. Записи сбрасываются сигналами при удалении токена
+    (выход через djoser), изменении или удалении пользователя, в том
+    числе при смене пароля и деактивации. Другие процессы видят сброс
+    через версию токена в общем кеше, с LocMemCache - не позже
+    TOKEN_CACHE_TIMEOUT."""
+
+    def authenticate_credentials(self, key):
+        # Версия читается до запроса к базе: сброс, пришедший после
+        # него, сделает сохраненную запись устаревшей.
+        version, data = token_cache.get(key)
+        if data is not None:
+            return load_credentials(key, data)
+        user, token = super().authenticate_credentials(key)
+        token_cache.set(key, dump_credentials(version, user, token))
+        return user, token
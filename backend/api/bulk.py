@@ -0,0 +1,147 @@
+from django.db import connection, transaction
+
+from .cache import invalidate_shopping_cart
+from .membership import invalidate_membership
+from .response_cache import POPULARITY, bump_generation
+from recipes.aggregates import add_recipes, remove_recipes
+from recipes.counters import change_counter
+from recipes.models import Favorite, ShoppingList
+
+ADDED = 'added'
+EXISTS = 'exists'
+REMOVED = 'removed'
+NOT_FOUND = 'not_found'
+FORBIDDEN = 'forbidden'
+
+
+def supports_returning():
+    """ INSERT ... ON CONFLICT DO NOTHING RETURNING и DELETE ... RETURNING
+    поддерживаются PostgreSQL и SQLite начиная с 3.35."""
+    return (connection.vendor in ('postgresql', 'sqlite')
+            and connection.features.can_return_rows_from_bulk_insert)
+
+
+class BulkRelation:
+    """ Пакетное добавление и удаление связей пользователя с объектами:
+    избранного, корзины и подписок.
+
+    Каждая операция выполняется одним запросом INSERT ... SELECT ...
+    ON CONFLICT DO NOTHING RETURNING или DELETE ... RETURNING, на других
+    базах - через bulk_create(ignore_conflicts=True) и delete().
+    Сигналы моделей при этом не отправляются, поэтому кеши и счетчики
+    обновляются здесь же."""
+
+    def __init__(self, model, field, allow_self=True):
+        self.model = model
+        self.field = model._meta.get_field(field)
+        self.target = self.field.related_model
+        self.allow_self = allow_self
+
+    def quote(self, name):
+        return connection.ops.quote_name(name)
+
+    def split(self, user, ids):
+        """ Отделяет id, недоступные пользователю (подписка на себя)."""
+        ids = list(dict.fromkeys(ids))
+        if self.allow_self:
+            return ids, {}
+        return ([pk for pk in ids if pk != user.pk],
+                {pk: FORBIDDEN for pk in ids if pk == user.pk})
+
+    def insert_returning(self, user, ids):
+        placeholders = ', '.join(['%s'] * len(ids))
+        sql = (
+            f'INSERT INTO {self.quote(self.model._meta.db_table)} '
+            f'({self.quote("user_id")}, {self.quote(self.field.column)}) '
+            f'SELECT %s, {self.quote("id")} '
+            f'FROM {self.quote(self.target._meta.db_table)} '
+            f'WHERE {self.quote("id")} IN ({placeholders}) '
+            f'ON CONFLICT DO NOTHING '
+            f'RETURNING {self.quote(self.field.column)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *ids])
+            return {row[0] for row in cursor.fetchall()}
+
+    def delete_returning(self, user, ids):
+        placeholders = ', '.join(['%s'] * len(ids))
+        sql = (
+            f'DELETE FROM {self.quote(self.model._meta.db_table)} '
+            f'WHERE {self.quote("user_id")} = %s '
+            f'AND {self.quote(self.field.column)} IN ({placeholders}) '
+            f'RETURNING {self.quote(self.field.column)}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [user.pk, *ids])
+            return {row[0] for row in cursor.fetchall()}
+
+    def existing(self, user, ids):
+        return set(self.model.objects.filter(
+            user=user, **{f'{self.field.attname}__in': ids}
+        ).values_list(self.field.attname, flat=True))
+
+    def found(self, ids):
+        return set(self.target.objects.filter(
+            id__in=ids).values_list('id', flat=True))
+
+    @transaction.atomic
+    def add(self, request, ids):
+        """ Добавляет связи и возвращает словарь id -> статус."""
+        user = request.user
+        ids, results = self.split(user, ids)
+        if not ids:
+            return results
+        if supports_returning():
+            added = self.insert_returning(user, ids)
+            rest = [pk for pk in ids if pk not in added]
+            found = added | (self.found(rest) if rest else set())
+        else:
+            found = self.found(ids)
+            added = found - self.existing(user, ids)
+            self.model.objects.bulk_create(
+                [self.model(user=user, **{self.field.attname: pk})
+                 for pk in added],
+                ignore_conflicts=True)
+        change_counter(self.model, added, 1)
+        if self.model is ShoppingList:
+            add_recipes(user.pk, added)
+        for pk in ids:
+            if pk in added:
+                results[pk] = ADDED
+            else:
+                results[pk] = EXISTS if pk in found else NOT_FOUND
+        if added:
+            self.changed(request)
+        return results
+
+    @transaction.atomic
+    def remove(self, request, ids):
+        """ Удаляет связи и возвращает словарь id -> статус."""
+        user = request.user
+        ids, results = self.split(user, ids)
+        if not ids:
+            return results
+        if supports_returning():
+            removed = self.delete_returning(user, ids)
+            change_counter(self.model, removed, -1)
+            if self.model is ShoppingList:
+                remove_recipes(user.pk, removed)
+        else:
+            # delete() отправляет pre_delete и post_delete, счетчики
+            # и суммы корзины меняют сигналы.
+            removed = self.existing(user, ids)
+            self.model.objects.filter(
+                user=user, **{f'{self.field.attname}__in': removed}
+            ).delete()
+        for pk in ids:
+            results[pk] = REMOVED if pk in removed else NOT_FOUND
+        if removed:
+            self.changed(request)
+        return results
+
+    def changed(self, request):
+        invalidate_membership(request, self.model)
+        if self.model is Favorite:
+            bump_generation(POPULARITY)
+        if self.model is ShoppingList:
+            invalidate_shopping_cart(request.user.pk)
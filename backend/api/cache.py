@@ -0,0 +1,192 @@
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Warning
+from django.db import transaction
+
+from foodgram.routers import get_replicas
+from recipes.models import Ingredient, ShoppingAggregate, ShoppingList, Tag
+
+SHOPPING_CART_KEY = 'shopping_cart:{generation}:{user_id}'
+SHOPPING_CART_GENERATION_KEY = 'shopping_cart:generation'
+
+
+def after_commit(func):
+    """ Откладывает сброс кеша до фиксации текущей транзакции.
+
+    До фиксации другие запросы читают из базы старые данные и могут
+    снова положить их в кеш, сброшенный внутри транзакции. Вне
+    транзакции функция выполняется сразу."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        transaction.on_commit(lambda: func(*args, **kwargs))
+    return wrapper
+
+
+def is_process_local():
+    """ Хранит ли кеш данные в памяти процесса."""
+    return isinstance(caches['default'], LocMemCache)
+
+
+def invalidation_timeout():
+    """ Время жизни записей, которые сбрасываются при изменении данных.
+
+    В общем кеше сброс видят все процессы, и записи живут до него.
+    LocMemCache у каждого процесса свой: сброс в одном процессе не
+    доходит до остальных, поэтому записи в нем устаревают через
+    LOCAL_CACHE_TIMEOUT секунд."""
+    if is_process_local():
+        return settings.LOCAL_CACHE_TIMEOUT
+    return None
+
+
+def check_shared_cache(app_configs=None, **kwargs):
+    errors = []
+    if settings.WEB_CONCURRENCY > 1 and is_process_local():
+        errors.append(Error(
+            f'LocMemCache при WEB_CONCURRENCY={settings.WEB_CONCURRENCY}: '
+            f'процессы не видят сброс кеша друг друга.',
+            hint='Задайте общий кеш в CACHE_BACKEND и CACHE_LOCATION '
+                 '(Redis, Memcached, база или файлы).',
+            id='api.E001'))
+    if get_replicas() and is_process_local():
+        errors.append(Warning(
+            'Привязка к основной базе после записи хранится в '
+            'LocMemCache: другие процессы сервера читают с реплики '
+            'данные без последних изменений.',
+            hint='Задайте общий кеш в CACHE_BACKEND и CACHE_LOCATION, '
+                 'если процессов сервера больше одного.',
+            id='api.W001'))
+    return errors
+
+
+def get_shopping_cart_generation():
+    """ Общее поколение кеша списков покупок.
+
+    Увеличивается при изменении справочника ингредиентов, чтобы
+    сбросить списки всех пользователей одной операцией."""
+    return cache.get_or_set(SHOPPING_CART_GENERATION_KEY, time.time_ns,
+                            timeout=invalidation_timeout())
+
+
+def shopping_cart_key(user_id, generation=None):
+    if generation is None:
+        generation = get_shopping_cart_generation()
+    return SHOPPING_CART_KEY.format(generation=generation, user_id=user_id)
+
+
+def get_shopping_cart(user):
+    """ Суммарное количество ингредиентов в корзине пользователя.
+
+    Возвращает список кортежей (название, единица измерения, количество)
+    из ShoppingAggregate. Результат кешируется до изменения корзины
+    пользователя, в LocMemCache - не дольше invalidation_timeout()."""
+    key = shopping_cart_key(user.id)
+    items = cache.get(key)
+    if items is None:
+        items = list(ShoppingAggregate.objects.filter(
+            user=user
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'total_amount'
+        ).order_by('ingredient__name'))
+        cache.set(key, items, timeout=invalidation_timeout())
+    return items
+
+
+@after_commit
+def invalidate_shopping_cart(user_id):
+    cache.delete(shopping_cart_key(user_id))
+
+
+def invalidate_recipe_shopping_carts(recipe_id):
+    """ Сбрасывает списки покупок пользователей с рецептом в корзине.
+    Пользователи выбираются сразу, а сбрасываются после фиксации."""
+    user_ids = list(ShoppingList.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True))
+    if user_ids:
+        delete_shopping_carts(user_ids)
+
+
+@after_commit
+def delete_shopping_carts(user_ids):
+    generation = get_shopping_cart_generation()
+    cache.delete_many([shopping_cart_key(user_id, generation)
+                       for user_id in user_ids])
+
+
+@after_commit
+def invalidate_all_shopping_carts():
+    try:
+        cache.incr(SHOPPING_CART_GENERATION_KEY)
+    except ValueError:
+        cache.set(SHOPPING_CART_GENERATION_KEY, time.time_ns(),
+                  timeout=invalidation_timeout())
+
+
+class ReferenceCache:
+    """ Кеш справочника, который меняется редко (теги, ингредиенты).
+
+    Хранит готовые к выдаче словари объектов и словарь id -> объект
+    в памяти процесса и в общем кеше Django. Ключ версии увеличивается
+    сигналами post_save / post_delete; процесс, увидевший новую версию,
+    берет данные из общего кеша или строит их заново. В LocMemCache
+    версия живет invalidation_timeout() секунд."""
+
+    def __init__(self, model, fields):
+        self.model = model
+        self.fields = fields
+        label = model._meta.label_lower
+        self.version_key = f'reference:{label}:version'
+        self.data_key = f'reference:{label}:{{version}}'
+        self._local = (None, None)
+
+    def get_version(self):
+        return cache.get_or_set(self.version_key, time.time_ns,
+                                timeout=invalidation_timeout())
+
+    def build(self):
+        items = list(self.model.objects.order_by('id').values(*self.fields))
+        return {'items': items,
+                'by_id': {item['id']: item for item in items}}
+
+    def load(self):
+        """ Возвращает версию и данные справочника."""
+        version = self.get_version()
+        local_version, data = self._local
+        if local_version == version:
+            return version, data
+        key = self.data_key.format(version=version)
+        data = cache.get(key)
+        if data is None:
+            data = self.build()
+            cache.set(key, data, timeout=invalidation_timeout())
+        self._local = (version, data)
+        return version, data
+
+    def all(self):
+        return self.load()[1]['items']
+
+    def by_id(self):
+        return self.load()[1]['by_id']
+
+    def get(self, pk):
+        return self.by_id().get(pk)
+
+    def invalidate(self):
+        transaction.on_commit(self.bump_version)
+
+    def bump_version(self):
+        try:
+            cache.incr(self.version_key)
+        except ValueError:
+            cache.set(self.version_key, time.time_ns(),
+                      timeout=invalidation_timeout())
+
+
+tag_cache = ReferenceCache(Tag, ('id', 'name', 'color', 'slug'))
+ingredient_cache = ReferenceCache(Ingredient,
+                                  ('id', 'name', 'measurement_unit'))
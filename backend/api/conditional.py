@@ -0,0 +1,171 @@
+import hashlib
+from datetime import timezone as dt_timezone
+
+from django.db import connection, connections, router
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.views.decorators.http import condition
+
+from .response_cache import POPULARITY, get_generations
+from recipes.models import (Deletion, Favorite, Ingredient, Recipe,
+                            ShoppingList, Tag)
+from users.models import Follow
+
+
+def mark_deleted(model):
+    """ Запоминает время удаления объекта модели.
+
+    Удаление не оставляет updated_at в таблице, поэтому оно учитывается
+    в версии отдельно. Отметка пишется в той же транзакции, что и
+    удаление, и не пропадает вместе с кешем."""
+    label = model._meta.label_lower
+    now = timezone.now()
+    if not Deletion.objects.filter(model=label).update(deleted_at=now):
+        Deletion.objects.get_or_create(model=label,
+                                       defaults={'deleted_at': now})
+
+
+def deleted_at_part(*models):
+    """ Подзапрос времени последнего удаления объектов моделей."""
+    labels = [model._meta.label_lower for model in models]
+    placeholders = ', '.join(['%s'] * len(labels))
+    return (f'SELECT MAX(deleted_at) FROM {table(Deletion)} '
+            f'WHERE model IN ({placeholders})', labels)
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def fetch_versions(parts):
+    """ Выполняет один запрос из скалярных подзапросов parts
+    и возвращает кортеж их значений.
+
+    Запрос идет в ту же базу, из которой читаются рецепты, чтобы версия
+    соответствовала отдаваемым данным."""
+    sql = 'SELECT ' + ', '.join(f'({part})' for part, _ in parts)
+    params = [param for _, part_params in parts for param in part_params]
+    with connections[router.db_for_read(Recipe)].cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchone()
+
+
+def to_datetime(value):
+    if isinstance(value, str):
+        value = parse_datetime(value)
+    if value is not None and timezone.is_naive(value):
+        value = timezone.make_aware(value, dt_timezone.utc)
+    return value
+
+
+def latest(*values):
+    values = [value for value in map(to_datetime, values) if value]
+    return max(values) if values else None
+
+
+def make_etag(request, *values):
+    """ Сильный ETag из значений версии, адреса запроса, пользователя
+    и выбранного формата ответа."""
+    accepted = getattr(request, 'accepted_media_type', '')
+    source = '|'.join(map(str, (*values, request.get_full_path(),
+                                request.user.pk, accepted)))
+    return hashlib.md5(source.encode()).hexdigest()
+
+
+class Version:
+    """ Версия ресурса, вычисляемая один раз на запрос."""
+
+    def __init__(self, values, last_modified):
+        self.etag_values = values
+        self.last_modified = last_modified
+
+
+def reference_version(request, model):
+    attr = f'_{model._meta.model_name}_version'
+    if not hasattr(request, attr):
+        count, updated_at, deleted_at = fetch_versions([
+            (f'SELECT COUNT(*) FROM {table(model)}', []),
+            (f'SELECT MAX(updated_at) FROM {table(model)}', []),
+            deleted_at_part(model),
+        ])
+        last_modified = latest(updated_at, deleted_at)
+        setattr(request, attr,
+                Version((count, last_modified), last_modified))
+    return getattr(request, attr)
+
+
+def recipes_version(request, pk=None):
+    """ Версия списка рецептов или рецепта pk для пользователя запроса.
+
+    Учитывает рецепты, теги, ингредиенты, а для авторизованного
+    пользователя - его избранное, корзину и подписки. Порядок
+    ordering=popular зависит от избранного всех пользователей, поэтому
+    для него в версию входит поколение popularity. Last-Modified
+    отдается только анонимным пользователям и не для ordering=popular:
+    изменения личных списков и популярности не имеют отметки времени."""
+    if hasattr(request, '_recipes_version'):
+        return request._recipes_version
+    if pk is not None and not str(pk).isdigit():
+        return None
+    if pk is None:
+        parts = [(f'SELECT MAX(updated_at) FROM {table(Recipe)}', [])]
+    else:
+        parts = [(f'SELECT updated_at FROM {table(Recipe)} WHERE id = %s',
+                  [pk])]
+    parts += [
+        (f'SELECT MAX(updated_at) FROM {table(Tag)}', []),
+        (f'SELECT COUNT(*) FROM {table(Tag)}', []),
+        (f'SELECT MAX(updated_at) FROM {table(Ingredient)}', []),
+        deleted_at_part(Recipe, Tag, Ingredient),
+    ]
+    user = request.user
+    if user.is_authenticated:
+        for model in (Favorite, ShoppingList, Follow):
+            parts += [
+                (f'SELECT COUNT(*) FROM {table(model)} WHERE user_id = %s',
+                 [user.pk]),
+                (f'SELECT MAX(id) FROM {table(model)} WHERE user_id = %s',
+                 [user.pk]),
+            ]
+    values = fetch_versions(parts)
+    popular = pk is None and request.GET.get('ordering') == 'popular'
+    if pk is not None and values[0] is None:
+        version = None
+    else:
+        updated = latest(*values[:2], *values[3:5])
+        etag_values = (*values, updated)
+        if popular:
+            etag_values += (get_generations([POPULARITY]),)
+        version = Version(
+            etag_values,
+            None if user.is_authenticated or popular else updated)
+    request._recipes_version = version
+    return version
+
+
+def recipes_etag(request, pk=None, **kwargs):
+    version = recipes_version(request, pk)
+    if version is not None:
+        return make_etag(request, *version.etag_values)
+
+
+def recipes_last_modified(request, pk=None, **kwargs):
+    version = recipes_version(request, pk)
+    if version is not None:
+        return version.last_modified
+
+
+def reference_condition(model):
+    """ Декоратор condition для справочников с полем updated_at."""
+    def etag(request, *args, **kwargs):
+        return make_etag(request, *reference_version(
+            request, model).etag_values)
+
+    def last_modified(request, *args, **kwargs):
+        return reference_version(request, model).last_modified
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
+
+
+recipes_condition = condition(etag_func=recipes_etag,
+                              last_modified_func=recipes_last_modified)
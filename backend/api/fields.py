@@ -1,16 +1,101 @@
 import base64
+import binascii
 
-from django.core.files.base import ContentFile
-from rest_framework.serializers import ImageField
+from django.conf import settings
+from django.core.files.storage import default_storage
+from rest_framework.fields import Field
+from rest_framework.serializers import ImageField, ValidationError
+
+from .cache import tag_cache
+from recipes.images import ImageRejected, sanitize_image
+from recipes.models import Recipe
 
 
 class Base64ImageField(ImageField):
-    """ Сериализатор получения изображения в кодировке."""
+    """ Сериализатор получения изображения в кодировке.
+
+    Размер проверяется по длине base64-строки до декодирования,
+    разрешение - по заголовку изображения. Сохраняется копия
+    без метаданных."""
 
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
             format, imgstr = data.split(';base64,')
-            ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            if len(imgstr) * 3 // 4 > settings.RECIPE_IMAGE_MAX_BYTES:
+                raise ValidationError(
+                    'Размер изображения не должен превышать '
+                    f'{settings.RECIPE_IMAGE_MAX_BYTES} байт.')
+            try:
+                data = sanitize_image(base64.b64decode(imgstr))
+            except binascii.Error:
+                raise ValidationError('Некорректная строка base64.')
+            except ImageRejected as error:
+                raise ValidationError(str(error))
 
         return super().to_internal_value(data)
+
+
+def image_url(recipe, variant, request=None):
+    """ URL варианта изображения рецепта или оригинала, если вариант
+    еще не создан; None, если изображения нет."""
+    name = (recipe.image_variants or {}).get(variant)
+    if name:
+        url = default_storage.url(name)
+    elif recipe.image:
+        url = recipe.image.url
+    else:
+        return None
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+class ImageVariantField(Field):
+    """ URL варианта изображения рецепта нужного размера.
+
+    Вариант задается аргументом поля или контекстом сериализатора
+    (image_variant, по умолчанию full); если он еще не создан,
+    отдается оригинал."""
+
+    def __init__(self, variant=None, **kwargs):
+        self.variant = variant
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        variant = self.variant or self.context.get('image_variant', 'full')
+        return image_url(recipe, variant, self.context.get('request'))
+
+
+def attach_tag_ids(recipes):
+    """ Загружает идентификаторы тегов рецептов одним запросом
+    к промежуточной таблице, без соединения с таблицей тегов."""
+    recipes = [recipe for recipe in recipes
+               if not hasattr(recipe, 'tag_ids')]
+    if not recipes:
+        return
+    tag_ids = {recipe.id: [] for recipe in recipes}
+    rows = Recipe.tags.through.objects.filter(
+        recipe_id__in=tag_ids
+    ).order_by('tag_id').values_list('recipe_id', 'tag_id')
+    for recipe_id, tag_id in rows:
+        tag_ids[recipe_id].append(tag_id)
+    for recipe in recipes:
+        recipe.tag_ids = tag_ids[recipe.id]
+
+
+class CachedTagsField(Field):
+    """ Теги рецепта из кеша справочника тегов."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+        self._tags = None
+
+    def to_representation(self, recipe):
+        attach_tag_ids([recipe])
+        if self._tags is None:
+            self._tags = tag_cache.by_id()
+        return [self._tags[pk] for pk in recipe.tag_ids if pk in self._tags]
@@ -1,8 +1,24 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework.filters import (BooleanFilter, CharFilter,
-                                                   ModelMultipleChoiceFilter)
+                                                   ChoiceFilter,
+                                                   MultipleChoiceFilter)
 from django_filters.rest_framework import FilterSet
 
-from recipes.models import Ingredient, Recipe, Tag
+from .cache import tag_cache
+from recipes.models import Recipe
+
+RecipeTag = Recipe.tags.through
+TAGS_MODE_CHOICES = (
+    ('any', 'Любой из тегов'),
+    ('all', 'Все теги'),
+)
+ORDERING_CHOICES = (
+    ('popular', 'По популярности'),
+)
+
+
+def tag_choices():
+    return [(tag['slug'], tag['name']) for tag in tag_cache.all()]
 
 
 class RecipeFilter(FilterSet):
@@ -10,13 +26,35 @@ class RecipeFilter(FilterSet):
     is_favorited = BooleanFilter(method='get_is_favorited')
     is_in_shopping_cart = BooleanFilter(
         method='get_is_in_shopping_cart')
-    tags = ModelMultipleChoiceFilter(queryset=Tag.objects.all(),
-                                     field_name='tags__slug',
-                                     to_field_name='slug', )
+    tags = MultipleChoiceFilter(choices=tag_choices, method='get_tags')
+    tags_mode = ChoiceFilter(choices=TAGS_MODE_CHOICES,
+                             method='get_tags_mode')
+    search = CharFilter(method='get_search')
+    ordering = ChoiceFilter(choices=ORDERING_CHOICES,
+                            method='get_ordering')
 
     class Meta:
         model = Recipe
-        fields = ('author', 'tags', 'is_favorited', 'is_in_shopping_cart')
+        fields = ('author', 'tags', 'tags_mode', 'is_favorited',
+                  'is_in_shopping_cart', 'search', 'ordering')
+
+    def get_tags(self, queryset, name, value):
+        """Фильтрует по тегам подзапросами EXISTS к таблице связи
+        без JOIN и DISTINCT: при tags_mode=all рецепт должен иметь
+        все указанные теги, иначе хотя бы один."""
+        slug_to_id = {tag['slug']: tag['id'] for tag in tag_cache.all()}
+        tag_ids = [slug_to_id[slug] for slug in value if slug in slug_to_id]
+        recipe_tags = RecipeTag.objects.filter(recipe_id=OuterRef('pk'))
+        if self.form.cleaned_data.get('tags_mode') == 'all':
+            for tag_id in tag_ids:
+                queryset = queryset.filter(
+                    Exists(recipe_tags.filter(tag_id=tag_id)))
+            return queryset
+        return queryset.filter(
+            Exists(recipe_tags.filter(tag_id__in=tag_ids)))
+
+    def get_tags_mode(self, queryset, name, value):
+        return queryset
 
     def get_is_favorited(self, queryset, name, value):
         if value and self.request.user.is_authenticated:
@@ -28,10 +66,8 @@ class RecipeFilter(FilterSet):
             return queryset.filter(carts__user=self.request.user)
         return queryset
 
+    def get_search(self, queryset, name, value):
+        return queryset.search(value)
 
-class IngredientFilter(FilterSet):
-    name = CharFilter(lookup_expr='istartswith')
-
-    class Meta:
-        model = Ingredient
-        fields = ('name', )
+    def get_ordering(self, queryset, name, value):
+        return queryset.order_by('-favorites_count', '-id')
@@ -0,0 +1,62 @@
+import threading
+from bisect import bisect_left
+
+from .cache import ingredient_cache
+
+
+class IngredientIndex:
+    """ Индекс ингредиентов в памяти процесса для автодополнения.
+
+    Хранит отсортированный список названий в нижнем регистре (casefold)
+    и ищет префикс двоичным поиском. Индекс строится из кеша справочника
+    ингредиентов и перестраивается при смене его версии: с общим кешем
+    изменения справочника видны всем процессам сразу, с LocMemCache -
+    после того как версия устареет (LOCAL_CACHE_TIMEOUT)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._keys = ()
+        self._items = ()
+
+    def build(self, version, ingredients):
+        items = tuple(sorted(
+            ingredients,
+            key=lambda item: (item['name'].casefold(), item['id'])))
+        self._keys = tuple(item['name'].casefold() for item in items)
+        self._items = items
+        self._version = version
+
+    def ensure_fresh(self):
+        version, data = ingredient_cache.load()
+        if version != self._version:
+            with self._lock:
+                if version != self._version:
+                    self.build(version, data['items'])
+
+    def search(self, query, limit=None):
+        """ Ингредиенты, название которых начинается с query,
+        затем ингредиенты, в названии которых query встречается."""
+        self.ensure_fresh()
+        keys, items = self._keys, self._items
+        query = query.casefold()
+        if limit is None:
+            limit = len(items)
+        result = []
+        start = end = bisect_left(keys, query)
+        while end < len(keys) and len(result) < limit:
+            if not keys[end].startswith(query):
+                break
+            result.append(items[end])
+            end += 1
+        for position, key in enumerate(keys):
+            if len(result) >= limit:
+                break
+            if start <= position < end:
+                continue
+            if query in key:
+                result.append(items[position])
+        return result
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,472 @@
+import json
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from statistics import mean
+
+import requests
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.urls import get_resolver, reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.pagination import Cursor
+from rest_framework.settings import api_settings
+
+from api.authentication import token_cache
+from api.indexes import ingredient_index
+from api.pagination import CustomCursorPagination
+from recipes.models import Ingredient, Recipe, ShoppingList, Tag
+from users.models import User
+
+# nonempty - список в ответе не должен быть пустым на тестовых данных:
+# пустой ответ означает сломанный запрос, а не быстрый. before
+# вызывается перед каждым запросом вне замера и работает только
+# в процессе команды, поэтому с --base-url такие случаи пропускаются.
+# Если path - функция, случай замеряет ее вызов вместо HTTP-запроса,
+# method служит только подписью в результатах.
+Case = namedtuple('Case', 'name method path data auth nonempty before',
+                  defaults=(None, True, False, None))
+
+# Страница для сравнения OFFSET и курсора вглубь списка рецептов;
+# на небольших данных берется последняя.
+DEEP_PAGE = 100
+
+# Эндпоинты, которые не запускаются: служебные, меняющие пароли и учетные
+# записи или требующие писем и паролей пользователей.
+SKIPPED = {
+    'api-root', 'metrics', 'login', 'logout', 'user-activation',
+    'user-resend-activation', 'user-reset-password',
+    'user-reset-password-confirm', 'user-reset-username',
+    'user-reset-username-confirm', 'user-set-password',
+    'user-set-username',
+}
+
+
+def percentile(values, percent):
+    """ Процентиль методом ближайшего ранга."""
+    values = sorted(values)
+    rank = max(0, -(-len(values) * percent // 100) - 1)
+    return values[int(rank)]
+
+
+class HttpClient:
+    """ Клиент запущенного сервера (gunicorn, uvicorn) с методами
+    django.test.Client, которые вызывает команда."""
+
+    def __init__(self, base_url, headers):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers
+        self.session = requests.Session()
+
+    def request(self, method, path, data=None, content_type=None):
+        headers = dict(self.headers)
+        if content_type is not None:
+            headers['Content-Type'] = content_type
+            data = json.dumps(data)
+        return self.session.request(method, self.base_url + path,
+                                    data=data, headers=headers)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def delete(self, path, **kwargs):
+        return self.request('DELETE', path, **kwargs)
+
+
+class Clients:
+    """ Клиенты с токеном и без него, свои у каждого потока."""
+
+    def __init__(self, token, base_url=None):
+        self.token = token
+        self.base_url = base_url
+        self.local = threading.local()
+
+    def create(self, auth):
+        if self.base_url:
+            headers = {'Authorization': f'Token {self.token}'} if auth else {}
+            return HttpClient(self.base_url, headers)
+        host = next((host.lstrip('.') for host in settings.ALLOWED_HOSTS
+                     if host != '*'), 'localhost')
+        if auth:
+            return Client(HTTP_HOST=host,
+                          HTTP_AUTHORIZATION=f'Token {self.token}')
+        return Client(HTTP_HOST=host)
+
+    def get(self, auth):
+        clients = getattr(self.local, 'clients', None)
+        if clients is None:
+            clients = self.local.clients = {}
+        if auth not in clients:
+            clients[auth] = self.create(auth)
+        return clients[auth]
+
+
+def search_ingredients_orm(query):
+    """ Поиск ингредиентов запросами к базе вместо индекса в памяти:
+    сначала по началу названия, затем по вхождению."""
+    ingredients = Ingredient.objects.order_by('name').values(
+        'id', 'name', 'measurement_unit')
+    prefix = ingredients.filter(name__istartswith=query)
+    contains = ingredients.filter(name__icontains=query).exclude(
+        name__istartswith=query)
+    return [*prefix, *contains]
+
+
+def api_url_names():
+    """ Имена всех маршрутов из api/urls.py."""
+    names = set()
+    patterns = [get_resolver('api.urls')]
+    while patterns:
+        pattern = patterns.pop()
+        if hasattr(pattern, 'url_patterns'):
+            patterns.extend(pattern.url_patterns)
+        elif pattern.name:
+            names.add(pattern.name)
+    return names
+
+
+class Samples:
+    """ Объекты из базы, на которых запускаются эндпоинты."""
+
+    def __init__(self, user=None):
+        if user is None:
+            cart = ShoppingList.objects.order_by('-id').first()
+            user = cart.user if cart else User.objects.first()
+        if user is None:
+            raise CommandError('Нет пользователей, запустите '
+                               'generate_fixture_data')
+        self.user = user
+        self.token = Token.objects.get_or_create(user=user)[0].key
+        self.recipe = Recipe.objects.order_by('-favorites_count',
+                                              '-id').first()
+        if self.recipe is None:
+            raise CommandError('Нет рецептов, запустите '
+                               'generate_fixture_data')
+        free_recipes = list(Recipe.objects.exclude(
+            favorites__user=user).exclude(
+            carts__user=user).values_list('id', flat=True)[:6])
+        if len(free_recipes) < 6:
+            raise CommandError('Недостаточно рецептов вне избранного '
+                               'и корзины пользователя')
+        self.free_recipe, *self.free_recipes = free_recipes
+        self.free_authors = list(User.objects.exclude(id=user.id).exclude(
+            followings__user=user).values_list('id', flat=True)[:6])
+        if len(self.free_authors) < 6:
+            raise CommandError('Недостаточно авторов без подписки')
+        self.tag = self.recipe.tags.first() or Tag.objects.first()
+        self.ingredient = Ingredient.objects.first()
+        if self.tag is None or self.ingredient is None:
+            raise CommandError('Нет тегов или ингредиентов')
+        # Последний рецепт перед страницей deep_page: курсор с этой
+        # позицией выдает ту же страницу, что и page=deep_page.
+        page_size = api_settings.PAGE_SIZE
+        self.deep_page = min(DEEP_PAGE,
+                             -(-Recipe.objects.count() // page_size))
+        if self.deep_page < 2:
+            raise CommandError('Рецептов меньше чем на две страницы')
+        self.deep_recipe = Recipe.objects.order_by('-id').values_list(
+            'id', flat=True)[(self.deep_page - 1) * page_size - 1]
+
+
+def cursor_path(path, position):
+    """ Адрес страницы курсорной пагинации после объекта position."""
+    paginator = CustomCursorPagination()
+    paginator.base_url = path
+    return paginator.encode_cursor(
+        Cursor(offset=0, reverse=False, position=str(position)))
+
+
+def get_groups(samples):
+    """ Группы запросов; запросы группы выполняются подряд, чтобы
+    изменяющий запрос отменялся следующим и данные не менялись."""
+    recipe_path = reverse('recipes-list')
+    favorite = reverse('recipes-favorite', args=[samples.free_recipe])
+    cart = reverse('recipes-shopping-cart', args=[samples.free_recipe])
+    author, *authors = samples.free_authors
+    subscribe = reverse('subscribe', args=[author])
+    recipe_ids = {'ids': samples.free_recipes}
+    ingredient_query = samples.ingredient.name[:2]
+    return [
+        [Case('tags-list', 'get', reverse('tags-list'), nonempty=True)],
+        [Case('tags-detail', 'get',
+              reverse('tags-detail', args=[samples.tag.id]))],
+        [Case('ingredients-list', 'get',
+              f'{reverse("ingredients-list")}'
+              f'?name={ingredient_query}', nonempty=True)],
+        # Тот же поиск без HTTP: индекс в памяти против istartswith
+        # и icontains в базе (справочник из data/ingredients.csv).
+        [Case('ingredients-list', 'index',
+              lambda: ingredient_index.search(ingredient_query))],
+        [Case('ingredients-list', 'orm',
+              lambda: search_ingredients_orm(ingredient_query))],
+        [Case('ingredients-detail', 'get',
+              reverse('ingredients-detail', args=[samples.ingredient.id]))],
+        [Case('recipes-list', 'get', recipe_path, nonempty=True)],
+        [Case('recipes-list anonymous', 'get', recipe_path, auth=False,
+              nonempty=True)],
+        [Case('recipes-list tags', 'get',
+              f'{recipe_path}?tags={samples.tag.slug}', nonempty=True)],
+        [Case('recipes-list is_favorited', 'get',
+              f'{recipe_path}?is_favorited=1')],
+        [Case('recipes-list is_in_shopping_cart', 'get',
+              f'{recipe_path}?is_in_shopping_cart=1')],
+        [Case('recipes-list author', 'get',
+              f'{recipe_path}?author={samples.recipe.author_id}',
+              nonempty=True)],
+        [Case('recipes-list search', 'get',
+              f'{recipe_path}?search={samples.recipe.name.split()[0]}',
+              nonempty=True)],
+        [Case('recipes-list popular', 'get',
+              f'{recipe_path}?ordering=popular', nonempty=True)],
+        [Case('recipes-list cursor', 'get',
+              f'{recipe_path}?pagination=cursor', nonempty=True)],
+        [Case('recipes-list deep page', 'get',
+              f'{recipe_path}?page={samples.deep_page}', nonempty=True)],
+        [Case('recipes-list deep cursor', 'get',
+              cursor_path(recipe_path, samples.deep_recipe), nonempty=True)],
+        [Case('recipes-detail', 'get',
+              reverse('recipes-detail', args=[samples.recipe.id]))],
+        [Case('recipes-download-shopping-cart', 'get',
+              reverse('recipes-download-shopping-cart'))],
+        [Case('recipes-shopping-cart-totals', 'get',
+              reverse('recipes-shopping-cart-totals'))],
+        [Case('recipes-favorite', 'post', favorite),
+         Case('recipes-favorite', 'delete', favorite)],
+        [Case('recipes-shopping-cart', 'post', cart),
+         Case('recipes-shopping-cart', 'delete', cart)],
+        [Case('recipes-favorite-bulk', 'post',
+              reverse('recipes-favorite-bulk'), recipe_ids),
+         Case('recipes-favorite-bulk', 'delete',
+              reverse('recipes-favorite-bulk'), recipe_ids)],
+        [Case('recipes-shopping-cart-bulk', 'post',
+              reverse('recipes-shopping-cart-bulk'), recipe_ids),
+         Case('recipes-shopping-cart-bulk', 'delete',
+              reverse('recipes-shopping-cart-bulk'), recipe_ids)],
+        [Case('subscriptions', 'get', reverse('subscriptions'))],
+        [Case('subscribe', 'post', subscribe),
+         Case('subscribe', 'delete', subscribe)],
+        [Case('subscribe-bulk', 'post', reverse('subscribe-bulk'),
+              {'ids': authors}),
+         Case('subscribe-bulk', 'delete', reverse('subscribe-bulk'),
+              {'ids': authors})],
+        [Case('user-list', 'get', reverse('user-list'), nonempty=True)],
+        [Case('user-detail', 'get',
+              reverse('user-detail', args=[samples.recipe.author_id]))],
+        [Case('user-me', 'get', reverse('user-me'))],
+        # Аутентификация без кеша токенов: запрос токена с пользователем
+        # к базе на каждый запрос, как в TokenAuthentication.
+        [Case('user-me token-miss', 'get', reverse('user-me'),
+              before=lambda: token_cache.delete(samples.token))],
+    ]
+
+
+class Command(BaseCommand):
+    help = ('Benchmarking API endpoints: latency percentiles and query '
+            'counts, compared with a stored baseline')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50,
+                            help='measured requests per endpoint')
+        parser.add_argument('--warmup', type=int, default=5,
+                            help='unmeasured requests per endpoint')
+        parser.add_argument('--user', help='username to run requests as')
+        parser.add_argument('--only', action='append', default=[],
+                            help='run only endpoints with this name prefix')
+        parser.add_argument('--baseline',
+                            help='fail on regressions against this file')
+        parser.add_argument('--save-baseline',
+                            help='write results to this file')
+        parser.add_argument('--tolerance', type=float, default=0.25,
+                            help='allowed relative p50 latency growth')
+        parser.add_argument('--min-slack-ms', type=float, default=2.0,
+                            help='allowed absolute p50 latency growth')
+        parser.add_argument('--concurrency', type=int, default=1,
+                            help='parallel requests; endpoints that change '
+                                 'data run only with 1')
+        parser.add_argument('--base-url',
+                            help='benchmark a running server, e.g. '
+                                 'http://127.0.0.1:8000, instead of the '
+                                 'in-process client; queries are not '
+                                 'counted')
+
+    def handle(self, *args, **options):
+        if options['iterations'] < 1:
+            raise CommandError('--iterations должен быть больше 0')
+        if options['concurrency'] < 1:
+            raise CommandError('--concurrency должен быть больше 0')
+        user = None
+        if options['user']:
+            user = User.objects.filter(username=options['user']).first()
+            if user is None:
+                raise CommandError('Пользователь не найден')
+        samples = Samples(user)
+        groups = self.select_groups(get_groups(samples), options)
+        clients = Clients(samples.token, options['base_url'])
+        results = {}
+        for group in groups:
+            results.update(self.run_group(group, clients, options))
+        if options['save_baseline']:
+            with open(options['save_baseline'], 'w',
+                      encoding='utf-8') as file:
+                json.dump(results, file, indent=2, sort_keys=True)
+            self.stdout.write(
+                f'Результаты сохранены в {options["save_baseline"]}')
+        if options['baseline']:
+            self.compare(results, options)
+
+    def select_groups(self, groups, options):
+        if options['only']:
+            groups = [group for group in groups if group[0].name.startswith(
+                tuple(options['only']))]
+        else:
+            self.check_coverage(groups)
+        if options['concurrency'] > 1:
+            # Параллельные POST и DELETE одной записи мешали бы друг другу.
+            groups = [group for group in groups
+                      if all(case.method == 'get' for case in group)]
+        if options['base_url']:
+            groups = [group for group in groups
+                      if all(case.before is None and not callable(case.path)
+                             for case in group)]
+        return groups
+
+    def run_group(self, group, clients, options):
+        """ Выполняет группу warmup + iterations раз; при concurrency
+        больше 1 прогоны идут параллельно в concurrency потоках."""
+        timings = [[] for _ in group]
+        queries = [0] * len(group)
+
+        def run(iteration):
+            return [self.request(clients.get(case.auth), case)
+                    for case in group]
+
+        if options['concurrency'] > 1:
+            executor = ThreadPoolExecutor(options['concurrency'])
+            run_all = executor.map
+        else:
+            executor = None
+            run_all = map
+        try:
+            list(run_all(run, range(options['warmup'])))
+            started_at = time.perf_counter()
+            runs = list(run_all(run, range(options['iterations'])))
+            wall_time = time.perf_counter() - started_at
+        finally:
+            if executor is not None:
+                executor.shutdown()
+        for measured in runs:
+            for index, (elapsed, count) in enumerate(measured):
+                timings[index].append(elapsed)
+                queries[index] = max(queries[index], count)
+        results = {}
+        for case, elapsed, count in zip(group, timings, queries):
+            key = f'{case.name} {case.method.upper()}'
+            results[key] = {
+                'p50': percentile(elapsed, 50),
+                'p90': percentile(elapsed, 90),
+                'p99': percentile(elapsed, 99),
+                'mean': mean(elapsed),
+                'rps': options['iterations'] / wall_time,
+                'queries': None if options['base_url'] else count,
+            }
+            self.report(key, results[key])
+        return results
+
+    def request(self, client, case):
+        kwargs = {}
+        if case.data is not None:
+            kwargs = {'data': case.data, 'content_type': 'application/json'}
+        queries = []
+        if case.before is not None:
+            case.before()
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            # Счетчик без connection.queries: его журнал ограничен
+            # 9000 записями, и на длинном прогоне запросы теряются.
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(count_query))
+            started_at = time.perf_counter()
+            if callable(case.path):
+                response = case.path()
+            else:
+                response = getattr(client, case.method)(case.path, **kwargs)
+            if getattr(response, 'streaming', False):
+                b''.join(response.streaming_content)
+            elapsed = (time.perf_counter() - started_at) * 1000
+        self.check_result(case, response)
+        return elapsed, len(queries)
+
+    def check_result(self, case, response):
+        if callable(case.path):
+            label = f'{case.name} {case.method}'
+        else:
+            label = f'{case.method.upper()} {case.path}'
+            if response.status_code >= 400:
+                raise CommandError(
+                    f'{label}: статус {response.status_code}')
+        if case.nonempty and not self.result_count(response):
+            raise CommandError(f'{label}: пустой ответ')
+
+    @staticmethod
+    def result_count(response):
+        if isinstance(response, list):
+            return len(response)
+        data = response.json()
+        if isinstance(data, dict):
+            data = data.get('results', ())
+        return len(data)
+
+    def report(self, key, result):
+        queries = result['queries']
+        self.stdout.write(
+            f'{key:<45} p50 {result["p50"]:8.2f} ms  '
+            f'p90 {result["p90"]:8.2f} ms  p99 {result["p99"]:8.2f} ms  '
+            f'{result["rps"]:8.1f} запросов/с  запросов к базе '
+            f'{"-" if queries is None else queries}')
+
+    def check_coverage(self, groups):
+        covered = {case.name.split()[0] for group in groups
+                   for case in group}
+        missing = api_url_names() - covered - SKIPPED
+        if missing:
+            self.stdout.write(self.style.WARNING(
+                'Эндпоинты без замеров: ' + ', '.join(sorted(missing))))
+
+    def compare(self, results, options):
+        try:
+            with open(options['baseline'], encoding='utf-8') as file:
+                baseline = json.load(file)
+        except FileNotFoundError:
+            raise CommandError(f'Файл {options["baseline"]} не найден')
+        regressions = []
+        for key, result in results.items():
+            base = baseline.get(key)
+            if base is None:
+                continue
+            if None not in (result['queries'], base.get('queries')) and (
+                    result['queries'] > base['queries']):
+                regressions.append(
+                    f'{key}: запросов к базе {base["queries"]} -> '
+                    f'{result["queries"]}')
+            allowed = (base['p50'] * (1 + options['tolerance'])
+                       + options['min_slack_ms'])
+            if result['p50'] > allowed:
+                regressions.append(
+                    f'{key}: p50 {base["p50"]:.2f} -> '
+                    f'{result["p50"]:.2f} ms')
+        if regressions:
+            raise CommandError('Регрессии производительности:\n'
+                               + '\n'.join(regressions))
+        self.stdout.write(self.style.SUCCESS('Регрессий нет'))
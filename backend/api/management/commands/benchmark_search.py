@@ -0,0 +1,57 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.db.models import Q
+
+from api.management.commands.benchmark_api import percentile
+from recipes.management.commands.generate_fixture_data import WORDS
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Benchmarking indexed recipe search against an icontains '
+            'scan on the current corpus (see generate_fixture_data)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--query', action='append', default=[],
+                            help='search query, fixture words by default')
+        parser.add_argument('--repeat', type=int, default=20,
+                            help='measured runs of each query')
+        parser.add_argument('--limit', type=int, default=6,
+                            help='results per query, as on a list page')
+        parser.add_argument('--skip-scan', action='store_true',
+                            help='do not run the icontains baseline')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('--repeat должен быть больше 0')
+        total = Recipe.objects.count()
+        if not total:
+            raise CommandError('Нет рецептов, запустите '
+                               'generate_fixture_data')
+        self.stdout.write(f'Рецептов: {total}')
+        variants = {'search': Recipe.objects.search}
+        if not options['skip_scan']:
+            variants['icontains'] = lambda query: Recipe.objects.filter(
+                Q(name__icontains=query) | Q(text__icontains=query)
+            ).order_by('-id')
+        for query in options['query'] or WORDS[:5]:
+            for name, search in variants.items():
+                hits = search(query).count()
+                if not hits:
+                    raise CommandError(f'{name} "{query}": нет результатов')
+                timings = self.measure(search, query, options)
+                self.stdout.write(
+                    f'{name:<10} {query:<12} найдено {hits:>8}  '
+                    f'p50 {percentile(timings, 50):8.2f} ms  '
+                    f'p90 {percentile(timings, 90):8.2f} ms')
+
+    @staticmethod
+    def measure(search, query, options):
+        timings = []
+        for _ in range(options['repeat']):
+            started_at = time.perf_counter()
+            list(search(query).values_list('id', flat=True)[
+                :options['limit']])
+            timings.append((time.perf_counter() - started_at) * 1000)
+        return timings
@@ -0,0 +1,70 @@
+import time
+
+from django.core.management import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.serializers import Serializer
+
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeReadSerializer
+from recipes.models import Recipe
+from users.models import User
+
+
+def field_representation(serializer, recipe):
+    """ Вывод RecipeReadSerializer через поля DRF, без быстрого пути."""
+    return Serializer.to_representation(serializer, recipe)
+
+
+class Command(BaseCommand):
+    help = ('Microbenchmark of recipe serialization and JSON rendering, '
+            'checking that the fast path matches DRF fields byte-for-byte')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=1000,
+                            help='number of recipes to serialize')
+        parser.add_argument('--repeat', type=int, default=5,
+                            help='runs of each variant, the best is shown')
+        parser.add_argument('--user', help='username for membership flags')
+
+    def handle(self, *args, **options):
+        recipes = list(Recipe.objects.with_related()[:options['recipes']])
+        if not recipes:
+            raise CommandError('Нет рецептов, запустите '
+                               'generate_fixture_data')
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = (User.objects.filter(username=options['user']).first()
+                        if options['user'] else User.objects.first())
+        context = {'request': request, 'image_variant': 'card'}
+        # Загружает теги и избранное для всех рецептов до замеров.
+        RecipeReadSerializer(recipes, many=True, context=context).data
+        serializer = RecipeReadSerializer(context=context)
+        variants = {
+            'DRF fields + JSONRenderer': (
+                lambda: [field_representation(serializer, recipe)
+                         for recipe in recipes], JSONRenderer()),
+            'fast path + ORJSONRenderer': (
+                lambda: [serializer.to_representation(recipe)
+                         for recipe in recipes], ORJSONRenderer()),
+        }
+        outputs = []
+        for name, (serialize, renderer) in variants.items():
+            serialize_time = render_time = float('inf')
+            for _ in range(options['repeat']):
+                started_at = time.perf_counter()
+                data = serialize()
+                serialized_at = time.perf_counter()
+                content = renderer.render(data)
+                finished_at = time.perf_counter()
+                serialize_time = min(serialize_time,
+                                     serialized_at - started_at)
+                render_time = min(render_time, finished_at - serialized_at)
+            outputs.append(content)
+            self.stdout.write(
+                f'{name:<28} сериализация {serialize_time * 1000:8.2f} ms  '
+                f'рендеринг {render_time * 1000:8.2f} ms')
+        if outputs[0] != outputs[1]:
+            raise CommandError('Вывод быстрого пути отличается от DRF')
+        self.stdout.write(self.style.SUCCESS(
+            f'Вывод совпадает для {len(recipes)} рецептов'))
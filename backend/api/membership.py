@@ -0,0 +1,80 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recipes.models import Favorite, ShoppingList
+from users.models import Follow
+
+MEMBERSHIP_KEY = 'membership:{kind}:{user_id}'
+MEMBERSHIP_KINDS = {
+    'favorites': (Favorite, 'recipe_id'),
+    'cart': (ShoppingList, 'recipe_id'),
+    'follows': (Follow, 'author_id'),
+}
+MODEL_KINDS = {model: kind for kind, (model, _) in MEMBERSHIP_KINDS.items()}
+
+
+class UserMembership:
+    """ Избранное, корзина и подписки пользователя на время запроса.
+
+    Без общего кеша загружаются только id объектов страницы: один запрос
+    на вид связи при вызове prime(). С MEMBERSHIP_CACHE_TIMEOUT множества
+    пользователя целиком хранятся в кеше Django и сбрасываются при
+    записи через CreateDeleteMixin."""
+
+    def __init__(self, user):
+        self.user = user
+        self.members = {kind: set() for kind in MEMBERSHIP_KINDS}
+        self.checked = {kind: set() for kind in MEMBERSHIP_KINDS}
+        self.complete = set()
+
+    def load_all(self, kind):
+        model, field = MEMBERSHIP_KINDS[kind]
+        key = MEMBERSHIP_KEY.format(kind=kind, user_id=self.user.pk)
+        members = cache.get(key)
+        if members is None:
+            members = set(model.objects.filter(
+                user=self.user).values_list(field, flat=True))
+            cache.set(key, members, settings.MEMBERSHIP_CACHE_TIMEOUT)
+        self.members[kind] = members
+        self.complete.add(kind)
+
+    def prime(self, kind, ids):
+        """ Загружает принадлежность объектов ids одним запросом."""
+        if kind in self.complete:
+            return
+        if settings.MEMBERSHIP_CACHE_TIMEOUT:
+            self.load_all(kind)
+            return
+        missing = set(ids) - self.checked[kind]
+        if not missing:
+            return
+        model, field = MEMBERSHIP_KINDS[kind]
+        self.members[kind].update(model.objects.filter(
+            user=self.user, **{f'{field}__in': missing}
+        ).values_list(field, flat=True))
+        self.checked[kind].update(missing)
+
+    def contains(self, kind, pk):
+        self.prime(kind, (pk,))
+        return pk in self.members[kind]
+
+
+def get_membership(request):
+    """ Membership пользователя запроса или None для анонима."""
+    if request is None or not request.user.is_authenticated:
+        return None
+    membership = getattr(request, '_membership', None)
+    if membership is None or membership.user != request.user:
+        membership = UserMembership(request.user)
+        request._membership = membership
+    return membership
+
+
+def invalidate_membership(request, model):
+    """ Сбрасывает множество после добавления или удаления записи."""
+    kind = MODEL_KINDS[model]
+    key = MEMBERSHIP_KEY.format(kind=kind, user_id=request.user.pk)
+    transaction.on_commit(lambda: cache.delete(key))
+    if hasattr(request, '_membership'):
+        del request._membership
@@ -0,0 +1,239 @@
+import contextvars
+import hmac
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import Http404, HttpResponse
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+current_timing = contextvars.ContextVar('current_timing', default=None)
+
+
+class RequestTiming:
+    """ Время и количество запросов к базе за один HTTP-запрос."""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.total = 0.0
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.serialize_time = 0.0
+        self.render_time = 0.0
+
+    def finish(self):
+        self.total = time.perf_counter() - self.started_at
+
+    def server_timing(self):
+        return ', '.join((
+            f'db;dur={self.db_time * 1000:.1f};'
+            f'desc="queries={self.db_queries}"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+            f'render;dur={self.render_time * 1000:.1f}',
+            f'total;dur={self.total * 1000:.1f}',
+        ))
+
+
+class Histogram:
+    """ Гистограмма в формате Prometheus с накопительными корзинами."""
+
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, label, value):
+        series = self.series.get(label)
+        if series is None:
+            series = self.series[label] = [
+                [0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.description}',
+                 f'# TYPE {self.name} histogram']
+        for label, (counts, total) in sorted(self.series.items()):
+            view = label.replace('\\', '\\\\').replace('"', '\\"')
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{view="{view}",'
+                             f'le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{view="{view}"}} {total}')
+            lines.append(f'{self.name}_count{{view="{view}"}} {cumulative}')
+        return lines
+
+
+class MetricsRegistry:
+    """ Метрики запросов по представлениям в памяти процесса.
+
+    Каждый воркер отдает свои значения; Prometheus собирает их с каждого
+    процесса отдельно, внешние сервисы не нужны."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.histograms = (
+            Histogram('foodgram_request_duration_seconds',
+                      'Total request processing time.', DURATION_BUCKETS),
+            Histogram('foodgram_db_duration_seconds',
+                      'Time spent in database queries.', DURATION_BUCKETS),
+            Histogram('foodgram_serialize_duration_seconds',
+                      'Time spent building serializer data.',
+                      DURATION_BUCKETS),
+            Histogram('foodgram_render_duration_seconds',
+                      'Time spent rendering response bodies.',
+                      DURATION_BUCKETS),
+            Histogram('foodgram_db_queries',
+                      'Database queries per request.', QUERY_BUCKETS),
+        )
+
+    def observe(self, view, timing):
+        values = (timing.total, timing.db_time, timing.serialize_time,
+                  timing.render_time, timing.db_queries)
+        with self._lock:
+            for histogram, value in zip(self.histograms, values):
+                histogram.observe(view, value)
+
+    def expose(self):
+        with self._lock:
+            lines = [line for histogram in self.histograms
+                     for line in histogram.expose()]
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+def query_timer(execute, sql, params, many, context):
+    """ Обертка выполнения запросов для connection.execute_wrappers."""
+    timing = current_timing.get()
+    if timing is None:
+        return execute(sql, params, many, context)
+    started_at = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timing.db_time += time.perf_counter() - started_at
+        timing.db_queries += 1
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """ Подключает query_timer к каждому новому соединению с базой."""
+    if query_timer not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_timer)
+
+
+@contextmanager
+def stage_timer(attr):
+    """ Прибавляет время блока к полю attr метрик текущего запроса."""
+    timing = current_timing.get()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timing is not None:
+            setattr(timing, attr, getattr(timing, attr)
+                    + time.perf_counter() - started_at)
+
+
+def render_timer():
+    """ Учитывает время рендеринга тела ответа в текущем запросе."""
+    return stage_timer('render_time')
+
+
+def serialize_timer():
+    """ Учитывает время построения данных сериализатором (.data)
+    в текущем запросе; запросы к базе внутри него входят и в db."""
+    return stage_timer('serialize_time')
+
+
+def get_view_name(request):
+    """ Имя представления и действия, например RecipeViewSet.list."""
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    func = match.func
+    view_class = getattr(func, 'cls', None) or getattr(
+        func, 'view_class', None)
+    if view_class is None:
+        return match.view_name or func.__name__
+    actions = getattr(func, 'actions', None) or {}
+    action = actions.get(request.method.lower(), request.method.lower())
+    return f'{view_class.__name__}.{action}'
+
+
+class PerformanceMetricsMiddleware:
+    """ Замеряет время запроса, работы с базой, сериализации
+    и рендеринга ответа.
+
+    Результат добавляется в гистограммы для /api/metrics и, если включен
+    SERVER_TIMING, в заголовок Server-Timing. Поддерживает синхронный
+    и асинхронный режимы, чтобы не переключать потоки при запуске
+    через ASGI."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.PERFORMANCE_METRICS:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.process_response(request, response, timing)
+
+    async def __acall__(self, request):
+        timing = RequestTiming()
+        token = current_timing.set(timing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timing.reset(token)
+        return self.process_response(request, response, timing)
+
+    @staticmethod
+    def process_response(request, response, timing):
+        timing.finish()
+        view = get_view_name(request)
+        if view is not None:
+            registry.observe(view, timing)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = timing.server_timing()
+        return response
+
+
+def metrics_view(request):
+    """ Метрики в текстовом формате Prometheus.
+
+    Доступны только при заданном METRICS_TOKEN с заголовком
+    Authorization: Bearer <токен>; без токена адреса нет."""
+    if not settings.PERFORMANCE_METRICS or not settings.METRICS_TOKEN:
+        raise Http404
+    if not hmac.compare_digest(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}'):
+        return HttpResponse(status=401)
+    return HttpResponse(registry.expose(),
+                        content_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,6 +1,41 @@
+from functools import lru_cache
+
+from django.db import transaction
 from rest_framework import status
 from rest_framework.response import Response
 
+from .membership import invalidate_membership
+from .metrics import serialize_timer
+from .serializers import BulkIdsSerializer, BulkResultSerializer
+
+
+class TimedDataMixin:
+    """ Сериализатор, время получения data которого учитывается
+    в метриках запроса."""
+
+    @property
+    def data(self):
+        with serialize_timer():
+            return super().data
+
+
+@lru_cache(maxsize=None)
+def timed_serializer_class(serializer_class):
+    return type(serializer_class.__name__,
+                (TimedDataMixin, serializer_class), {})
+
+
+class SerializerTimingMixin:
+    """ Миксин GenericAPIView: время сериализации ответа представления
+    попадает в метрики (foodgram_serialize_duration_seconds и
+    Server-Timing). Замеряется только корневой сериализатор, поэтому
+    время вложенных не считается дважды."""
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        serializer.__class__ = timed_serializer_class(type(serializer))
+        return serializer
+
 
 class CreateDeleteMixin:
 
@@ -10,8 +45,14 @@ class CreateDeleteMixin:
                                            fields[1]: instance.id, },
                                      context={'request': request})
         serializer.is_valid(raise_exception=True)
-        serializer.save()
-        return Response(serializer.data, status=status.HTTP_201_CREATED)
+        # Сигналы post_save меняют счетчики и суммы корзины в той же
+        # транзакции, что и запись.
+        with transaction.atomic():
+            serializer.save()
+        invalidate_membership(request, serializer_name.Meta.model)
+        with serialize_timer():
+            data = serializer.data
+        return Response(data, status=status.HTTP_201_CREATED)
 
     def delete_object(self, request, model_name, instance, fields):
         """ Функция удаления рецептов из избранного и корзины."""
@@ -19,9 +60,24 @@ class CreateDeleteMixin:
             fields[0]: request.user,
             fields[1]: instance
         }
-        if not model_name.objects.filter(**data).exists():
+        deleted, _ = model_name.objects.filter(**data).delete()
+        if not deleted:
             return Response(
                 {'errors': 'Запись еще не существует'},
                 status=status.HTTP_400_BAD_REQUEST)
-        model_name.objects.filter(**data).delete()
+        invalidate_membership(request, model_name)
         return Response(status=status.HTTP_204_NO_CONTENT)
+
+    def bulk_objects(self, request, relation):
+        """ Пакетное добавление (POST) или удаление (DELETE) объектов
+        из списка ids с результатом для каждого id."""
+        serializer = BulkIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        if request.method == 'POST':
+            results = relation.add(request, ids)
+        else:
+            results = relation.remove(request, ids)
+        return Response({'results': BulkResultSerializer(
+            [{'id': pk, 'status': results[pk]} for pk in dict.fromkeys(ids)],
+            many=True).data})
@@ -1,5 +1,87 @@
-from rest_framework.pagination import PageNumberPagination
+from asgiref.sync import sync_to_async
+from django.core.paginator import InvalidPage, Page
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+
+
+class CustomCursorPagination(CursorPagination):
+    """ Пагинация по курсору (keyset) без COUNT(*) и OFFSET.
+
+    Порядок берется из атрибута cursor_ordering представления. Выборка
+    с другой сортировкой (поиск по релевантности, ordering=popular)
+    отклоняется: курсор заменил бы ее своим порядком."""
+    page_size_query_param = 'limit'
+    ordering = '-id'
+    ordering_conflict_message = ('Курсорная пагинация не поддерживает '
+                                 'сортировку запроса, используйте '
+                                 'постраничную.')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        requested = tuple(queryset.query.order_by)
+        if requested and requested != self.get_ordering(
+                request, queryset, view):
+            raise ValidationError(
+                {'pagination': [self.ordering_conflict_message]})
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        ordering = getattr(view, 'cursor_ordering', self.ordering)
+        if isinstance(ordering, str):
+            return (ordering,)
+        return tuple(ordering)
 
 
 class CustomPagination(PageNumberPagination):
+    """ Постраничная пагинация с переключением на курсорную.
+
+    Курсорный режим включается параметром pagination=cursor или
+    наличием параметра cursor; в нем не считается общее количество
+    объектов и не используется OFFSET."""
     page_size_query_param = "limit"
+    mode_query_param = 'pagination'
+    cursor_pagination_class = CustomCursorPagination
+
+    def __init__(self):
+        self.cursor_paginator = None
+
+    def use_cursor(self, request):
+        cursor_query_param = self.cursor_pagination_class.cursor_query_param
+        return (request.query_params.get(self.mode_query_param) == 'cursor'
+                or cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+    async def apaginate_queryset(self, queryset, request, view=None):
+        """ Асинхронный paginate_queryset: количество объектов и страница
+        загружаются через async ORM. Курсорный режим выполняется
+        синхронным кодом в потоке."""
+        if self.use_cursor(request):
+            return await sync_to_async(self.paginate_queryset)(
+                queryset, request, view)
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        paginator = self.django_paginator_class(queryset, page_size)
+        paginator.count = await queryset.acount()
+        page_number = self.get_page_number(request, paginator)
+        try:
+            number = paginator.validate_number(page_number)
+        except InvalidPage as exc:
+            raise NotFound(self.invalid_page_message.format(
+                page_number=page_number, message=str(exc)))
+        bottom = (number - 1) * page_size
+        object_list = [obj async for obj
+                       in queryset[bottom:bottom + page_size]]
+        self.page = Page(object_list, number, paginator)
+        self.request = request
+        return object_list
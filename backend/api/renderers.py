@@ -0,0 +1,163 @@
+import csv
+import io
+import json
+
+import orjson
+from django.conf import settings
+from reportlab.lib.pagesizes import A4
+from reportlab.pdfbase import pdfmetrics
+from reportlab.pdfbase.ttfonts import TTFError, TTFont
+from reportlab.pdfgen import canvas
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .metrics import render_timer
+
+SHOPPING_CART_TITLE = 'Список покупок:'
+SHOPPING_CART_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+LINE_SEPARATORS = ((b'\xe2\x80\xa8', b'\\u2028'),
+                   (b'\xe2\x80\xa9', b'\\u2029'))
+
+
+class ORJSONRenderer(JSONRenderer):
+    """ JSON-рендерер на orjson с тем же выводом, что и JSONRenderer.
+
+    Даты и другие типы, которые orjson кодирует иначе, передаются
+    кодировщику DRF. Ответы с отступами (браузерная версия API, indent
+    в Accept) и данные, которые orjson не принимает, отдаются
+    стандартному рендереру."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        with render_timer():
+            return self.render_json(data, accepted_media_type,
+                                    renderer_context)
+
+    def render_json(self, data, accepted_media_type, renderer_context):
+        if data is None:
+            return b''
+        if self.ensure_ascii or not self.compact or self.get_indent(
+                accepted_media_type, renderer_context or {}) is not None:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default,
+                               option=ORJSON_OPTIONS)
+        except orjson.JSONEncodeError:
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        for separator, escaped in LINE_SEPARATORS:
+            if separator in ret:
+                ret = ret.replace(separator, escaped)
+        return ret
+
+
+class ShoppingCartNegotiation(DefaultContentNegotiation):
+    """ Выбор формата выгрузки только по параметру format.
+
+    Без параметра всегда отдается первый рендерер (txt), чтобы заголовок
+    Accept клиента не менял формат скачиваемого файла."""
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query_param = self.settings.URL_FORMAT_OVERRIDE
+        if format_suffix or request.query_params.get(format_query_param):
+            return super().select_renderer(request, renderers, format_suffix)
+        return renderers[0], renderers[0].media_type
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """ Базовый рендерер выгрузки списка покупок.
+
+    Элементы списка - кортежи (название, единица измерения, количество).
+    Метод stream отдает файл частями для StreamingHttpResponse."""
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if not isinstance(data, (list, tuple)):
+            return json.dumps(data, ensure_ascii=False).encode('utf-8')
+        return b''.join(self.stream(data))
+
+    def stream(self, items):
+        raise NotImplementedError
+
+    def get_filename(self):
+        return f'shopping_cart.{self.format}'
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, items):
+        yield f'{SHOPPING_CART_TITLE}\n'.encode(self.charset)
+        for name, unit, amount in items:
+            yield f'\n{name} - {amount}, {unit}'.encode(self.charset)
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, items):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in (SHOPPING_CART_HEADER, *items):
+            writer.writerow(row)
+            yield buffer.getvalue().encode(self.charset)
+            buffer.seek(0)
+            buffer.truncate()
+
+
+class ShoppingCartJSONRenderer(ShoppingCartRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, items):
+        yield b'['
+        for index, (name, unit, amount) in enumerate(items):
+            item = json.dumps({'name': name, 'measurement_unit': unit,
+                               'amount': amount}, ensure_ascii=False)
+            yield (',' if index else '').encode(self.charset) + item.encode(
+                self.charset)
+        yield b']'
+
+
+class ShoppingCartPDFRenderer(ShoppingCartRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+    chunk_size = 64 * 1024
+    font_name = 'ShoppingCartFont'
+    font_size = 12
+
+    def get_font(self):
+        """ Шрифт с кириллицей из SHOPPING_CART_PDF_FONT или Helvetica."""
+        if self.font_name in pdfmetrics.getRegisteredFontNames():
+            return self.font_name
+        try:
+            pdfmetrics.registerFont(
+                TTFont(self.font_name, settings.SHOPPING_CART_PDF_FONT))
+        except (OSError, TTFError):
+            return 'Helvetica'
+        return self.font_name
+
+    def stream(self, items):
+        buffer = io.BytesIO()
+        pdf = canvas.Canvas(buffer, pagesize=A4)
+        font = self.get_font()
+        width, height = A4
+        margin = 50
+        line_height = self.font_size * 1.5
+        lines = [SHOPPING_CART_TITLE, ''] + [
+            f'{name} - {amount}, {unit}' for name, unit, amount in items]
+        y = height - margin
+        for line in lines:
+            if y < margin:
+                pdf.showPage()
+                y = height - margin
+            pdf.setFont(font, self.font_size)
+            pdf.drawString(margin, y, line)
+            y -= line_height
+        pdf.save()
+        buffer.seek(0)
+        yield from iter(lambda: buffer.read(self.chunk_size), b'')
@@ -0,0 +1,179 @@
+import gzip
+import hashlib
+import time
+
+import brotli
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import parse_http_date_safe
+
+from .cache import after_commit, invalidation_timeout
+
+RESPONSE_KEY = 'anonymous_response:{generations}:{digest}'
+GENERATION_KEY = 'anonymous_response:generation:{name}'
+# Поколения: recipes - данные рецептов, тегов, ингредиентов и авторов,
+# popularity - избранное, от которого зависит ordering=popular.
+RECIPES = 'recipes'
+POPULARITY = 'popularity'
+CACHED_VIEWS = {'recipes-list', 'recipes-detail', 'user-detail'}
+COPIED_HEADERS = ('Content-Type', 'ETag', 'Last-Modified', 'Allow')
+ENCODINGS = ('br', 'gzip')
+BROTLI_QUALITY = 6
+
+
+@after_commit
+def bump_generation(name):
+    """ Делает недействительными все закешированные ответы,
+    зависящие от поколения name."""
+    key = GENERATION_KEY.format(name=name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), timeout=invalidation_timeout())
+
+
+def get_generations(names):
+    keys = {name: GENERATION_KEY.format(name=name) for name in names}
+    values = cache.get_many(keys.values())
+    missing = {key: time.time_ns() for key in keys.values()
+               if key not in values}
+    if missing:
+        cache.set_many(missing, timeout=invalidation_timeout())
+        values.update(missing)
+    return ':'.join(str(values[keys[name]]) for name in names)
+
+
+def accepted_encoding(request):
+    """ Лучшее из br и gzip, которое принимает клиент, или None."""
+    accepted = set()
+    for item in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = item.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00'):
+            accepted.add(name.strip().lower())
+    return next((encoding for encoding in ENCODINGS
+                 if encoding in accepted), None)
+
+
+def compress(content):
+    return {'br': brotli.compress(content, quality=BROTLI_QUALITY),
+            'gzip': gzip.compress(content, mtime=0)}
+
+
+class AnonymousResponseCacheMiddleware:
+    """ Кеш готовых ответов API для анонимных GET-запросов к списку
+    и странице рецепта и странице пользователя.
+
+    Для анонима is_favorited, is_in_shopping_cart и is_subscribed всегда
+    false, поэтому ответ зависит только от адреса и параметров запроса.
+    Ключ строится по нормализованным параметрам, тело хранится сжатым
+    brotli и gzip. Устаревшие записи отбрасываются сменой поколения,
+    которое увеличивают сигналы изменения рецептов, тегов, ингредиентов
+    и пользователей; ordering=popular зависит еще и от избранного.
+    В LocMemCache поколения живут invalidation_timeout() секунд: другие
+    процессы не видят их увеличения."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.ANONYMOUS_RESPONSE_CACHE_TIMEOUT:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        key = self.get_key(request)
+        if key is None:
+            return self.get_response(request)
+        entry = cache.get(key)
+        if entry is not None:
+            return self.build_response(request, entry)
+        return self.store(request, key, self.get_response(request))
+
+    async def __acall__(self, request):
+        # Синхронный API кеша в цикле событий блокирует его, а с
+        # DatabaseCache запрещен; построение ключа и сжатие тела при
+        # записи выполняются в потоке.
+        key = await sync_to_async(self.get_key)(request)
+        if key is None:
+            return await self.get_response(request)
+        entry = await cache.aget(key)
+        if entry is not None:
+            return self.build_response(request, entry)
+        response = await self.get_response(request)
+        return await sync_to_async(self.store)(request, key, response)
+
+    @staticmethod
+    def get_key(request):
+        """ Ключ ответа или None, если запрос не кешируется."""
+        if request.method != 'GET' or 'Authorization' in request.headers:
+            return None
+        if 'text/html' in request.headers.get('Accept', ''):
+            return None
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return None
+        if match.url_name not in CACHED_VIEWS:
+            return None
+        request.resolver_match = match
+        params = sorted((name, sorted(values))
+                        for name, values in request.GET.lists())
+        names = [RECIPES]
+        if request.GET.get('ordering') == 'popular':
+            names.append(POPULARITY)
+        source = '|'.join((request.get_host(), request.scheme,
+                           request.path, repr(params)))
+        return RESPONSE_KEY.format(
+            generations=get_generations(names),
+            digest=hashlib.sha256(source.encode()).hexdigest())
+
+    @staticmethod
+    def store(request, key, response):
+        if (response.status_code != 200 or response.streaming
+                or response.has_header('Content-Encoding')
+                or response.cookies
+                or not response.get('Content-Type', '').startswith(
+                    'application/json')):
+            return response
+        entry = {
+            'headers': {header: response[header]
+                        for header in COPIED_HEADERS
+                        if response.has_header(header)},
+            'bodies': compress(response.content),
+        }
+        cache.set(key, entry, settings.ANONYMOUS_RESPONSE_CACHE_TIMEOUT)
+        return response
+
+    @staticmethod
+    def build_response(request, entry):
+        headers = entry['headers']
+        last_modified = headers.get('Last-Modified')
+        response = get_conditional_response(
+            request, etag=headers.get('ETag'),
+            last_modified=last_modified and parse_http_date_safe(
+                last_modified))
+        if response is None:
+            encoding = accepted_encoding(request)
+            if encoding is None:
+                content = gzip.decompress(entry['bodies']['gzip'])
+            else:
+                content = entry['bodies'][encoding]
+            response = HttpResponse(content)
+            if encoding is not None:
+                response['Content-Encoding'] = encoding
+        for header, value in headers.items():
+            if header != 'Content-Type' or response.status_code == 200:
+                response[header] = value
+        patch_vary_headers(response, ('Accept', 'Accept-Encoding',
+                                      'Authorization'))
+        return response
@@ -1,18 +1,43 @@
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer, UserSerializer
-from rest_framework.serializers import (ModelSerializer,
-                                        PrimaryKeyRelatedField,
+from rest_framework.serializers import (ListSerializer, ModelSerializer,
+                                        PrimaryKeyRelatedField, Serializer,
                                         ValidationError, CharField,
-                                        IntegerField)
+                                        IntegerField, ListField)
 from rest_framework.validators import UniqueTogetherValidator
 from rest_framework.fields import SerializerMethodField
 
-from .fields import Base64ImageField
+from .cache import invalidate_recipe_shopping_carts, tag_cache
+from .membership import get_membership
+from .fields import (Base64ImageField, CachedTagsField, ImageVariantField,
+                     attach_tag_ids, image_url)
+from .signals import recipe_ingredients_update
+from recipes.aggregates import change_recipe
+from recipes.images import build_image_variants
 from recipes.models import (Tag, Ingredient, Recipe, RecipeIngredient,
                             Favorite, ShoppingList)
 from users.models import Follow, User
 
 
+BULK_MAX_ITEMS = 500
+
+
+def get_limit(request, param='limit'):
+    """ Значение целочисленного параметра запроса или None,
+    если он не задан или некорректен."""
+    if request is None:
+        return None
+    try:
+        limit = int(request.GET.get(param))
+    except (TypeError, ValueError):
+        return None
+    return limit if limit >= 0 else None
+
+
+def get_recipes_limit(request):
+    return get_limit(request, 'recipes_limit')
+
+
 class UserNewSerializer(UserCreateSerializer):
     """Сериализатор для регистрации новых пользователей."""
     class Meta:
@@ -21,6 +46,19 @@ class UserNewSerializer(UserCreateSerializer):
                   'last_name', 'password')
 
 
+class UserListSerializer(ListSerializer):
+    """ Сериализатор списка пользователей.
+
+    Загружает подписки текущего пользователя на всю страницу сразу."""
+
+    def to_representation(self, data):
+        users = list(data.all() if hasattr(data, 'all') else data)
+        membership = get_membership(self.context.get('request'))
+        if membership is not None:
+            membership.prime('follows', [user.id for user in users])
+        return super().to_representation(users)
+
+
 class UserSerializer(UserSerializer):
     """ Сериализатор для модели User."""
     is_subscribed = SerializerMethodField(read_only=True)
@@ -29,17 +67,30 @@ class UserSerializer(UserSerializer):
         model = User
         fields = ('email', 'id', 'username', 'first_name',
                   'last_name', 'is_subscribed')
+        list_serializer_class = UserListSerializer
+
+    def to_representation(self, instance):
+        # Пользователь из кеша токенов загружен без имени и фамилии:
+        # они догружаются одним запросом, а не запросом на каждое поле.
+        deferred = instance.get_deferred_fields() & {'first_name',
+                                                     'last_name'}
+        if deferred:
+            instance.refresh_from_db(fields=deferred)
+        return super().to_representation(instance)
 
     def get_is_subscribed(self, obj):
-        user = self.context.get('request').user
-        if user is None or user.is_anonymous:
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
             return False
-        return Follow.objects.filter(user=user,
-                                     author=obj).exists()
+        return membership.contains('follows', obj.id)
 
 
 class RecipeFavoriteSerializer(ModelSerializer):
     """ Сериализатор ответа при добавлении рецепта в избранное."""
+    image = ImageVariantField('thumbnail')
+
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
@@ -59,18 +110,19 @@ class UserSubscribeListSerializer(UserSerializer):
 
     def get_recipes(self, obj):
         request = self.context.get('request')
-        limit = None
-        recipes = obj.recipes.all()
-        if request:
-            limit = request.GET.get('recipes_limit')
-        if limit:
-            recipes = obj.recipes.all()[:int(limit)]
+        if hasattr(obj, 'limited_recipes'):
+            recipes = obj.limited_recipes
+        else:
+            recipes = obj.recipes.all()
+            limit = get_recipes_limit(request)
+            if limit is not None:
+                recipes = recipes[:limit]
         serializer = RecipeFavoriteSerializer(recipes, many=True,
                                               context={'request': request})
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return obj.recipes.count()
+        return obj.recipes_count
 
 
 class SubscriptionSerializer(ModelSerializer):
@@ -102,14 +154,14 @@ class IngredientSerializer(ModelSerializer):
     """ Сериализатор ингредиента."""
     class Meta:
         model = Ingredient
-        fields = '__all__'
+        fields = ('id', 'name', 'measurement_unit')
 
 
 class TagSerialiser(ModelSerializer):
     """ Сериализатор тега."""
     class Meta:
         model = Tag
-        fields = '__all__'
+        fields = ('id', 'name', 'color', 'slug')
 
 
 class RecipeIngredientSerializer(ModelSerializer):
@@ -134,36 +186,101 @@ class IngredientAddSerializer(ModelSerializer):
         fields = ('id', 'amount')
 
 
+class RecipeListSerializer(ListSerializer):
+    """ Сериализатор списка рецептов.
+
+    Перед сериализацией загружает данные сразу для всей страницы."""
+
+    def to_representation(self, data):
+        recipes = list(data.all() if hasattr(data, 'all') else data)
+        attach_tag_ids(recipes)
+        membership = get_membership(self.context.get('request'))
+        if membership is not None:
+            recipe_ids = [recipe.id for recipe in recipes]
+            membership.prime('favorites', recipe_ids)
+            membership.prime('cart', recipe_ids)
+            membership.prime('follows',
+                             [recipe.author_id for recipe in recipes])
+        return super().to_representation(recipes)
+
+
 class RecipeReadSerializer(ModelSerializer):
     """ Сериализатор получения информации о рецепте."""
-    tags = TagSerialiser(read_only=True, many=True)
+    tags = CachedTagsField()
     author = UserSerializer(read_only=True)
     ingredients = RecipeIngredientSerializer(read_only=True, many=True,
                                              source='recipe_ingredients')
     is_favorited = SerializerMethodField()
     is_in_shopping_cart = SerializerMethodField()
-    image = Base64ImageField(required=False)
+    image = ImageVariantField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'author', 'tags', 'ingredients',
                   'is_favorited', 'is_in_shopping_cart',
                   'image', 'text', 'cooking_time')
+        list_serializer_class = RecipeListSerializer
 
-    def get_is_favorited(self, obj):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._tags = None
+
+    def to_representation(self, recipe):
+        """ Словарь рецепта, собранный напрямую из подгруженных объектов.
+
+        Повторяет вывод полей сериализатора (порядок ключей и типы
+        значений), но без обхода полей DRF, на который уходила большая
+        часть времени ответа списка рецептов."""
         request = self.context.get('request')
-        if request.user.is_anonymous:
+        membership = get_membership(request)
+        if self._tags is None:
+            self._tags = tag_cache.by_id()
+        attach_tag_ids([recipe])
+        author = recipe.author
+        if hasattr(author, 'is_subscribed'):
+            is_subscribed = author.is_subscribed
+        else:
+            is_subscribed = membership is not None and membership.contains(
+                'follows', author.id)
+        return {
+            'id': recipe.id,
+            'name': recipe.name,
+            'author': {
+                'email': author.email,
+                'id': author.id,
+                'username': author.username,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'is_subscribed': is_subscribed,
+            },
+            'tags': [self._tags[pk] for pk in recipe.tag_ids
+                     if pk in self._tags],
+            'ingredients': [{
+                'id': row.ingredient.id,
+                'name': row.ingredient.name,
+                'measurement_unit': row.ingredient.measurement_unit,
+                'amount': row.amount,
+            } for row in recipe.recipe_ingredients.all()],
+            'is_favorited': self.get_is_favorited(recipe),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(recipe),
+            'image': image_url(recipe,
+                               self.context.get('image_variant', 'full'),
+                               request),
+            'text': recipe.text,
+            'cooking_time': recipe.cooking_time,
+        }
+
+    def get_is_favorited(self, obj):
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
             return False
-        return Favorite.objects.filter(
-            recipe=obj, user=request.user).exists()
+        return membership.contains('favorites', obj.id)
 
     def get_is_in_shopping_cart(self, obj):
-        request = self.context.get('request')
-        if request.user.is_anonymous:
+        membership = get_membership(self.context.get('request'))
+        if membership is None:
             return False
-        return ShoppingList.objects.filter(
-            recipe=obj, user=request.user
-        ).exists()
+        return membership.contains('cart', obj.id)
 
 
 class RecipeCreateSerializer(ModelSerializer):
@@ -180,15 +297,24 @@ class RecipeCreateSerializer(ModelSerializer):
                   'ingredients', 'text', 'cooking_time')
 
     def validate(self, data):
-        ingredients_list = []
-        for ingredient in data.get('recipe_ingredients'):
+        ingredients = data.get('recipe_ingredients')
+        if ingredients is None:
+            return data
+        ingredient_ids = set()
+        for ingredient in ingredients:
             if int(ingredient.get('amount')) < 1:
                 raise ValidationError(
                     'Количество ингредиента должно быть больше 0')
-            if ingredient.get('id') in ingredients_list:
+            if ingredient.get('id') in ingredient_ids:
                 raise ValidationError(
                     'Есть одинаковые ингредиенты!')
-            ingredients_list.append(ingredient.get('id'))
+            ingredient_ids.add(ingredient.get('id'))
+        missing = ingredient_ids - set(Ingredient.objects.filter(
+            id__in=ingredient_ids).values_list('id', flat=True))
+        if missing:
+            raise ValidationError(
+                'Ингредиенты не найдены: '
+                + ', '.join(map(str, sorted(missing))))
         return data
 
     @staticmethod
@@ -212,22 +338,76 @@ class RecipeCreateSerializer(ModelSerializer):
                                        **validated_data)
         recipe.tags.set(tags)
         self.create_ingredients(recipe, ingredients)
+        build_image_variants(recipe)
         return recipe
 
+    @staticmethod
+    def update_ingredients(recipe, ingredients):
+        """ Приводит ингредиенты рецепта к списку ingredients, изменяя
+        только отличающиеся строки. Возвращает изменения количества:
+        словарь id ингредиента -> разница, пустой, если изменений нет."""
+        current = {row.ingredient_id: row
+                   for row in recipe.recipe_ingredients.all()}
+        to_create = []
+        to_update = []
+        deltas = {}
+        for ingredient_data in ingredients:
+            ingredient_id = ingredient_data.get('id')
+            amount = ingredient_data.get('amount')
+            row = current.pop(ingredient_id, None)
+            if row is None:
+                to_create.append(RecipeIngredient(
+                    ingredient_id=ingredient_id,
+                    amount=amount,
+                    recipe=recipe,
+                ))
+                deltas[ingredient_id] = amount
+            elif row.amount != amount:
+                deltas[ingredient_id] = amount - row.amount
+                row.amount = amount
+                to_update.append(row)
+        for row in current.values():
+            deltas[row.ingredient_id] = -row.amount
+        if current:
+            # post_delete отправляется для каждой строки, но обработчик
+            # не сбрасывает корзины и не обновляет рецепт: update делает
+            # это один раз для всего рецепта.
+            with recipe_ingredients_update(recipe.id):
+                RecipeIngredient.objects.filter(
+                    id__in=[row.id for row in current.values()]).delete()
+        if to_update:
+            RecipeIngredient.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            RecipeIngredient.objects.bulk_create(to_create)
+        return deltas
+
     @transaction.atomic
     def update(self, instance, validated_data):
-        tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('recipe_ingredients')
-        instance.tags.clear()
-        instance.tags.set(tags)
-        RecipeIngredient.objects.filter(recipe=instance).delete()
-        super().update(instance, validated_data)
-        self.create_ingredients(instance, ingredients)
+        tags = validated_data.pop('tags', None)
+        ingredients = validated_data.pop('recipe_ingredients', None)
+        changed_fields = [
+            field for field, value in validated_data.items()
+            if field == 'image' or getattr(instance, field) != value]
+        for field in changed_fields:
+            setattr(instance, field, validated_data[field])
+        ingredient_deltas = (self.update_ingredients(instance, ingredients)
+                             if ingredients is not None else {})
+        ingredients_changed = bool(ingredient_deltas)
+        if changed_fields or ingredients_changed:
+            instance.save(update_fields=[*changed_fields, 'updated_at'])
+        if tags is not None:
+            instance.tags.set(tags)
+        if 'image' in changed_fields:
+            build_image_variants(instance)
+        if ingredients_changed:
+            change_recipe(instance.id, ingredient_deltas)
+            invalidate_recipe_shopping_carts(instance.id)
         return instance
 
     def to_representation(self, instance):
+        recipe = Recipe.objects.with_related().get(id=instance.id)
         return RecipeReadSerializer(
-            instance, context={'request': self.context.get('request')}).data
+            recipe, context={'request': self.context.get('request')}).data
 
 
 class FavoriteSerializer(ModelSerializer):
@@ -263,3 +443,15 @@ class ShoppingListSerializer(ModelSerializer):
         return RecipeFavoriteSerializer(
             instance.recipe,
             context={'request': self.context.get('request')}).data
+
+
+class BulkIdsSerializer(Serializer):
+    """ Сериализатор списка id для пакетных операций."""
+    ids = ListField(child=IntegerField(min_value=1), allow_empty=False,
+                    max_length=BULK_MAX_ITEMS)
+
+
+class BulkResultSerializer(Serializer):
+    """ Сериализатор результата пакетной операции для одного id."""
+    id = IntegerField()
+    status = CharField()
@@ -0,0 +1,210 @@
+import contextvars
+from contextlib import contextmanager
+
+from django.db import transaction
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete, pre_save)
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from .authentication import token_cache
+from .cache import (delete_shopping_carts, ingredient_cache,
+                    invalidate_all_shopping_carts,
+                    invalidate_recipe_shopping_carts, invalidate_shopping_cart,
+                    tag_cache)
+from .conditional import mark_deleted
+from .response_cache import POPULARITY, RECIPES, bump_generation
+from recipes.aggregates import add_recipes, remove_recipes
+from recipes.counters import COUNTERS, change_counter
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from recipes.signals import ingredients_loaded, shopping_totals_rebuilt
+from recipes.storage import (add_references, image_files, recipe_files,
+                             remove_references)
+from users.models import Follow, User
+
+AUTHOR_FIELDS = {'username', 'first_name', 'last_name', 'email'}
+IMAGE_FIELDS = {'image', 'image_variants'}
+
+
+@receiver((post_save, post_delete), sender=ShoppingList)
+def shopping_list_changed(sender, instance, **kwargs):
+    invalidate_shopping_cart(instance.user_id)
+
+
+@receiver(shopping_totals_rebuilt)
+def shopping_totals_fixed(sender, user_ids, **kwargs):
+    delete_shopping_carts(user_ids)
+
+
+@receiver(post_save, sender=ShoppingList)
+def cart_recipe_added(sender, instance, created, **kwargs):
+    if created:
+        add_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def cart_recipe_removed(sender, instance, **kwargs):
+    """ Отправляется до удаления, поэтому при каскадном удалении рецепта
+    его ингредиенты еще можно вычесть из корзины."""
+    remove_recipes(instance.user_id, [instance.recipe_id])
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_save, sender=Follow)
+@receiver(post_save, sender=Recipe)
+def counted_object_created(sender, instance, created, **kwargs):
+    if created:
+        _, field, _ = COUNTERS[sender]
+        change_counter(sender, [getattr(instance, field)], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingList)
+@receiver(post_delete, sender=Follow)
+@receiver(post_delete, sender=Recipe)
+def counted_object_deleted(sender, instance, **kwargs):
+    _, field, _ = COUNTERS[sender]
+    change_counter(sender, [getattr(instance, field)], -1)
+
+
+# Рецепт, ингредиенты которого меняет recipe_ingredients_update.
+updating_recipe = contextvars.ContextVar('updating_recipe', default=None)
+
+
+@contextmanager
+def recipe_ingredients_update(recipe_id):
+    """ Изменение нескольких ингредиентов рецепта: сигналы строк
+    не обновляют рецепт и корзины, вызывающий код делает это один раз."""
+    token = updating_recipe.set(recipe_id)
+    try:
+        yield
+    finally:
+        updating_recipe.reset(token)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    if instance.recipe_id == updating_recipe.get():
+        return
+    invalidate_recipe_shopping_carts(instance.recipe_id)
+    Recipe.objects.filter(id=instance.recipe_id).update(
+        updated_at=timezone.now())
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        recipes = Recipe.objects.filter(id=instance.id)
+    elif action == 'pre_clear':
+        recipes = Recipe.objects.filter(tags=instance)
+    else:
+        recipes = Recipe.objects.filter(id__in=pk_set)
+    recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Recipe)
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def versioned_object_deleted(sender, instance, **kwargs):
+    mark_deleted(sender)
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None, **kwargs):
+    """ Изменение данных автора меняет представление его рецептов."""
+    if created or (update_fields and not AUTHOR_FIELDS & set(update_fields)):
+        return
+    instance.recipes.update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender=Token)
+def token_deleted(sender, instance, **kwargs):
+    key = instance.key
+    transaction.on_commit(lambda: token_cache.invalidate(key))
+
+
+@receiver(post_save, sender=User)
+def user_credentials_changed(sender, instance, created, update_fields=None,
+                             **kwargs):
+    """ Смена пароля, деактивация и любые другие изменения пользователя
+    сбрасывают его токены в кеше аутентификации; при удалении
+    пользователя токены удаляются каскадом и сбрасываются token_deleted."""
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    keys = list(Token.objects.filter(user_id=instance.pk).values_list(
+        'key', flat=True))
+    if keys:
+        transaction.on_commit(lambda: token_cache.invalidate(*keys))
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, instance, **kwargs):
+    invalidate_all_shopping_carts()
+    ingredient_cache.invalidate()
+
+
+@receiver(ingredients_loaded)
+def ingredients_bulk_loaded(sender, **kwargs):
+    ingredient_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, instance, **kwargs):
+    tag_cache.invalidate()
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+@receiver((post_save, post_delete), sender=Tag)
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def public_recipes_changed(sender, **kwargs):
+    bump_generation(RECIPES)
+
+
+@receiver((post_save, post_delete), sender=User)
+def public_user_changed(sender, instance, created=False, update_fields=None,
+                        **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    bump_generation(RECIPES)
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+def popularity_changed(sender, **kwargs):
+    bump_generation(POPULARITY)
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_images_saving(sender, instance, update_fields=None, **kwargs):
+    """ Запоминает файлы рецепта до сохранения, чтобы после него
+    изменить счетчики ссылок только у замененных файлов."""
+    if update_fields is not None and not IMAGE_FIELDS & set(update_fields):
+        instance._stored_files = None
+        return
+    previous = None
+    if not instance._state.adding:
+        previous = Recipe.objects.filter(id=instance.id).values_list(
+            'image', 'image_variants').first()
+    instance._stored_files = image_files(*previous) if previous else set()
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_images_saved(sender, instance, **kwargs):
+    previous = getattr(instance, '_stored_files', None)
+    if previous is None:
+        return
+    current = recipe_files(instance)
+    add_references(current - previous)
+    remove_references(previous - current)
+    instance._stored_files = None
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_images_deleted(sender, instance, **kwargs):
+    remove_references(recipe_files(instance))
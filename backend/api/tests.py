@@ -0,0 +1,1312 @@
+import base64
+import re
+import shutil
+import tempfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models.signals import post_delete
+from django.test import (AsyncRequestFactory, Client, RequestFactory,
+                         TestCase, TransactionTestCase, override_settings)
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient
+
+from api.async_views import (AsyncRecipeDetailView, AsyncRecipeListView,
+                             AsyncSubscriptionsView)
+from api.authentication import (CachedTokenAuthentication, TokenCache,
+                                token_cache)
+from api.cache import (check_shared_cache, get_shopping_cart,
+                       invalidation_timeout, tag_cache)
+from api.indexes import ingredient_index
+from api.management.commands.benchmark_api import Samples, cursor_path
+from api.management.commands.benchmark_serializers import (
+    field_representation)
+from api.metrics import registry
+from api.renderers import ORJSONRenderer
+from api.serializers import RecipeReadSerializer
+from foodgram.routers import sticky_key
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingAggregate, ShoppingList, Tag)
+from users.models import Follow, User
+
+
+class RecipeSearchTests(TestCase):
+    """ Поиск по рецептам, созданным после всех миграций: индекс
+    поиска должен обновляться при записи рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password', first_name='Имя', last_name='Фамилия')
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def search(self, query):
+        response = self.client.get('/api/recipes/', {'search': query})
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_new_recipe_is_found(self):
+        recipe = Recipe.objects.create(
+            author=self.author, name='Курица с рисом', text='Запечь.',
+            cooking_time=40)
+        Recipe.objects.create(author=self.author, name='Салат',
+                              text='Нарезать овощи.', cooking_time=10)
+        self.assertEqual(self.search('курица'), [recipe.id])
+
+    def test_edited_recipe_is_found_by_new_name(self):
+        recipe = Recipe.objects.create(author=self.author, name='Суп',
+                                       text='Сварить.', cooking_time=30)
+        recipe.name = 'Борщ'
+        recipe.save()
+        self.assertEqual(self.search('борщ'), [recipe.id])
+        self.assertEqual(self.search('суп'), [])
+
+
+class PopularOrderingETagTests(TestCase):
+    """ ETag списка с ordering=popular меняется, когда избранное
+    других пользователей меняет порядок рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.fan = User.objects.create_user(
+            username='fan', email='fan@example.com', password='password')
+        cls.recipes = [
+            Recipe.objects.create(author=cls.author, name=f'Рецепт {number}',
+                                  text='Текст', cooking_time=5)
+            for number in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_other_users_favorite_changes_etag(self):
+        url = '/api/recipes/?ordering=popular'
+        response = self.client.get(url)
+        etag = response['ETag']
+        self.assertFalse(response.has_header('Last-Modified'))
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        with self.captureOnCommitCallbacks(execute=True):
+            Favorite.objects.create(user=self.fan, recipe=self.recipes[0])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['id'],
+                         self.recipes[0].id)
+
+
+@override_settings(ANONYMOUS_RESPONSE_CACHE_TIMEOUT=0)
+class DeletionVersionTests(TestCase):
+    """ Удаление меняет ETag и Last-Modified списков и после очистки
+    кеша: отметка удаления хранится в базе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.recipes = [
+            Recipe.objects.create(author=author, name=f'Рецепт {number}',
+                                  text='Текст', cooking_time=5)
+            for number in range(2)]
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag-{number}')
+                    for number in range(2)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_changed_after_delete(self, url, obj):
+        response = self.client.get(url)
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        later = timezone.now() + timedelta(minutes=1)
+        with mock.patch('django.utils.timezone.now', return_value=later):
+            obj.delete()
+        cache.clear()
+        self.assertEqual(
+            self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+        self.assertEqual(self.client.get(
+            url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 200)
+
+    def test_recipe_list(self):
+        self.assert_changed_after_delete('/api/recipes/', self.recipes[0])
+
+    def test_tag_list(self):
+        self.assert_changed_after_delete('/api/tags/', self.tags[0])
+
+
+class AsyncErrorResponseTests(TestCase):
+    """ Ошибки асинхронных представлений отдаются в JSON с нужными
+    заголовками из ответа обработчика исключений DRF."""
+
+    def setUp(self):
+        cache.clear()
+        self.factory = AsyncRequestFactory()
+
+    async def test_not_found(self):
+        response = await AsyncRecipeDetailView.as_view()(
+            self.factory.get('/api/recipes/0/'), pk=0)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertIn('detail', response.content.decode())
+
+    async def test_not_authenticated(self):
+        response = await AsyncSubscriptionsView.as_view()(
+            self.factory.get('/api/users/subscriptions/'))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+
+class SharedCacheTests(TestCase):
+    """ Кеш в памяти процесса при нескольких процессах сервера."""
+
+    @override_settings(WEB_CONCURRENCY=4)
+    def test_local_cache_with_workers_is_an_error(self):
+        self.assertEqual([error.id for error in check_shared_cache()],
+                         ['api.E001'])
+
+    def test_local_cache_with_replicas_is_a_warning(self):
+        with mock.patch('api.cache.get_replicas',
+                        return_value=['replica_1']):
+            self.assertEqual([error.id for error in check_shared_cache()],
+                             ['api.W001'])
+
+    @override_settings(WEB_CONCURRENCY=1, LOCAL_CACHE_TIMEOUT=7)
+    def test_local_cache_entries_expire(self):
+        self.assertEqual(check_shared_cache(), [])
+        self.assertEqual(invalidation_timeout(), 7)
+
+    @override_settings(WEB_CONCURRENCY=4, CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}})
+    def test_shared_cache_entries_live_until_invalidated(self):
+        self.assertEqual(check_shared_cache(), [])
+        self.assertIsNone(invalidation_timeout())
+
+
+class ShoppingCartCacheTests(TestCase):
+    """ Корзина в LocMemCache устаревает, даже если сброс прошел
+    в другом процессе."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='password')
+        ingredient = Ingredient.objects.create(name='Мука',
+                                               measurement_unit='г')
+        ShoppingAggregate.objects.create(user=cls.user, ingredient=ingredient,
+                                         total_amount=100)
+
+    def setUp(self):
+        cache.clear()
+
+    def change_in_other_process(self):
+        ShoppingAggregate.objects.filter(user=self.user).update(
+            total_amount=200)
+
+    def test_cart_is_cached_until_timeout(self):
+        self.assertEqual(get_shopping_cart(self.user), [('Мука', 'г', 100)])
+        self.change_in_other_process()
+        self.assertEqual(get_shopping_cart(self.user), [('Мука', 'г', 100)])
+
+    def test_rebuild_resets_fixed_carts(self):
+        get_shopping_cart(self.user)
+        self.change_in_other_process()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('rebuild_shopping_aggregates', stdout=StringIO())
+        self.assertEqual(get_shopping_cart(self.user), [])
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=0)
+    def test_expired_cart_is_reloaded(self):
+        get_shopping_cart(self.user)
+        self.change_in_other_process()
+        self.assertEqual(get_shopping_cart(self.user), [('Мука', 'г', 200)])
+
+
+class AnonymousResponseCacheTests(TestCase):
+    """ Поколения кеша ответов в LocMemCache устаревают, даже если
+    их увеличил другой процесс."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.recipe = Recipe.objects.create(author=author, name='Каша',
+                                           text='Сварить.', cooking_time=20)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def get_name(self):
+        response = self.client.get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()['name']
+
+    def change_in_other_process(self):
+        Recipe.objects.filter(id=self.recipe.id).update(name='Омлет')
+
+    def test_response_is_cached(self):
+        self.assertEqual(self.get_name(), 'Каша')
+        self.change_in_other_process()
+        self.assertEqual(self.get_name(), 'Каша')
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=0)
+    def test_expired_generation_is_not_served(self):
+        self.get_name()
+        self.change_in_other_process()
+        self.assertEqual(self.get_name(), 'Омлет')
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'test_response_cache',
+}})
+class AsyncAnonymousResponseCacheTests(TestCase):
+    """ Кеш ответов под ASGI с DatabaseCache: синхронные вызовы кеша
+    в цикле событий запрещены."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.recipe = Recipe.objects.create(author=author, name='Каша',
+                                           text='Сварить.', cooking_time=20)
+
+    def setUp(self):
+        call_command('createcachetable', verbosity=0)
+        cache.clear()
+
+    async def test_response_is_cached(self):
+        path = f'/api/recipes/{self.recipe.id}/'
+        response = await self.async_client.get(path)
+        self.assertEqual(response.status_code, 200)
+        await Recipe.objects.filter(id=self.recipe.id).aupdate(name='Омлет')
+        response = await self.async_client.get(path)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['name'], 'Каша')
+
+
+@override_settings(CACHES={'default': {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'test_routing_cache',
+}})
+class AsyncReplicaRoutingTests(TestCase):
+    """ Привязка к основной базе после записи под ASGI с DatabaseCache."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.recipe = Recipe.objects.create(author=cls.user, name='Каша',
+                                           text='Сварить.', cooking_time=20)
+
+    def setUp(self):
+        call_command('createcachetable', verbosity=0)
+        cache.clear()
+        patcher = mock.patch('foodgram.routers.get_replicas',
+                             return_value=['default'])
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def test_write_makes_user_sticky(self):
+        authorization = f'Token {self.token.key}'
+        response = await self.async_client.post(
+            f'/api/recipes/{self.recipe.id}/favorite/',
+            headers={'Authorization': authorization})
+        self.assertEqual(response.status_code, 201)
+        key = sticky_key(RequestFactory().get(
+            '/', HTTP_AUTHORIZATION=authorization))
+        self.assertIs(await cache.aget(key), True)
+
+
+class IngredientIndexTests(TestCase):
+    """ Индекс ингредиентов процесса перестраивается, когда версия
+    справочника в LocMemCache устаревает."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.ingredient = Ingredient.objects.create(name='Мука',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, query):
+        return [item['id'] for item in ingredient_index.search(query)]
+
+    def change_in_other_process(self):
+        Ingredient.objects.filter(id=self.ingredient.id).update(
+            name='Сахар')
+
+    def test_index_is_kept_until_timeout(self):
+        self.assertEqual(self.search('му'), [self.ingredient.id])
+        self.change_in_other_process()
+        self.assertEqual(self.search('са'), [])
+
+    @override_settings(LOCAL_CACHE_TIMEOUT=0)
+    def test_index_is_rebuilt_after_timeout(self):
+        self.assertEqual(self.search('му'), [self.ingredient.id])
+        self.change_in_other_process()
+        self.assertEqual(self.search('са'), [self.ingredient.id])
+
+
+class RecipeIngredientsUpdateTests(TestCase):
+    """ Изменение ингредиентов рецепта выполняет одинаковое число
+    запросов независимо от количества удаленных строк."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {number}',
+                                      measurement_unit='г')
+            for number in range(6)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(self.author)
+
+    def create_recipe(self, ingredient_count):
+        recipe = Recipe.objects.create(author=self.author, name='Рецепт',
+                                       text='Текст', cooking_time=5)
+        RecipeIngredient.objects.bulk_create(
+            RecipeIngredient(recipe=recipe, ingredient=ingredient, amount=10)
+            for ingredient in self.ingredients[:ingredient_count])
+        ShoppingList.objects.create(user=self.author, recipe=recipe)
+        return recipe
+
+    def keep_first_ingredient(self, recipe):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/',
+                {'ingredients': [{'id': self.ingredients[0].id,
+                                  'amount': 20}]},
+                format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(item['id'], item['amount'])
+             for item in response.json()['ingredients']],
+            [(self.ingredients[0].id, 20)])
+        return len(queries)
+
+    def test_removed_rows_do_not_add_queries(self):
+        self.keep_first_ingredient(self.create_recipe(1))
+        few = self.keep_first_ingredient(self.create_recipe(2))
+        many = self.keep_first_ingredient(self.create_recipe(6))
+        self.assertEqual(few, many)
+
+    def test_removed_rows_send_post_delete(self):
+        recipe = self.create_recipe(3)
+        deleted = []
+
+        def collect(sender, instance, **kwargs):
+            deleted.append(instance.ingredient_id)
+
+        post_delete.connect(collect, sender=RecipeIngredient)
+        self.addCleanup(post_delete.disconnect, collect,
+                        sender=RecipeIngredient)
+        self.keep_first_ingredient(recipe)
+        self.assertCountEqual(
+            deleted, [ingredient.id for ingredient in self.ingredients[1:3]])
+
+    def test_cached_cart_is_reset_after_commit(self):
+        recipe = self.create_recipe(2)
+        self.assertEqual(len(get_shopping_cart(self.author)), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.keep_first_ingredient(recipe)
+            self.assertEqual(len(get_shopping_cart(self.author)), 2)
+        self.assertEqual(get_shopping_cart(self.author),
+                         [('Ингредиент 0', 'г', 20)])
+
+    def test_cart_totals_follow_removed_rows(self):
+        recipe = self.create_recipe(3)
+        self.keep_first_ingredient(recipe)
+        self.assertEqual(
+            list(ShoppingAggregate.objects.filter(
+                user=self.author).values_list('ingredient_id',
+                                              'total_amount')),
+            [(self.ingredients[0].id, 20)])
+
+
+class RecipeImageTests(TestCase):
+    """ Проверка размера изображения рецепта и WebP-варианты после
+    создания и изменения рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.author)
+        cls.tag = Tag.objects.create(name='Обед', color='#000000',
+                                     slug='lunch')
+        cls.ingredient = Ingredient.objects.create(name='Соль',
+                                                   measurement_unit='г')
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @staticmethod
+    def image(width, height, color='red'):
+        buffer = BytesIO()
+        Image.new('RGB', (width, height), color).save(buffer, format='PNG')
+        return ('data:image/png;base64,'
+                + base64.b64encode(buffer.getvalue()).decode())
+
+    def create_recipe(self, image):
+        return self.client.post('/api/recipes/', {
+            'name': 'Рецепт', 'text': 'Текст', 'cooking_time': 5,
+            'tags': [self.tag.id],
+            'ingredients': [{'id': self.ingredient.id, 'amount': 10}],
+            'image': image}, format='json')
+
+    def assert_variants(self, recipe):
+        self.assertEqual(set(recipe.image_variants),
+                         set(settings.RECIPE_IMAGE_VARIANTS))
+        for variant, size in settings.RECIPE_IMAGE_VARIANTS.items():
+            with self.subTest(variant=variant):
+                name = recipe.image_variants[variant]
+                self.assertTrue(default_storage.exists(name))
+                with default_storage.open(name) as file, \
+                        Image.open(file) as image:
+                    self.assertEqual(image.format, 'WEBP')
+                    self.assertLessEqual(image.width, size[0])
+                    self.assertLessEqual(image.height, size[1])
+
+    @override_settings(RECIPE_IMAGE_MAX_BYTES=100)
+    def test_payload_over_max_bytes_is_rejected_before_decoding(self):
+        with mock.patch('api.fields.sanitize_image') as sanitize:
+            response = self.create_recipe(self.image(200, 200))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('100 байт', response.json()['image'][0])
+        sanitize.assert_not_called()
+        self.assertFalse(Recipe.objects.exists())
+
+    @override_settings(RECIPE_IMAGE_MAX_PIXELS=100)
+    def test_image_over_max_pixels_is_rejected(self):
+        response = self.create_recipe(self.image(20, 20))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('100 пикселей', response.json()['image'][0])
+        self.assertFalse(Recipe.objects.exists())
+
+    def test_variants_exist_after_create_and_update(self):
+        response = self.create_recipe(self.image(2000, 1000))
+        self.assertEqual(response.status_code, 201)
+        recipe = Recipe.objects.get(id=response.json()['id'])
+        self.assert_variants(recipe)
+        created = recipe.image_variants
+        response = self.client.patch(
+            f'/api/recipes/{recipe.id}/',
+            {'image': self.image(400, 300, 'blue')}, format='json')
+        self.assertEqual(response.status_code, 200)
+        recipe.refresh_from_db()
+        self.assert_variants(recipe)
+        self.assertFalse(set(created.values())
+                         & set(recipe.image_variants.values()))
+
+
+class InvalidationAfterCommitTests(TestCase):
+    """ Кеши сбрасываются после фиксации транзакции, а не внутри нее."""
+
+    def setUp(self):
+        cache.clear()
+
+    def test_reference_cache_is_reset_after_commit(self):
+        self.assertEqual(tag_cache.all(), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Tag.objects.create(name='Завтрак', color='#FFAA00',
+                               slug='breakfast')
+            self.assertEqual(tag_cache.all(), [])
+        self.assertEqual([tag['slug'] for tag in tag_cache.all()],
+                         ['breakfast'])
+
+    def test_shopping_cart_is_reset_after_commit(self):
+        user = User.objects.create_user(
+            username='buyer', email='buyer@example.com', password='password')
+        recipe = Recipe.objects.create(author=user, name='Рецепт',
+                                       text='Текст', cooking_time=5)
+        RecipeIngredient.objects.create(
+            recipe=recipe, amount=10, ingredient=Ingredient.objects.create(
+                name='Мука', measurement_unit='г'))
+        self.assertEqual(get_shopping_cart(user), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            ShoppingList.objects.create(user=user, recipe=recipe)
+            self.assertEqual(get_shopping_cart(user), [])
+        self.assertEqual(get_shopping_cart(user), [('Мука', 'г', 10)])
+
+
+class BenchmarkApiTests(TestCase):
+    """ Команда benchmark_api на небольших тестовых данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        call_command('generate_fixture_data', users=20, recipes=30,
+                     ingredients=20, stdout=StringIO())
+
+    def setUp(self):
+        cache.clear()
+
+    def benchmark(self, *only, warmup=0):
+        output = StringIO()
+        call_command('benchmark_api', *[f'--only={name}' for name in only],
+                     iterations=1, warmup=warmup, stdout=output)
+        return output.getvalue()
+
+    def test_queries_are_counted_after_full_query_log(self):
+        connection.queries_log.extend([{}] * connection.queries_log.maxlen)
+        output = self.benchmark('recipes-detail')
+        self.assertRegex(output, r'запросов к базе [1-9]')
+
+    def test_empty_list_fails(self):
+        with mock.patch('api.management.commands.benchmark_api.Command.'
+                        'result_count', return_value=0):
+            with self.assertRaisesMessage(CommandError, 'пустой ответ'):
+                self.benchmark('recipes-list search')
+
+    def test_search_finds_sample_recipe(self):
+        self.assertIn('recipes-list search GET',
+                      self.benchmark('recipes-list search'))
+
+    def test_ingredient_index_is_compared_with_orm(self):
+        output = self.benchmark('ingredients-list')
+        self.assertIn('ingredients-list GET', output)
+        self.assertRegex(output, r'ingredients-list INDEX .* запросов '
+                                 r'к базе 0\n')
+        self.assertRegex(output, r'ingredients-list ORM .* запросов '
+                                 r'к базе 2\n')
+
+    def test_deep_cursor_is_compared_with_deep_page(self):
+        output = self.benchmark('recipes-list deep', warmup=1)
+        samples = Samples()
+        page = self.client.get('/api/recipes/',
+                               {'page': samples.deep_page}).json()
+        cursor = self.client.get(
+            cursor_path('/api/recipes/', samples.deep_recipe)).json()
+        self.assertEqual([recipe['id'] for recipe in cursor['results']],
+                         [recipe['id'] for recipe in page['results']])
+        queries = dict(re.findall(
+            r'deep (page|cursor) GET .* запросов к базе (\d+)', output))
+        # Курсор обходится без COUNT(*) по всему списку.
+        self.assertEqual(int(queries['cursor']), int(queries['page']) - 1)
+
+    def test_token_miss_is_measured(self):
+        with mock.patch.object(token_cache, 'delete',
+                               wraps=token_cache.delete) as delete:
+            output = self.benchmark('user-me')
+        self.assertIn('user-me GET', output)
+        self.assertIn('user-me token-miss GET', output)
+        delete.assert_called_once()
+
+
+class ConcurrentBenchmarkApiTests(TransactionTestCase):
+    """ benchmark_api с параллельными запросами: потоки видят только
+    зафиксированные данные, поэтому транзакции не откатываются."""
+
+    def setUp(self):
+        cache.clear()
+        call_command('generate_fixture_data', users=20, recipes=30,
+                     ingredients=20, stdout=StringIO())
+
+    def test_concurrent_run_skips_changing_endpoints(self):
+        output = StringIO()
+        call_command('benchmark_api', '--only=recipes-detail',
+                     '--only=recipes-favorite', iterations=4, warmup=1,
+                     concurrency=2, stdout=output)
+        self.assertIn('recipes-detail GET', output.getvalue())
+        self.assertIn('запросов/с', output.getvalue())
+        self.assertNotIn('recipes-favorite', output.getvalue())
+
+    def test_running_server_is_requested_over_http(self):
+        client = Client()
+
+        def request(method, url, data=None, headers=None):
+            return client.generic(method, url.removeprefix('http://api'),
+                                  data or '', **{
+                                      f'HTTP_{name.upper()}': value
+                                      for name, value in headers.items()})
+
+        output = StringIO()
+        with mock.patch('requests.Session.request', autospec=True,
+                        side_effect=lambda session, *args, **kwargs:
+                        request(*args, **kwargs)):
+            call_command('benchmark_api', '--only=recipes-detail',
+                         iterations=1, warmup=0, base_url='http://api/',
+                         stdout=output)
+        self.assertRegex(output.getvalue(),
+                         r'recipes-detail GET .*запросов к базе -')
+
+
+class TokenCacheTests(TestCase):
+    """ Кеш токенов аутентификации."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password', first_name='Имя')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        cache.clear()
+        token_cache.clear()
+
+    def authenticate(self):
+        return CachedTokenAuthentication().authenticate_credentials(
+            self.token.key)
+
+    def test_only_credentials_are_cached(self):
+        self.authenticate()
+        _, data = token_cache.get(self.token.key)
+        self.assertNotIn(self.user.password, repr(data))
+        self.assertNotIn('Имя', repr(data))
+        with self.assertNumQueries(0):
+            user, _ = self.authenticate()
+            self.assertEqual((user.pk, user.username, user.is_active),
+                             (self.user.pk, 'reader', True))
+
+    def test_reset_reaches_other_processes(self):
+        self.authenticate()
+        other_process = TokenCache()
+        other_process.set_local(self.token.key,
+                                token_cache.get(self.token.key)[1])
+        self.assertIsNotNone(other_process.get(self.token.key)[1])
+        token_cache.invalidate(self.token.key)
+        self.assertIsNone(other_process.get(self.token.key)[1])
+
+    def test_deleted_user_is_rejected(self):
+        self.authenticate()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.filter(pk=self.user.pk).delete()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    @override_settings(TOKEN_CACHE_SHARED_TIMEOUT=60)
+    def test_cache_is_read_once_per_request(self):
+        calls = []
+        get_many = cache.get_many
+
+        def count_get_many(keys):
+            calls.append(keys)
+            return get_many(keys)
+
+        with mock.patch.object(cache, 'get_many', count_get_many):
+            with self.assertNumQueries(1):
+                self.authenticate()
+            token_cache.clear()
+            with self.assertNumQueries(0):
+                self.authenticate()
+            with self.assertNumQueries(0):
+                self.authenticate()
+        self.assertEqual([len(keys) for keys in calls], [2, 2, 1])
+
+    def test_deactivated_user_is_rejected(self):
+        self.authenticate()
+        user = User.objects.get(pk=self.user.pk)
+        user.is_active = False
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_current_user_is_loaded_once(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        client.get('/api/users/me/')
+        # Имя и фамилия одним запросом и подписка на себя.
+        with self.assertNumQueries(2):
+            response = client.get('/api/users/me/')
+        self.assertEqual(response.json()['first_name'], 'Имя')
+
+
+class MetricsTests(TestCase):
+    """ Доступ к /api/metrics и замеры сериализации и рендеринга ответа."""
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(METRICS_TOKEN='')
+    def test_disabled_without_token(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 404)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get('/api/metrics').status_code, 401)
+        self.assertEqual(self.client.get(
+            '/api/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code,
+            401)
+        self.client.get('/api/tags/')
+        response = self.client.get('/api/metrics',
+                                   HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('foodgram_render_duration_seconds_count'
+                      '{view="TagViewSet.list"}',
+                      response.content.decode())
+
+    @override_settings(SERVER_TIMING=True)
+    def test_server_timing_reports_render(self):
+        response = self.client.get('/api/tags/')
+        self.assertIn('render;dur=', response['Server-Timing'])
+
+    @override_settings(SERVER_TIMING=True, METRICS_TOKEN='secret',
+                       ANONYMOUS_RESPONSE_CACHE_TIMEOUT=0)
+    def test_serializer_time_is_reported_per_view(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        Recipe.objects.create(author=author, name='Каша', text='Сварить.',
+                              cooking_time=20)
+        registry.reset()
+        timings = []
+        with mock.patch('api.metrics.RequestTiming.finish', autospec=True,
+                        side_effect=timings.append):
+            response = self.client.get('/api/recipes/')
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+        self.assertGreater(timings[0].serialize_time, 0)
+        metrics = self.client.get('/api/metrics',
+                                  HTTP_AUTHORIZATION='Bearer secret')
+        self.assertIn('foodgram_serialize_duration_seconds_count'
+                      '{view="RecipeViewSet.list"} 1',
+                      metrics.content.decode())
+
+
+@override_settings(ANONYMOUS_RESPONSE_CACHE_TIMEOUT=0)
+class RecipeQueryCountTests(TestCase):
+    """ Количество запросов к базе у списка и страницы рецепта не
+    зависит от числа рецептов, тегов и ингредиентов. Первый запрос
+    заполняет кеши справочников и токенов, считается второй."""
+
+    @classmethod
+    def setUpTestData(cls):
+        authors = [User.objects.create_user(
+            username=f'author{number}', email=f'author{number}@example.com',
+            password='password') for number in range(3)]
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        tags = [Tag.objects.create(name=f'Тег {number}',
+                                   color=f'#00000{number}',
+                                   slug=f'tag-{number}')
+                for number in range(3)]
+        ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент {number}', measurement_unit='г')
+            for number in range(4)]
+        for number in range(8):
+            recipe = Recipe.objects.create(
+                author=authors[number % 3], name=f'Рецепт {number}',
+                text='Текст', cooking_time=5)
+            recipe.tags.set(tags[:number % 3 + 1])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=10)
+                for ingredient in ingredients[:number % 4 + 1])
+        cls.recipe = recipe
+        Favorite.objects.create(user=cls.user, recipe=recipe)
+        ShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assert_queries(self, count, path):
+        self.assertEqual(self.client.get(path).status_code, 200)
+        with self.assertNumQueries(count):
+            self.assertEqual(self.client.get(path).status_code, 200)
+
+    def authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def test_list_anonymous(self):
+        self.assert_queries(5, '/api/recipes/')
+
+    def test_list_authenticated(self):
+        self.authenticate()
+        self.assert_queries(8, '/api/recipes/')
+
+    def test_detail_anonymous(self):
+        self.assert_queries(4, f'/api/recipes/{self.recipe.id}/')
+
+    def test_detail_authenticated(self):
+        self.authenticate()
+        self.assert_queries(7, f'/api/recipes/{self.recipe.id}/')
+
+
+class MembershipTests(TestCase):
+    """ is_favorited, is_in_shopping_cart и is_subscribed: один запрос
+    на вид связи для всей страницы, с MEMBERSHIP_CACHE_TIMEOUT - ни
+    одного, пока множество не сброшено записью."""
+
+    MEMBERSHIP_TABLES = (Favorite._meta.db_table,
+                         ShoppingList._meta.db_table, Follow._meta.db_table)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        authors = [User.objects.create_user(
+            username=f'author{number}', email=f'author{number}@example.com',
+            password='password') for number in range(6)]
+        cls.recipes = [Recipe.objects.create(
+            author=author, name=f'Рецепт {number}', text='Текст',
+            cooking_time=5) for number, author in enumerate(authors)]
+        for recipe in cls.recipes[1:]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingList.objects.create(user=cls.user, recipe=recipe)
+            Follow.objects.create(user=cls.user, author=recipe.author)
+        cls.free_recipe = cls.recipes[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def membership_queries(self, path):
+        self.assertEqual(self.client.get(path).status_code, 200)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return [query['sql'] for query in queries
+                if query['sql'].startswith(tuple(
+                    f'SELECT "{table}".' for table in self.MEMBERSHIP_TABLES))]
+
+    def test_one_query_per_kind_for_any_page_size(self):
+        for limit in (2, 6):
+            with self.subTest(limit=limit):
+                self.assertEqual(len(self.membership_queries(
+                    f'/api/recipes/?limit={limit}')), 3)
+
+    @override_settings(MEMBERSHIP_CACHE_TIMEOUT=60)
+    def test_cached_sets_are_not_queried(self):
+        for limit in (2, 6):
+            with self.subTest(limit=limit):
+                self.assertEqual(self.membership_queries(
+                    f'/api/recipes/?limit={limit}'), [])
+
+    def get_recipe(self):
+        return self.client.get(f'/api/recipes/{self.free_recipe.id}/').json()
+
+    def assert_invalidated(self, action, field):
+        path = f'/api/recipes/{self.free_recipe.id}/{action}/'
+        self.assertFalse(self.get_recipe()[field])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post(path).status_code, 201)
+        self.assertTrue(self.get_recipe()[field])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.delete(path).status_code, 204)
+        self.assertFalse(self.get_recipe()[field])
+
+    @override_settings(MEMBERSHIP_CACHE_TIMEOUT=60)
+    def test_favorite_resets_cached_set(self):
+        self.assert_invalidated('favorite', 'is_favorited')
+
+    @override_settings(MEMBERSHIP_CACHE_TIMEOUT=60)
+    def test_shopping_cart_resets_cached_set(self):
+        self.assert_invalidated('shopping_cart', 'is_in_shopping_cart')
+
+
+class SubscriptionsQueryCountTests(TestCase):
+    """ Лента подписок: число запросов не зависит от количества авторов,
+    recipes_limit ограничивает рецепты каждого автора отдельно."""
+
+    PATH = '/api/users/subscriptions/?limit=10&recipes_limit=2'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.authors = [User.objects.create_user(
+            username=f'author{number}', email=f'author{number}@example.com',
+            password='password') for number in range(8)]
+        Recipe.objects.bulk_create(
+            Recipe(author=author, name=f'Рецепт {number}', text='Текст',
+                   cooking_time=5)
+            for author in cls.authors for number in range(4))
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def follow(self, authors):
+        Follow.objects.bulk_create(Follow(user=self.user, author=author)
+                                   for author in authors)
+
+    def get_feed(self):
+        self.assertEqual(self.client.get(self.PATH).status_code, 200)
+        # COUNT(*), страница авторов и их рецепты одним запросом.
+        with self.assertNumQueries(3):
+            response = self.client.get(self.PATH)
+        self.assertEqual(response.status_code, 200)
+        return response.json()['results']
+
+    def test_queries_do_not_depend_on_feed_size(self):
+        self.follow(self.authors[:2])
+        self.assertEqual(len(self.get_feed()), 2)
+        self.follow(self.authors[2:])
+        self.assertEqual(len(self.get_feed()), 8)
+
+    def test_recipes_limit_is_applied_per_author(self):
+        self.follow(self.authors)
+        for author in self.get_feed():
+            latest = list(Recipe.objects.filter(
+                author_id=author['id']).order_by('-id').values_list(
+                'id', flat=True)[:2])
+            with self.subTest(author=author['id']):
+                self.assertEqual(
+                    [recipe['id'] for recipe in author['recipes']], latest)
+
+
+class RecipeTagFilterTests(TestCase):
+    """ Фильтр по нескольким тегам не размножает рецепты и ищет связи
+    рецептов с тегами по индексу."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.tags = [Tag.objects.create(name=f'Тег {number}',
+                                       color=f'#00000{number}',
+                                       slug=f'tag-{number}')
+                    for number in range(3)]
+        cls.both = Recipe.objects.create(author=author, name='Оба тега',
+                                         text='Текст', cooking_time=5)
+        cls.both.tags.set(cls.tags[:2])
+        cls.first = Recipe.objects.create(author=author, name='Первый тег',
+                                          text='Текст', cooking_time=5)
+        cls.first.tags.set(cls.tags[:1])
+        cls.other = Recipe.objects.create(author=author, name='Другой тег',
+                                          text='Текст', cooking_time=5)
+        cls.other.tags.set(cls.tags[2:])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def filter(self, **params):
+        params['tags'] = [tag.slug for tag in self.tags[:2]]
+        response = self.client.get('/api/recipes/', params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data['count'], len(data['results']))
+        return [recipe['id'] for recipe in data['results']]
+
+    def test_any_tag_without_duplicates(self):
+        self.assertEqual(self.filter(), [self.first.id, self.both.id])
+
+    def test_all_tags(self):
+        self.assertEqual(self.filter(tags_mode='all'), [self.both.id])
+
+    @skipUnless(connection.vendor == 'sqlite',
+                'план запроса проверяется для SQLite')
+    def test_tags_are_searched_by_index(self):
+        for mode in ('any', 'all'):
+            with self.subTest(tags_mode=mode), \
+                    CaptureQueriesContext(connection) as queries:
+                self.filter(tags_mode=mode)
+            sql = next(query['sql'] for query in queries
+                       if 'recipes_recipe_tags' in query['sql']
+                       and 'COUNT' not in query['sql'])
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+            tag_steps = [step for step in plan
+                         if 'recipes_recipe_tags' in step or ' U0 ' in step]
+            self.assertTrue(tag_steps, plan)
+            for step in tag_steps:
+                self.assertIn('INDEX', step, plan)
+                self.assertFalse(step.startswith('SCAN'), plan)
+            self.assertFalse(any('DISTINCT' in step for step in plan), plan)
+
+
+class RecipeSerializerGoldenTests(TestCase):
+    """ Быстрый путь RecipeReadSerializer отдает побайтно тот же JSON,
+    что и поля DRF, на наборе рецептов с разными данными."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        authors = [
+            User.objects.create_user(
+                username='author', email='author@example.com',
+                password='password', first_name='Имя', last_name='Фамилия'),
+            User.objects.create_user(
+                username='empty', email='empty@example.com',
+                password='password'),
+        ]
+        Follow.objects.create(user=cls.user, author=authors[0])
+        tags = [Tag.objects.create(name=f'Тег "{number}"',
+                                   color=f'#ABCDE{number}',
+                                   slug=f'tag-{number}')
+                for number in range(3)]
+        ingredients = [Ingredient.objects.create(
+            name=f'Ингредиент \\ {number}', measurement_unit='г')
+            for number in range(3)]
+        images = [
+            {},
+            {'image': 'recipes/images/photo.jpg'},
+            {'image': 'recipes/images/photo.jpg',
+             'image_variants': {'card': 'recipes/images/photo_card.webp'}},
+        ]
+        for number, image in enumerate(images * 2):
+            recipe = Recipe.objects.create(
+                author=authors[number % 2], name=f'Рецепт {number} 🍲',
+                text='Строка\nвторая строка\t"кавычки"',
+                cooking_time=number + 1, **image)
+            recipe.tags.set(tags[:number % 4])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(recipe=recipe, ingredient=ingredient,
+                                 amount=number * 100 + 1)
+                for ingredient in ingredients[:number % 4])
+            if number % 2:
+                Favorite.objects.create(user=cls.user, recipe=recipe)
+            if number % 3:
+                ShoppingList.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        cache.clear()
+
+    def assert_same_output(self, user, image_variant):
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = user
+        context = {'request': request, 'image_variant': image_variant}
+        recipes = list(Recipe.objects.with_related())
+        RecipeReadSerializer(recipes, many=True, context=context).data
+        serializer = RecipeReadSerializer(context=context)
+        fast = [serializer.to_representation(recipe) for recipe in recipes]
+        fields = [field_representation(serializer, recipe)
+                  for recipe in recipes]
+        self.assertEqual(fast, fields)
+        self.assertEqual(ORJSONRenderer().render(fast),
+                         JSONRenderer().render(fields))
+
+    def test_anonymous(self):
+        self.assert_same_output(AnonymousUser(), 'full')
+
+    def test_authenticated(self):
+        self.assert_same_output(self.user, 'card')
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_serializers', recipes=10, repeat=1,
+                     user='reader', stdout=out)
+        self.assertIn('Вывод совпадает для 6 рецептов', out.getvalue())
+
+
+@override_settings(ANONYMOUS_RESPONSE_CACHE_TIMEOUT=0)
+class CursorPaginationTests(TestCase):
+    """ Курсор идет по id и не принимает запросы со своей сортировкой."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.recipes = [Recipe.objects.create(
+            author=author, name=f'Суп {number}', text='Сварить.',
+            cooking_time=10) for number in range(3)]
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def test_pages_follow_id(self):
+        response = self.client.get('/api/recipes/',
+                                   {'pagination': 'cursor', 'limit': 2})
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual([recipe['id'] for recipe in data['results']],
+                         [self.recipes[2].id, self.recipes[1].id])
+        response = self.client.get(data['next'])
+        self.assertEqual([recipe['id'] for recipe in
+                          response.json()['results']], [self.recipes[0].id])
+
+    def test_ordering_conflicts_are_rejected(self):
+        for params in ({'search': 'суп'}, {'ordering': 'popular'}):
+            with self.subTest(**params):
+                response = self.client.get(
+                    '/api/recipes/', {'pagination': 'cursor', **params})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('pagination', response.json())
+
+    async def test_async_ordering_conflict_is_rejected(self):
+        response = await AsyncRecipeListView.as_view()(
+            AsyncRequestFactory().get(
+                '/api/recipes/', {'pagination': 'cursor',
+                                  'ordering': 'popular'}))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response['Content-Type'], 'application/json')
+
+
+class BulkRelationTests(TestCase):
+    """ Пакетное избранное, корзина и подписки: статусы, счетчики
+    и суммы корзины при INSERT/DELETE ... RETURNING."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='password')
+        cls.token = Token.objects.create(user=cls.user)
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        cls.flour, cls.sugar = [
+            Ingredient.objects.create(name=name, measurement_unit='г')
+            for name in ('Мука', 'Сахар')]
+        cls.pie = Recipe.objects.create(author=cls.author, name='Пирог',
+                                        text='Испечь.', cooking_time=60)
+        cls.bread = Recipe.objects.create(author=cls.author, name='Хлеб',
+                                          text='Испечь.', cooking_time=90)
+        RecipeIngredient.objects.bulk_create([
+            RecipeIngredient(recipe=cls.pie, ingredient=cls.flour,
+                             amount=100),
+            RecipeIngredient(recipe=cls.pie, ingredient=cls.sugar,
+                             amount=50),
+            RecipeIngredient(recipe=cls.bread, ingredient=cls.flour,
+                             amount=20),
+        ])
+        cls.missing = Recipe.objects.order_by('-id').first().id + 100
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    def bulk(self, method, path, ids):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = getattr(self.client, method)(
+                path, {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return {item['id']: item['status']
+                for item in response.json()['results']}
+
+    def counters(self, field):
+        return dict(Recipe.objects.values_list('id', field))
+
+    def totals(self):
+        return dict(ShoppingAggregate.objects.filter(
+            user=self.user).values_list('ingredient_id', 'total_amount'))
+
+    def test_favorites(self):
+        path = '/api/recipes/favorite/'
+        ids = [self.pie.id, self.bread.id, self.missing]
+        self.assertEqual(self.bulk('post', path, ids), {
+            self.pie.id: 'added', self.bread.id: 'added',
+            self.missing: 'not_found'})
+        self.assertEqual(self.counters('favorites_count'),
+                         {self.pie.id: 1, self.bread.id: 1})
+        self.assertEqual(self.bulk('post', path, [self.pie.id]),
+                         {self.pie.id: 'exists'})
+        self.assertEqual(self.counters('favorites_count'),
+                         {self.pie.id: 1, self.bread.id: 1})
+        self.assertTrue(self.client.get(
+            f'/api/recipes/{self.pie.id}/').json()['is_favorited'])
+        self.assertEqual(self.bulk('delete', path,
+                                   [self.pie.id, self.missing]),
+                         {self.pie.id: 'removed', self.missing: 'not_found'})
+        self.assertEqual(self.bulk('delete', path, [self.pie.id]),
+                         {self.pie.id: 'not_found'})
+        self.assertEqual(self.counters('favorites_count'),
+                         {self.pie.id: 0, self.bread.id: 1})
+        self.assertFalse(self.client.get(
+            f'/api/recipes/{self.pie.id}/').json()['is_favorited'])
+
+    def test_shopping_cart(self):
+        path = '/api/recipes/shopping_cart/'
+        ids = [self.pie.id, self.bread.id, self.missing]
+        self.assertEqual(self.bulk('post', path, ids), {
+            self.pie.id: 'added', self.bread.id: 'added',
+            self.missing: 'not_found'})
+        self.assertEqual(self.counters('carts_count'),
+                         {self.pie.id: 1, self.bread.id: 1})
+        self.assertEqual(self.totals(),
+                         {self.flour.id: 120, self.sugar.id: 50})
+        self.assertEqual(self.bulk('post', path, [self.bread.id]),
+                         {self.bread.id: 'exists'})
+        self.assertEqual(self.totals(),
+                         {self.flour.id: 120, self.sugar.id: 50})
+        self.assertEqual(self.bulk('delete', path,
+                                   [self.pie.id, self.missing]),
+                         {self.pie.id: 'removed', self.missing: 'not_found'})
+        self.assertEqual(self.counters('carts_count'),
+                         {self.pie.id: 0, self.bread.id: 1})
+        self.assertEqual(self.totals(), {self.flour.id: 20})
+        self.assertEqual(len(get_shopping_cart(self.user)), 1)
+        self.assertEqual(self.bulk('delete', path, [self.bread.id]),
+                         {self.bread.id: 'removed'})
+        self.assertEqual(self.totals(), {})
+        self.assertEqual(get_shopping_cart(self.user), [])
+
+    def test_subscriptions(self):
+        path = '/api/users/subscribe/'
+        missing = self.author.id + 100
+        self.assertEqual(
+            self.bulk('post', path, [self.author.id, self.user.id, missing]),
+            {self.author.id: 'added', self.user.id: 'forbidden',
+             missing: 'not_found'})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 1)
+        self.assertEqual(self.bulk('post', path, [self.author.id]),
+                         {self.author.id: 'exists'})
+        self.assertEqual(
+            self.bulk('delete', path, [self.author.id, self.user.id]),
+            {self.author.id: 'removed', self.user.id: 'forbidden'})
+        self.author.refresh_from_db()
+        self.assertEqual(self.author.followers_count, 0)
+        self.assertFalse(Follow.objects.exists())
+
+
+class BulkRelationFallbackTests(BulkRelationTests):
+    """ То же без RETURNING: bulk_create и delete() с сигналами."""
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch('api.bulk.supports_returning',
+                             return_value=False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
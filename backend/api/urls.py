@@ -1,8 +1,15 @@
+from django.conf import settings
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
+from .async_views import (AsyncIngredientDetailView, AsyncIngredientListView,
+                          AsyncRecipeDetailView, AsyncRecipeListView,
+                          AsyncSubscriptionsView, AsyncTagDetailView,
+                          AsyncTagListView)
+from .metrics import metrics_view
 from .views import (IngredientViewSet, RecipeViewSet, TagViewSet,
-                    UserSubscribeView, UserSubscriptionsViewSet)
+                    UserBulkSubscribeView, UserSubscribeView,
+                    UserSubscriptionsViewSet)
 
 
 router_v1 = DefaultRouter()
@@ -11,12 +18,33 @@ router_v1.register(r'tags', TagViewSet, basename='tags')
 router_v1.register(r'ingredients', IngredientViewSet, basename='ingredients')
 router_v1.register(r'recipes', RecipeViewSet, basename='recipes')
 
-urlpatterns = [path('users/subscriptions/',
-                    UserSubscriptionsViewSet.as_view({'get': 'list'}
-                                                     ), name='subscriptions'),
-               path('users/<int:user_id>/subscribe/',
-                    UserSubscribeView.as_view(), name='subscribe'),
-               path('', include(router_v1.urls)),
-               path('', include('djoser.urls')),
-               path('auth/', include('djoser.urls.authtoken')),
-               ]
+# Асинхронные представления чтения заменяют синхронные при запуске
+# через ASGI (foodgram.asgi); остальные методы они передают DRF.
+async_urlpatterns = [
+    path('users/subscriptions/', AsyncSubscriptionsView.as_view(),
+         name='subscriptions'),
+    path('recipes/', AsyncRecipeListView.as_view(), name='recipes-list'),
+    path('recipes/<int:pk>/', AsyncRecipeDetailView.as_view(),
+         name='recipes-detail'),
+    path('tags/', AsyncTagListView.as_view(), name='tags-list'),
+    path('tags/<int:pk>/', AsyncTagDetailView.as_view(), name='tags-detail'),
+    path('ingredients/', AsyncIngredientListView.as_view(),
+         name='ingredients-list'),
+    path('ingredients/<int:pk>/', AsyncIngredientDetailView.as_view(),
+         name='ingredients-detail'),
+]
+
+urlpatterns = async_urlpatterns if settings.ASYNC_READ_VIEWS else []
+urlpatterns += [
+    path('metrics', metrics_view, name='metrics'),
+    path('users/subscriptions/',
+         UserSubscriptionsViewSet.as_view({'get': 'list'}),
+         name='subscriptions'),
+    path('users/subscribe/',
+         UserBulkSubscribeView.as_view(), name='subscribe-bulk'),
+    path('users/<int:user_id>/subscribe/',
+         UserSubscribeView.as_view(), name='subscribe'),
+    path('', include(router_v1.urls)),
+    path('', include('djoser.urls')),
+    path('auth/', include('djoser.urls.authtoken')),
+]
@@ -1,24 +1,44 @@
-from django.shortcuts import get_object_or_404, HttpResponse
-from django.db.models import Sum
+from django.http import Http404, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.db.models import F, Prefetch, Value, Window
+from django.db.models.functions import RowNumber
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import viewsets, mixins
 from rest_framework.decorators import action
 from rest_framework.permissions import SAFE_METHODS, AllowAny, IsAuthenticated
+from rest_framework.response import Response
 from rest_framework.views import APIView
 
-from .filters import IngredientFilter, RecipeFilter
+from .bulk import BulkRelation
+from .cache import get_shopping_cart, ingredient_cache, tag_cache
+from .conditional import recipes_condition, reference_condition
+from .filters import RecipeFilter
+from .indexes import ingredient_index
 from .permissions import IsAuthorAdminOrReadOnly
+from .renderers import (ShoppingCartCSVRenderer, ShoppingCartJSONRenderer,
+                        ShoppingCartNegotiation, ShoppingCartPDFRenderer,
+                        ShoppingCartTextRenderer)
 from .serializers import (
     FavoriteSerializer, IngredientSerializer,
     RecipeCreateSerializer, RecipeReadSerializer,
     ShoppingListSerializer, SubscriptionSerializer,
-    TagSerialiser, UserSubscribeListSerializer)
-from .mixins import CreateDeleteMixin
+    TagSerialiser, UserSubscribeListSerializer, get_limit,
+    get_recipes_limit)
+from .mixins import CreateDeleteMixin, SerializerTimingMixin
 from recipes.models import (Ingredient, Tag, Recipe, Favorite, ShoppingList,
-                            RecipeIngredient)
+                            ShoppingAggregate)
 from users.models import Follow, User
 
 
+def get_cached_object(reference_cache, pk):
+    """ Объект справочника из кеша или 404."""
+    obj = reference_cache.get(int(pk)) if str(pk).isdigit() else None
+    if obj is None:
+        raise Http404
+    return obj
+
+
 class UserSubscribeView(CreateDeleteMixin, APIView):
     """ Вью добавления, удаления подписки на пользователя."""
 
@@ -35,25 +55,75 @@ class UserSubscribeView(CreateDeleteMixin, APIView):
         )
 
 
-class UserSubscriptionsViewSet(mixins.ListModelMixin,
+class UserBulkSubscribeView(CreateDeleteMixin, APIView):
+    """ Вью пакетной подписки и отписки по списку id авторов."""
+    relation = BulkRelation(Follow, 'author', allow_self=False)
+
+    def post(self, request):
+        return self.bulk_objects(request, self.relation)
+
+    def delete(self, request):
+        return self.bulk_objects(request, self.relation)
+
+
+def list_ingredients(request):
+    """ Ингредиенты из кеша: поиск по началу и вхождению name
+    или весь справочник, не больше limit."""
+    limit = get_limit(request)
+    name = request.query_params.get('name')
+    if name:
+        return ingredient_index.search(name, limit)
+    return ingredient_cache.all()[:limit]
+
+
+def get_subscriptions_queryset(request):
+    """ Авторы, на которых подписан пользователь, с последними
+    recipes_limit рецептами каждого."""
+    recipes = Recipe.objects.all()
+    limit = get_recipes_limit(request)
+    if limit is not None:
+        recipes = recipes.annotate(
+            row_number=Window(RowNumber(), partition_by=F('author_id'),
+                              order_by=F('id').desc())
+        ).filter(row_number__lte=limit)
+    return User.objects.filter(
+        followings__user=request.user
+    ).annotate(
+        is_subscribed=Value(True),
+    ).prefetch_related(
+        Prefetch('recipes', queryset=recipes, to_attr='limited_recipes')
+    ).order_by('id')
+
+
+class UserSubscriptionsViewSet(SerializerTimingMixin,
+                               mixins.ListModelMixin,
                                viewsets.GenericViewSet):
     """ Вьюсет получения списка подписок на пользователя."""
     serializer_class = UserSubscribeListSerializer
+    cursor_ordering = 'id'
 
     def get_queryset(self):
-        return User.objects.filter(followings__user=self.request.user)
+        return get_subscriptions_queryset(self.request)
 
 
+@method_decorator(reference_condition(Ingredient), name='list')
+@method_decorator(reference_condition(Ingredient), name='retrieve')
 class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
     """ Вьюсет получения ингердиентов."""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return Response(list_ingredients(request))
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_cached_object(ingredient_cache, kwargs['pk']))
 
+
+@method_decorator(reference_condition(Tag), name='list')
+@method_decorator(reference_condition(Tag), name='retrieve')
 class TagViewSet(viewsets.ReadOnlyModelViewSet):
     """ Вьюсет получения тегов."""
     queryset = Tag.objects.all()
@@ -61,8 +131,17 @@ class TagViewSet(viewsets.ReadOnlyModelViewSet):
     permission_classes = (AllowAny,)
     pagination_class = None
 
+    def list(self, request, *args, **kwargs):
+        return Response(tag_cache.all())
+
+    def retrieve(self, request, *args, **kwargs):
+        return Response(get_cached_object(tag_cache, kwargs['pk']))
 
-class RecipeViewSet(CreateDeleteMixin, viewsets.ModelViewSet):
+
+@method_decorator(recipes_condition, name='list')
+@method_decorator(recipes_condition, name='retrieve')
+class RecipeViewSet(SerializerTimingMixin, CreateDeleteMixin,
+                    viewsets.ModelViewSet):
     """ Вьюсет работы с рецептами."""
     queryset = Recipe.objects.all()
     permission_classes = (IsAuthorAdminOrReadOnly,)
@@ -70,6 +149,17 @@ class RecipeViewSet(CreateDeleteMixin, viewsets.ModelViewSet):
     filterset_class = RecipeFilter
     http_method_names = ['get', 'post', 'patch', 'delete']
 
+    def get_queryset(self):
+        if self.request.method in SAFE_METHODS:
+            return Recipe.objects.with_related()
+        return super().get_queryset()
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action == 'list':
+            context['image_variant'] = 'card'
+        return context
+
     def get_serializer_class(self):
         if self.request.method in SAFE_METHODS:
             return RecipeReadSerializer
@@ -95,21 +185,50 @@ class RecipeViewSet(CreateDeleteMixin, viewsets.ModelViewSet):
         return self.delete_object(request, ShoppingList, recipe,
                                   ShoppingListSerializer.Meta.fields)
 
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated, ],
+            url_path='favorite', url_name='favorite-bulk')
+    def favorite_bulk(self, request):
+        return self.bulk_objects(request, BulkRelation(Favorite, 'recipe'))
+
+    @action(detail=False, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated, ],
+            url_path='shopping_cart', url_name='shopping-cart-bulk')
+    def shopping_cart_bulk(self, request):
+        return self.bulk_objects(request,
+                                 BulkRelation(ShoppingList, 'recipe'))
+
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated, ])
+            permission_classes=[IsAuthenticated, ],
+            url_path='shopping_cart/totals', url_name='shopping-cart-totals')
+    def shopping_cart_totals(self, request):
+        """ Суммы ингредиентов корзины из ShoppingAggregate, названия
+        и единицы измерения берутся из кеша справочника."""
+        ingredients = ingredient_cache.by_id()
+        totals = [
+            {**ingredients[pk], 'amount': amount}
+            for pk, amount in ShoppingAggregate.objects.filter(
+                user=request.user).values_list('ingredient_id',
+                                               'total_amount')
+            if pk in ingredients]
+        totals.sort(key=lambda item: item['name'])
+        return Response(totals)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated, ],
+            renderer_classes=[ShoppingCartTextRenderer,
+                              ShoppingCartCSVRenderer,
+                              ShoppingCartJSONRenderer,
+                              ShoppingCartPDFRenderer],
+            content_negotiation_class=ShoppingCartNegotiation)
     def download_shopping_cart(self, request):
-        ingredient_lst = RecipeIngredient.objects.filter(
-            recipe__carts__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(ingredient_amount=Sum('amount'))
-        shopping_lst = ['Список покупок:\n']
-        for ingredient in ingredient_lst:
-            name = ingredient['ingredient__name']
-            unit = ingredient['ingredient__measurement_unit']
-            amount = ingredient['ingredient_amount']
-            shopping_lst.append(f'\n{name} - {amount}, {unit}')
-        response = HttpResponse(shopping_lst, content_type='text/plain')
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type = f'{content_type}; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            renderer.stream(get_shopping_cart(request.user)),
+            content_type=content_type)
         response['Content-Disposition'] = (
-            'attachment; filename="shopping_cart.txt"')
+            f'attachment; filename="{renderer.get_filename()}"')
         return response
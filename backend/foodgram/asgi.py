@@ -3,5 +3,9 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
+os.environ.setdefault('ASYNC_READ_VIEWS', 'True')
+# Постоянные соединения не рекомендуются для ASGI: асинхронные
+# представления работают с базой из разных потоков.
+os.environ.setdefault('CONN_MAX_AGE', '0')
 
 application = get_asgi_application()
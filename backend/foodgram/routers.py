@@ -0,0 +1,140 @@
+import contextvars
+import hashlib
+import random
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = 'default'
+STICKY_KEY = 'db_sticky:{digest}'
+# Модели, которые читаются только с основной базы: токен, созданный
+# при входе, может еще не дойти до реплики к следующему запросу.
+PRIMARY_MODELS = {'authtoken.token'}
+# Модули представлений, чтения которых можно отдавать репликам.
+REPLICA_VIEW_MODULES = ('api.',)
+
+current_request = contextvars.ContextVar('current_request', default=None)
+
+
+def get_replicas():
+    return [alias for alias in settings.DATABASES if alias != PRIMARY]
+
+
+def sticky_key(request):
+    """ Ключ привязки к основной базе по токену запроса или None
+    для анонимного запроса."""
+    authorization = request.headers.get('Authorization')
+    if not authorization:
+        return None
+    digest = hashlib.sha256(authorization.encode()).hexdigest()
+    return STICKY_KEY.format(digest=digest)
+
+
+class RequestRouting:
+    """ Состояние маршрутизации одного запроса: выбранная реплика
+    и привязка пользователя к основной базе."""
+
+    def __init__(self, request):
+        self.request = request
+        self.replica = random.choice(get_replicas())
+        self._sticky = None
+
+    def is_sticky(self):
+        if self._sticky is None:
+            key = sticky_key(self.request)
+            self._sticky = key is not None and bool(cache.get(key))
+        return self._sticky
+
+    def read_replica(self):
+        """ Реплика для чтения или None, если читать нужно с основной
+        базы."""
+        request = self.request
+        if request.method not in SAFE_METHODS:
+            return None
+        match = getattr(request, 'resolver_match', None)
+        if match is None or not match.func.__module__.startswith(
+                REPLICA_VIEW_MODULES):
+            return None
+        if self.is_sticky():
+            return None
+        return self.replica
+
+
+class PrimaryReplicaRouter:
+    """ Роутер основной базы и реплик.
+
+    Чтения из безопасных запросов к представлениям api идут на реплику,
+    выбранную для запроса; записи, остальные запросы, команды и
+    административный сайт работают с основной базой. После успешного
+    изменяющего запроса пользователь читает с основной базы
+    READ_YOUR_WRITES_SECONDS секунд, чтобы видеть свои изменения до того,
+    как их получат реплики. Привязка хранится в кеше Django, поэтому
+    нескольким процессам сервера нужен общий кеш (проверка api.W001)."""
+
+    def db_for_read(self, model, **hints):
+        routing = current_request.get()
+        if routing is None or model._meta.label_lower in PRIMARY_MODELS:
+            return PRIMARY
+        return routing.read_replica() or PRIMARY
+
+    def db_for_write(self, model, **hints):
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == PRIMARY
+
+
+class ReplicaRoutingMiddleware:
+    """ Передает запрос роутеру баз и после успешных изменяющих
+    запросов привязывает токен пользователя к основной базе."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not get_replicas():
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        routing = RequestRouting(request)
+        token = current_request.set(routing)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        key = self.get_sticky_key(routing, response)
+        if key is not None:
+            cache.set(key, True, settings.READ_YOUR_WRITES_SECONDS)
+        return response
+
+    async def __acall__(self, request):
+        routing = RequestRouting(request)
+        token = current_request.set(routing)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        key = self.get_sticky_key(routing, response)
+        if key is not None:
+            await cache.aset(key, True, settings.READ_YOUR_WRITES_SECONDS)
+        return response
+
+    @staticmethod
+    def get_sticky_key(routing, response):
+        """ Ключ привязки пользователя к основной базе после успешного
+        изменяющего запроса или None."""
+        request = routing.request
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            return sticky_key(request)
+        return None
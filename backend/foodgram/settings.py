@@ -22,6 +22,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -32,6 +33,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.metrics.PerformanceMetricsMiddleware',
+    'foodgram.routers.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -39,6 +42,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.response_cache.AnonymousResponseCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -78,10 +82,74 @@ DATABASES = {
         'USER': os.getenv('POSTGRES_USER', 'postgres'),
         'PASSWORD': os.getenv('POSTGRES_PASSWORD', 'postgres'),
         'HOST': os.getenv('DB_HOST', '127.0.0.1'),
-        'PORT': os.getenv('DB_PORT', '5432')
+        'PORT': os.getenv('DB_PORT', '5432'),
+        'CONN_MAX_AGE': int(os.getenv('CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Реплики для чтения: через пробел host или host:port, для SQLite - пути
+# к файлам баз. Без реплик роутер и его middleware не используются.
+for number, replica in enumerate(os.getenv('DB_REPLICAS', '').split(), 1):
+    DATABASES[f'replica_{number}'] = dict(
+        DATABASES['default'], TEST={'MIRROR': 'default'})
+    if 'sqlite3' in DATABASES['default']['ENGINE']:
+        DATABASES[f'replica_{number}']['NAME'] = replica
+    else:
+        host, _, port = replica.partition(':')
+        DATABASES[f'replica_{number}'].update(
+            HOST=host, PORT=port or DATABASES['default']['PORT'])
+
+if len(DATABASES) > 1:
+    DATABASE_ROUTERS = ['foodgram.routers.PrimaryReplicaRouter']
+
+# Сколько секунд после записи пользователь читает с основной базы.
+READ_YOUR_WRITES_SECONDS = int(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Количество процессов сервера; gunicorn и uvicorn берут из этой переменной
+# число воркеров. Нескольким процессам нужен общий кеш (CACHE_BACKEND):
+# LocMemCache у каждого процесса свой, и сброс кеша в одном процессе
+# не виден остальным.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+
+# Время жизни в LocMemCache записей, которые сбрасываются при изменении
+# данных (справочники, корзины, поколения кеша ответов); в общем кеше
+# они хранятся до сброса.
+LOCAL_CACHE_TIMEOUT = int(os.getenv('LOCAL_CACHE_TIMEOUT', 10))
+
+# Время хранения избранного, корзины и подписок пользователя в кеше,
+# 0 - загружать их на каждый запрос только для объектов страницы.
+MEMBERSHIP_CACHE_TIMEOUT = int(os.getenv('MEMBERSHIP_CACHE_TIMEOUT', 0))
+
+# Время хранения готовых ответов API для анонимных пользователей,
+# 0 - не кешировать.
+ANONYMOUS_RESPONSE_CACHE_TIMEOUT = int(
+    os.getenv('ANONYMOUS_RESPONSE_CACHE_TIMEOUT', 600))
+
+# Асинхронные представления чтения; включаются в foodgram.asgi.
+ASYNC_READ_VIEWS = os.getenv('ASYNC_READ_VIEWS', 'False') == 'True'
+
+# Кеш токенов аутентификации: размер LRU в памяти процесса, время жизни
+# записи в нем и время жизни в общем кеше (0 - общий кеш не используется).
+TOKEN_CACHE_SIZE = int(os.getenv('TOKEN_CACHE_SIZE', 10000))
+TOKEN_CACHE_TIMEOUT = int(os.getenv('TOKEN_CACHE_TIMEOUT', 30))
+TOKEN_CACHE_SHARED_TIMEOUT = int(os.getenv('TOKEN_CACHE_SHARED_TIMEOUT', 0))
+
+# Метрики запросов по представлениям для /api/metrics (формат Prometheus),
+# токен для доступа к ним (без токена адрес отключен) и заголовок
+# Server-Timing в ответах.
+PERFORMANCE_METRICS = os.getenv('PERFORMANCE_METRICS', 'True') == 'True'
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'False') == 'True'
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -112,6 +180,27 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
+# Внутренний location nginx, через который X-Accel-Redirect отдает
+# файлы из MEDIA_ROOT; без него файлы /media/ отдает сам Django.
+MEDIA_ACCEL_REDIRECT = os.getenv('MEDIA_ACCEL_REDIRECT', '')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'recipes.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
+RECIPE_IMAGE_MAX_BYTES = 10 * 1024 * 1024
+RECIPE_IMAGE_MAX_PIXELS = 40_000_000
+RECIPE_IMAGE_VARIANTS = {
+    'thumbnail': (320, 320),
+    'card': (720, 720),
+    'full': (1600, 1600),
+}
+RECIPE_IMAGE_WEBP_QUALITY = 80
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
@@ -123,12 +212,19 @@ REST_FRAMEWORK = {
     ],
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'api.renderers.ORJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.CustomPagination',
     'PAGE_SIZE': 6,
 }
 
+SHOPPING_CART_PDF_FONT = os.getenv(
+    'SHOPPING_CART_PDF_FONT', '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf')
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
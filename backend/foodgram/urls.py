@@ -1,7 +1,12 @@
+from django.conf import settings
 from django.contrib import admin
 from django.urls import include, path
 
+from recipes.views import media_file
+
 urlpatterns = [
     path('admin/', admin.site.urls),
-    path('api/', include('api.urls'))
+    path('api/', include('api.urls')),
+    path(f'{settings.MEDIA_URL.strip("/")}/<path:name>', media_file,
+         name='media'),
 ]
@@ -1,7 +1,9 @@
 from django.contrib import admin
 
+from .aggregates import rebuild_totals
 from .models import (Favorite, Ingredient, Recipe,
                      RecipeIngredient, ShoppingList, Tag)
+from foodgram.paginators import EstimatedCountPaginator
 
 
 class TagAdmin(admin.ModelAdmin):
@@ -13,36 +15,94 @@ class TagAdmin(admin.ModelAdmin):
 
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('pk', 'name', 'measurement_unit')
-    search_fields = ('name',)
-    list_filter = ('name',)
+    search_fields = ('name__startswith',)
+    list_filter = ('measurement_unit',)
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
 class RecipeAdmin(admin.ModelAdmin):
     list_display = ('pk', 'name', 'author', 'favorites_amount')
-    search_fields = ('name', 'author')
-    list_filter = ('name', 'author', 'tags')
+    list_select_related = ('author',)
+    search_fields = ('name',)
+    list_filter = ('tags',)
+    autocomplete_fields = ('author',)
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
+    @admin.display(description='Добавлений в избранное',
+                   ordering='favorites_count')
     def favorites_amount(self, obj):
-        return obj.favorites.count()
+        return obj.favorites_count
+
+    def get_search_results(self, request, queryset, search_term):
+        """ Поиск по индексированному полнотекстовому поиску рецептов
+        вместо icontains по всей таблице."""
+        if not search_term:
+            return queryset, False
+        return queryset.search(search_term), False
+
+
+class CartTotalsAdminMixin:
+    """ Пересчитывает суммы корзин, затронутых правкой в админке:
+    изменение существующих строк не обновляет их инкрементально."""
+
+    def cart_users(self, objs):
+        raise NotImplementedError
 
+    def save_model(self, request, obj, form, change):
+        previous = [type(obj).objects.get(pk=obj.pk)] if change else []
+        super().save_model(request, obj, form, change)
+        rebuild_totals(self.cart_users([obj, *previous]))
 
-class RecipeIngredientAdmin(admin.ModelAdmin):
+    def delete_model(self, request, obj):
+        users = self.cart_users([obj])
+        super().delete_model(request, obj)
+        rebuild_totals(users)
+
+    def delete_queryset(self, request, queryset):
+        users = self.cart_users(queryset)
+        super().delete_queryset(request, queryset)
+        rebuild_totals(users)
+
+
+class RecipeIngredientAdmin(CartTotalsAdminMixin, admin.ModelAdmin):
     list_display = ('pk', 'recipe', 'ingredient', 'amount')
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def cart_users(self, objs):
+        return list(ShoppingList.objects.filter(
+            recipe_id__in={obj.recipe_id for obj in objs}
+        ).values_list('user_id', flat=True).distinct())
 
 
 class FavoriteAdmin(admin.ModelAdmin):
     list_display = ('pk', 'user', 'recipe')
-    search_fields = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    search_fields = ('user__username__startswith',)
+    autocomplete_fields = ('user', 'recipe')
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
 
-class ShopCartAdmin(admin.ModelAdmin):
+class ShopCartAdmin(CartTotalsAdminMixin, admin.ModelAdmin):
     list_display = ('pk', 'user', 'recipe')
-    search_fields = ('user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    search_fields = ('user__username__startswith',)
+    autocomplete_fields = ('user', 'recipe')
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def cart_users(self, objs):
+        return list({obj.user_id for obj in objs})
 
 
 admin.site.register(Tag, TagAdmin)
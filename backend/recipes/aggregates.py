@@ -0,0 +1,101 @@
+from django.db.models import Case, F, Sum, Value, When
+from django.db.models.functions import Greatest
+
+from recipes.models import RecipeIngredient, ShoppingAggregate, ShoppingList
+from recipes.signals import shopping_totals_rebuilt
+
+
+def recipe_amounts(recipe_ids):
+    """ Суммарное количество каждого ингредиента в рецептах recipe_ids:
+    словарь id ингредиента -> количество."""
+    return dict(RecipeIngredient.objects.filter(
+        recipe_id__in=recipe_ids
+    ).order_by().values('ingredient_id').annotate(
+        total=Sum('amount')
+    ).values_list('ingredient_id', 'total'))
+
+
+def change_totals(user_ids, deltas):
+    """ Изменяет суммы ингредиентов в корзинах пользователей user_ids
+    на deltas (id ингредиента -> изменение).
+
+    Суммы меняются одним UPDATE через F(), поэтому одновременные
+    изменения корзин не теряются; строки с нулевой суммой удаляются.
+    user_ids может быть запросом values_list, тогда он используется
+    как подзапрос."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    added = [pk for pk, delta in deltas.items() if delta > 0]
+    if added:
+        ShoppingAggregate.objects.bulk_create(
+            [ShoppingAggregate(user_id=user_id, ingredient_id=pk)
+             for user_id in user_ids for pk in added],
+            ignore_conflicts=True)
+    rows = ShoppingAggregate.objects.filter(user_id__in=user_ids,
+                                            ingredient_id__in=deltas)
+    rows.update(total_amount=Greatest(
+        F('total_amount') + Case(
+            *[When(ingredient_id=pk, then=Value(delta))
+              for pk, delta in deltas.items()],
+            default=Value(0)),
+        Value(0)))
+    if len(added) < len(deltas):
+        rows.filter(total_amount=0).delete()
+
+
+def add_recipes(user_id, recipe_ids):
+    """ Добавляет ингредиенты рецептов, положенных в корзину."""
+    change_totals([user_id], recipe_amounts(recipe_ids))
+
+
+def remove_recipes(user_id, recipe_ids):
+    """ Вычитает ингредиенты рецептов, убранных из корзины."""
+    change_totals([user_id], {pk: -total for pk, total
+                              in recipe_amounts(recipe_ids).items()})
+
+
+def change_recipe(recipe_id, deltas):
+    """ Применяет изменение ингредиентов рецепта к корзинам всех
+    пользователей, у которых он лежит."""
+    change_totals(ShoppingList.objects.filter(
+        recipe_id=recipe_id).values_list('user_id', flat=True), deltas)
+
+
+def actual_totals(user_ids):
+    """ Суммы ингредиентов корзин, посчитанные по рецептам заново."""
+    return RecipeIngredient.objects.filter(
+        recipe__carts__user_id__in=user_ids
+    ).values_list(
+        'recipe__carts__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+
+
+def rebuild_totals(user_ids):
+    """ Пересчитывает суммы корзин пользователей user_ids по рецептам.
+    Возвращает количество исправленных строк."""
+    actual = {(user_id, pk): total
+              for user_id, pk, total in actual_totals(user_ids)}
+    stored = {(user_id, pk): total
+              for user_id, pk, total in ShoppingAggregate.objects.filter(
+                  user_id__in=user_ids).values_list(
+                  'user_id', 'ingredient_id', 'total_amount')}
+    fixed = 0
+    removed = stored.keys() - actual.keys()
+    for user_id, pk in removed:
+        fixed += ShoppingAggregate.objects.filter(
+            user_id=user_id, ingredient_id=pk).delete()[0]
+    changed = [
+        ShoppingAggregate(user_id=user_id, ingredient_id=pk,
+                          total_amount=total)
+        for (user_id, pk), total in actual.items()
+        if stored.get((user_id, pk)) != total]
+    ShoppingAggregate.objects.bulk_create(
+        changed, update_conflicts=True, update_fields=['total_amount'],
+        unique_fields=['user', 'ingredient'])
+    changed_users = ({user_id for user_id, _ in removed}
+                     | {row.user_id for row in changed})
+    if changed_users:
+        shopping_totals_rebuilt.send(sender=ShoppingAggregate,
+                                     user_ids=sorted(changed_users))
+    return fixed + len(changed)
@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.core.checks import Tags, register
+from django.db.models.signals import post_migrate
 
 
 class RecipesConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'recipes'
+
+    def ready(self):
+        from .search import check_search_index, ensure_search_index
+
+        register(check_search_index, Tags.database)
+        post_migrate.connect(ensure_search_index, sender=self)
@@ -0,0 +1,38 @@
+from django.db.models import Count, F, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Greatest
+
+from recipes.models import Favorite, Recipe, ShoppingList
+from users.models import Follow, User
+
+# Модель записи -> (модель со счетчиком, поле связи, поле счетчика).
+COUNTERS = {
+    Favorite: (Recipe, 'recipe_id', 'favorites_count'),
+    ShoppingList: (Recipe, 'recipe_id', 'carts_count'),
+    Follow: (User, 'author_id', 'followers_count'),
+    Recipe: (User, 'author_id', 'recipes_count'),
+}
+
+
+def change_counter(model, ids, delta):
+    """ Атомарно изменяет счетчик на delta у объектов ids.
+
+    Используется F(), поэтому одновременные запросы не теряют
+    изменений; счетчик не опускается ниже нуля."""
+    if not ids:
+        return
+    target, _, counter = COUNTERS[model]
+    value = F(counter) + delta
+    if delta < 0:
+        value = Greatest(value, Value(0))
+    target.objects.filter(id__in=ids).update(**{counter: value})
+
+
+def actual_count(model):
+    """ Подзапрос с фактическим количеством записей model для строки
+    модели со счетчиком."""
+    _, field, _ = COUNTERS[model]
+    return Coalesce(Subquery(
+        model.objects.order_by().filter(
+            **{field: OuterRef('pk')}
+        ).values(field).annotate(total=Count('pk')).values('total')
+    ), 0)
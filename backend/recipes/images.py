@@ -0,0 +1,70 @@
+import os
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+SAVE_FORMATS = {'JPEG': 'jpg', 'PNG': 'png', 'WEBP': 'webp', 'GIF': 'gif'}
+VARIANTS_DIR = 'recipes/variants'
+
+
+class ImageRejected(ValueError):
+    """ Изображение не прошло проверку размера или формата."""
+
+
+def open_image(data):
+    """ Открывает изображение, читая только заголовок, и проверяет
+    количество пикселей до декодирования."""
+    try:
+        image = Image.open(BytesIO(data))
+    except (UnidentifiedImageError, OSError):
+        raise ImageRejected('Загрузите корректное изображение.')
+    if image.width * image.height > settings.RECIPE_IMAGE_MAX_PIXELS:
+        raise ImageRejected(
+            'Слишком большое разрешение изображения, максимум '
+            f'{settings.RECIPE_IMAGE_MAX_PIXELS} пикселей.')
+    return image
+
+
+def sanitize_image(data):
+    """ Пересохраняет изображение без метаданных (EXIF, ICC и т.п.),
+    уменьшая его до размера варианта full.
+
+    Возвращает ContentFile с расширением итогового формата."""
+    image = open_image(data)
+    save_format = image.format if image.format in SAVE_FORMATS else 'PNG'
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail(settings.RECIPE_IMAGE_VARIANTS['full'])
+    if save_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=save_format)
+    return ContentFile(buffer.getvalue(),
+                       name='temp.' + SAVE_FORMATS[save_format])
+
+
+def build_image_variants(recipe):
+    """ Создает WebP-варианты изображения рецепта и сохраняет их имена
+    в recipe.image_variants."""
+    variants = {}
+    if recipe.image:
+        stem = os.path.splitext(os.path.basename(recipe.image.name))[0]
+        sizes = sorted(settings.RECIPE_IMAGE_VARIANTS.items(),
+                       key=lambda item: item[1], reverse=True)
+        with recipe.image.open('rb') as file:
+            image = Image.open(file)
+            image.draft('RGB', sizes[0][1])
+            image = image.convert('RGBA' if 'A' in image.getbands()
+                                  else 'RGB')
+        for variant, size in sizes:
+            image.thumbnail(size)
+            buffer = BytesIO()
+            image.save(buffer, format='WEBP',
+                       quality=settings.RECIPE_IMAGE_WEBP_QUALITY)
+            variants[variant] = default_storage.save(
+                f'{VARIANTS_DIR}/{stem}_{variant}.webp',
+                ContentFile(buffer.getvalue()))
+    recipe.image_variants = variants
+    recipe.save(update_fields=['image_variants'])
@@ -0,0 +1,23 @@
+from django.core.management import BaseCommand
+
+from recipes.images import build_image_variants
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Building resized WebP variants for recipe images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true',
+                            help='rebuild variants that already exist')
+
+    def handle(self, *args, **options):
+        recipes = Recipe.objects.exclude(image='').order_by('id')
+        if not options['all']:
+            recipes = recipes.filter(image_variants={})
+        built = 0
+        for recipe in recipes.iterator():
+            build_image_variants(recipe)
+            built += 1
+        self.stdout.write(
+            self.style.SUCCESS(f'Варианты картинок созданы: {built}'))
@@ -0,0 +1,105 @@
+import posixpath
+from datetime import timedelta
+
+from django.core.files.storage import default_storage
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from recipes.models import Recipe, StoredFile
+from recipes.storage import recipe_files
+
+# Каталоги хранилища с картинками рецептов и их вариантами.
+MEDIA_DIRS = ('recipes',)
+
+
+def walk(storage, directory):
+    """ Имена всех файлов каталога хранилища и его подкаталогов."""
+    directories, files = storage.listdir(directory)
+    for name in files:
+        yield posixpath.join(directory, name)
+    for name in directories:
+        yield from walk(storage, posixpath.join(directory, name))
+
+
+class Command(BaseCommand):
+    help = ('Deleting recipe images and variants that are no longer '
+            'referenced by any recipe')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=60,
+                            help='minutes a file must be unreferenced')
+        parser.add_argument('--recount', action='store_true',
+                            help='recompute reference counts from recipes')
+        parser.add_argument('--scan', action='store_true',
+                            help='also delete untracked files in media')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report files to delete')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.cutoff = timezone.now() - timedelta(minutes=options['min_age'])
+        if options['recount']:
+            self.recount()
+        deleted = self.delete_unreferenced()
+        if options['scan']:
+            deleted += self.delete_untracked()
+        action = 'К удалению' if options['dry_run'] else 'Удалено'
+        self.stdout.write(self.style.SUCCESS(f'{action} файлов: {deleted}'))
+
+    def recount(self):
+        references = {}
+        for recipe in Recipe.objects.only('image', 'image_variants'):
+            for name in recipe_files(recipe):
+                references[name] = references.get(name, 0) + 1
+        with transaction.atomic():
+            StoredFile.objects.bulk_create(
+                [StoredFile(name=name) for name in references],
+                ignore_conflicts=True)
+            fixed = 0
+            for stored in StoredFile.objects.select_for_update():
+                actual = references.get(stored.name, 0)
+                if stored.references != actual:
+                    stored.references = actual
+                    stored.save(update_fields=['references', 'updated_at'])
+                    fixed += 1
+        self.stdout.write(f'Исправлено счетчиков ссылок: {fixed}')
+
+    def is_old(self, name):
+        if not default_storage.exists(name):
+            return True
+        return default_storage.get_modified_time(name) < self.cutoff
+
+    def delete_unreferenced(self):
+        deleted = 0
+        names = StoredFile.objects.filter(
+            references=0, updated_at__lt=self.cutoff
+        ).values_list('name', flat=True)
+        for name in list(names):
+            if not self.is_old(name):
+                continue
+            if self.options['dry_run']:
+                deleted += 1
+                continue
+            with transaction.atomic():
+                # Ссылка могла появиться после выборки.
+                removed, _ = StoredFile.objects.filter(
+                    name=name, references=0).delete()
+                if removed:
+                    default_storage.delete(name)
+                    deleted += 1
+        return deleted
+
+    def delete_untracked(self):
+        deleted = 0
+        tracked = set(StoredFile.objects.values_list('name', flat=True))
+        for directory in MEDIA_DIRS:
+            if not default_storage.exists(directory):
+                continue
+            for name in walk(default_storage, directory):
+                if name in tracked or not self.is_old(name):
+                    continue
+                deleted += 1
+                if not self.options['dry_run']:
+                    default_storage.delete(name)
+        return deleted
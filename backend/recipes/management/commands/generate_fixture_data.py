@@ -0,0 +1,196 @@
+import random
+from itertools import accumulate
+
+from django.contrib.auth.hashers import make_password
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import transaction
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, Tag)
+from recipes.signals import ingredients_loaded
+from users.models import Follow, User
+
+WORDS = ('суп', 'салат', 'пирог', 'омлет', 'каша', 'паста', 'рагу', 'соус',
+         'запеканка', 'блины', 'котлеты', 'плов', 'борщ', 'десерт', 'хлеб',
+         'курица', 'рыба', 'овощи', 'грибы', 'сыр', 'томаты', 'яблоки')
+UNITS = ('г', 'кг', 'мл', 'л', 'шт.', 'ст. л.', 'ч. л.', 'по вкусу')
+
+
+def zipf_weights(size, skew):
+    """ Накопленные веса распределения Ципфа для rng.choices: первые
+    элементы выбираются заметно чаще остальных, как популярные рецепты
+    и авторы."""
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(size)))
+
+
+class Command(BaseCommand):
+    help = ('Generating synthetic users, recipes, favorites, carts '
+            'and follows for load testing')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000,
+                            help='number of users to create')
+        parser.add_argument('--recipes', type=int, default=5000,
+                            help='number of recipes to create')
+        parser.add_argument('--tags', type=int, default=12,
+                            help='number of tags to ensure')
+        parser.add_argument('--ingredients', type=int, default=2000,
+                            help='ingredients to create if there are none')
+        parser.add_argument('--ingredients-per-recipe', type=int, default=8,
+                            help='mean ingredients per recipe')
+        parser.add_argument('--favorites-per-user', type=int, default=20,
+                            help='mean favorites per user')
+        parser.add_argument('--carts-per-user', type=int, default=4,
+                            help='mean recipes in a shopping cart per user')
+        parser.add_argument('--follows-per-user', type=int, default=10,
+                            help='mean follows per user')
+        parser.add_argument('--authors-share', type=float, default=0.2,
+                            help='share of users who publish recipes')
+        parser.add_argument('--skew', type=float, default=1.1,
+                            help='Zipf exponent of popularity')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='rows per insert')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='random seed')
+        parser.add_argument('--prefix', default='fixture',
+                            help='username prefix of generated users')
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.batch_size = options['batch_size']
+        if self.batch_size < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        if options['users'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь')
+        self.rng = random.Random(options['seed'])
+        self.tag_ids = self.create_tags()
+        self.ingredient_ids = self.create_ingredients()
+        self.user_ids = self.create_users()
+        self.recipe_ids = self.create_recipes()
+        self.create_relations(
+            Favorite, 'recipe', self.recipe_ids,
+            options['favorites_per_user'])
+        self.create_relations(
+            ShoppingList, 'recipe', self.recipe_ids,
+            options['carts_per_user'])
+        self.create_relations(
+            Follow, 'author', self.author_ids, options['follows_per_user'])
+        call_command('reconcile_counters', batch_size=self.batch_size,
+                     stdout=self.stdout)
+        call_command('rebuild_shopping_aggregates', stdout=self.stdout)
+        self.stdout.write(self.style.SUCCESS('Тестовые данные созданы'))
+
+    def report(self, model, count):
+        self.stdout.write(f'{model._meta.verbose_name_plural}: {count}')
+
+    def bulk_create(self, model, rows, **kwargs):
+        """ Вставляет строки пачками по batch_size и возвращает
+        созданные объекты."""
+        created = []
+        for start in range(0, len(rows), self.batch_size):
+            with transaction.atomic():
+                created += model.objects.bulk_create(
+                    rows[start:start + self.batch_size], **kwargs)
+        return created
+
+    def create_tags(self):
+        for number in range(Tag.objects.count(), self.options['tags']):
+            Tag.objects.get_or_create(
+                slug=f'{self.options["prefix"]}-tag-{number}',
+                defaults={'name': f'Тег {number}',
+                          'color': f'#{number:06x}'})
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        if not tag_ids:
+            raise CommandError('Нет тегов')
+        return tag_ids
+
+    def create_ingredients(self):
+        if not Ingredient.objects.exists():
+            self.bulk_create(Ingredient, [
+                Ingredient(
+                    name=f'{self.rng.choice(WORDS)} {number}',
+                    measurement_unit=self.rng.choice(UNITS))
+                for number in range(self.options['ingredients'])])
+            ingredients_loaded.send(sender=Ingredient)
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        if not ingredient_ids:
+            raise CommandError('Нет ингредиентов')
+        self.rng.shuffle(ingredient_ids)
+        return ingredient_ids
+
+    def create_users(self):
+        prefix = self.options['prefix']
+        start = User.objects.filter(username__startswith=prefix).count()
+        password = make_password(None)
+        users = self.bulk_create(User, [
+            User(username=f'{prefix}{number}',
+                 email=f'{prefix}{number}@example.com',
+                 first_name='Имя', last_name='Фамилия', password=password)
+            for number in range(start, start + self.options['users'])])
+        self.report(User, len(users))
+        return [user.id for user in users]
+
+    def create_recipes(self):
+        authors = max(1, int(len(self.user_ids)
+                             * self.options['authors_share']))
+        self.author_ids = self.user_ids[:authors]
+        author_weights = zipf_weights(authors, self.options['skew'])
+        ingredient_weights = zipf_weights(len(self.ingredient_ids),
+                                          self.options['skew'])
+        RecipeTag = Recipe.tags.through
+        recipe_ids = []
+        remaining = self.options['recipes']
+        while remaining > 0:
+            size = min(remaining, self.batch_size)
+            remaining -= size
+            with transaction.atomic():
+                recipes = Recipe.objects.bulk_create([
+                    Recipe(
+                        name=' '.join(self.rng.sample(WORDS, 2)).capitalize(),
+                        text=' '.join(self.rng.choices(WORDS, k=30)),
+                        author_id=author_id,
+                        cooking_time=self.rng.randint(5, 180))
+                    for author_id in self.rng.choices(
+                        self.author_ids, cum_weights=author_weights,
+                        k=size)])
+                RecipeTag.objects.bulk_create([
+                    RecipeTag(recipe_id=recipe.id, tag_id=tag_id)
+                    for recipe in recipes
+                    for tag_id in self.rng.sample(
+                        self.tag_ids,
+                        min(len(self.tag_ids), self.rng.randint(1, 3)))])
+                RecipeIngredient.objects.bulk_create([
+                    RecipeIngredient(recipe_id=recipe.id,
+                                     ingredient_id=ingredient_id,
+                                     amount=self.rng.randint(1, 500))
+                    for recipe in recipes
+                    for ingredient_id in self.sample(
+                        self.ingredient_ids, ingredient_weights,
+                        self.options['ingredients_per_recipe'])])
+            recipe_ids += [recipe.id for recipe in recipes]
+            self.stdout.write(f'Создано рецептов: {len(recipe_ids)}')
+        self.report(Recipe, len(recipe_ids))
+        return recipe_ids
+
+    def sample(self, population, cum_weights, mean):
+        """ Различные элементы population, их количество распределено
+        экспоненциально со средним mean."""
+        if not population or mean <= 0:
+            return set()
+        size = max(1, round(self.rng.expovariate(1 / mean)))
+        return set(self.rng.choices(population, cum_weights=cum_weights,
+                                    k=size))
+
+    def create_relations(self, model, field, targets, mean):
+        weights = zipf_weights(len(targets), self.options['skew'])
+        rows = []
+        created = 0
+        for user_id in self.user_ids:
+            rows += [model(user_id=user_id, **{f'{field}_id': target_id})
+                     for target_id in self.sample(targets, weights, mean)
+                     if target_id != user_id or field != 'author']
+            if len(rows) >= self.batch_size:
+                created += len(self.bulk_create(model, rows))
+                rows = []
+        created += len(self.bulk_create(model, rows))
+        self.report(model, created)
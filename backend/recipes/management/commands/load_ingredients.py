@@ -1,10 +1,59 @@
 import csv
+import io
+import json
+import os
 
 from django.core.management import BaseCommand, CommandError
+from django.db import connection, transaction
 
 from recipes.models import Ingredient
+from recipes.signals import ingredients_loaded
 
-MODELS_FIELDS = {}
+JSON_CHUNK_SIZE = 64 * 1024
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if row:
+            name, measurement_unit = row
+            yield name, measurement_unit
+
+
+def read_json(file):
+    """ Потоково читает JSON-массив объектов name / measurement_unit,
+    не загружая файл в память целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    for chunk in iter(lambda: file.read(JSON_CHUNK_SIZE), ''):
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not started:
+                if not buffer:
+                    break
+                if buffer[0] != '[':
+                    raise ValueError('Ожидается JSON-массив')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer[:1] in (',', ']'):
+                buffer = buffer[1:]
+                continue
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                break
+            buffer = buffer[end:]
+            yield item['name'], item['measurement_unit']
+    if buffer.strip():
+        raise ValueError('некорректный JSON')
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
 
 
 class Command(BaseCommand):
@@ -12,18 +61,96 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('--path', type=str, help="file path")
+        parser.add_argument('--format', choices=READERS,
+                            help='file format, by default from extension')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='rows per insert')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='parse the file without saving')
 
     def handle(self, *args, **options):
         file_path = options['path']
+        if not file_path:
+            raise CommandError('Добавьте файл')
+        file_format = (options['format']
+                       or os.path.splitext(file_path)[1].lstrip('.').lower())
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        self.dry_run = options['dry_run']
+        self.read = self.created = 0
         try:
-            with open(file_path, 'r', encoding='utf-8') as csv_file:
-                reader = csv.reader(csv_file)
-                for row in reader:
-                    name, measurement_unit = row
-                    Ingredient.objects.get_or_create(
-                        name=name, measurement_unit=measurement_unit)
-                self.stdout.write(
-                    self.style.SUCCESS('Ингредиенты загружены')
-                )
+            with open(file_path, 'r', encoding='utf-8') as file:
+                self.load(READERS[file_format](file), batch_size)
         except FileNotFoundError:
             raise CommandError('Добавьте файл')
+        except (ValueError, KeyError) as error:
+            raise CommandError(f'Ошибка в строке {self.read + 1}: {error}')
+        if not self.dry_run and self.created:
+            ingredients_loaded.send(sender=Ingredient)
+        self.stdout.write(self.style.SUCCESS(
+            f'Ингредиенты загружены: прочитано {self.read}, '
+            f'добавлено {self.created}'
+            + (' (пробный запуск)' if self.dry_run else '')))
+
+    def load(self, rows, batch_size):
+        # bulk_create с ignore_conflicts не сообщает, сколько строк
+        # вставлено, поэтому без COPY добавленные считаются по разнице
+        # количества ингредиентов до и после загрузки.
+        count_rows = (not self.dry_run
+                      and connection.vendor != 'postgresql')
+        if count_rows:
+            before = Ingredient.objects.count()
+        seen = set()
+        batch = []
+        for row in rows:
+            self.read += 1
+            row = tuple(value.strip() for value in row)
+            if row in seen:
+                continue
+            seen.add(row)
+            batch.append(row)
+            if len(batch) >= batch_size:
+                self.save_batch(batch)
+                batch = []
+        if batch:
+            self.save_batch(batch)
+        if count_rows:
+            self.created = Ingredient.objects.count() - before
+
+    def save_batch(self, batch):
+        if self.dry_run:
+            self.created += len(batch)
+        elif connection.vendor == 'postgresql':
+            self.created += self.copy_batch(batch)
+        else:
+            Ingredient.objects.bulk_create(
+                [Ingredient(name=name, measurement_unit=unit)
+                 for name, unit in batch],
+                ignore_conflicts=True)
+        self.stdout.write(f'Обработано строк: {self.read}')
+
+    @staticmethod
+    def copy_batch(batch):
+        """ Загрузка пачки через COPY во временную таблицу и
+        INSERT ... ON CONFLICT DO NOTHING в таблицу ингредиентов."""
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(batch)
+        buffer.seek(0)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMP TABLE ingredient_load '
+                '(name varchar(200), measurement_unit varchar(200))')
+            cursor.copy_expert(
+                'COPY ingredient_load (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)', buffer)
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit, updated_at) '
+                'SELECT name, measurement_unit, NOW() FROM ingredient_load '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING')
+            created = cursor.rowcount
+            cursor.execute('DROP TABLE ingredient_load')
+        return created
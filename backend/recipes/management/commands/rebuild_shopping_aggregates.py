@@ -0,0 +1,31 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
+
+from recipes.aggregates import rebuild_totals
+from recipes.models import ShoppingAggregate, ShoppingList
+
+
+class Command(BaseCommand):
+    help = ('Recomputing per-user shopping cart ingredient totals '
+            'from cart recipes')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='users per transaction')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        if batch_size < 1:
+            raise CommandError('--batch-size должен быть больше 0')
+        user_ids = sorted(
+            set(ShoppingList.objects.order_by().values_list(
+                'user_id', flat=True).distinct())
+            | set(ShoppingAggregate.objects.order_by().values_list(
+                'user_id', flat=True).distinct()))
+        fixed = 0
+        for start in range(0, len(user_ids), batch_size):
+            with transaction.atomic():
+                fixed += rebuild_totals(user_ids[start:start + batch_size])
+        self.stdout.write(f'Исправлено сумм: {fixed}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Корзины пересчитаны: {len(user_ids)}'))
@@ -0,0 +1,41 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min
+
+from recipes.counters import COUNTERS, actual_count
+
+
+class Command(BaseCommand):
+    help = ('Repairing denormalized favorites, carts, recipes '
+            'and followers counters')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10000,
+                            help='rows per UPDATE statement')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only report the number of drifted rows')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        for model, (target, _, counter) in COUNTERS.items():
+            bounds = target.objects.aggregate(low=Min('id'), high=Max('id'))
+            if bounds['low'] is None:
+                continue
+            fixed = 0
+            for start in range(bounds['low'], bounds['high'] + 1,
+                               batch_size):
+                drifted = target.objects.filter(
+                    id__gte=start, id__lt=start + batch_size
+                ).annotate(
+                    actual=actual_count(model)
+                ).exclude(**{counter: F('actual')})
+                if options['dry_run']:
+                    fixed += drifted.count()
+                    continue
+                with transaction.atomic():
+                    fixed += target.objects.filter(
+                        id__in=list(drifted.values_list('id', flat=True))
+                    ).update(**{counter: actual_count(model)})
+            self.stdout.write(
+                f'{target._meta.label}.{counter}: расхождений {fixed}')
+        self.stdout.write(self.style.SUCCESS('Счетчики проверены'))
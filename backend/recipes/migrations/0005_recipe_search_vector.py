@@ -0,0 +1,102 @@
+# Generated by Django 4.2.3 on 2026-10-18 03:40
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+POSTGRESQL_FORWARDS = [
+    '''CREATE INDEX recipes_recipe_search_vector_gin
+       ON recipes_recipe USING gin (search_vector)''',
+    '''CREATE INDEX recipes_recipe_name_trgm
+       ON recipes_recipe USING gin (name gin_trgm_ops)''',
+    '''CREATE FUNCTION recipes_recipe_search_vector_update()
+       RETURNS trigger AS $$
+       BEGIN
+           NEW.search_vector :=
+               setweight(to_tsvector('russian',
+                                     coalesce(NEW.name, '')), 'A') ||
+               setweight(to_tsvector('russian',
+                                     coalesce(NEW.text, '')), 'B');
+           RETURN NEW;
+       END
+       $$ LANGUAGE plpgsql''',
+    '''CREATE TRIGGER recipes_recipe_search_vector_trigger
+       BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+       FOR EACH ROW EXECUTE FUNCTION recipes_recipe_search_vector_update()''',
+    'UPDATE recipes_recipe SET name = name',
+]
+
+POSTGRESQL_BACKWARDS = [
+    'DROP TRIGGER recipes_recipe_search_vector_trigger ON recipes_recipe',
+    'DROP FUNCTION recipes_recipe_search_vector_update()',
+    'DROP INDEX recipes_recipe_name_trgm',
+    'DROP INDEX recipes_recipe_search_vector_gin',
+]
+
+SQLITE_FORWARDS = [
+    '''CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+       name, text, content='recipes_recipe', content_rowid='id',
+       tokenize='unicode61 remove_diacritics 2')''',
+    '''CREATE TRIGGER recipes_recipe_fts_insert
+       AFTER INSERT ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts (rowid, name, text)
+           VALUES (new.id, new.name, new.text);
+       END''',
+    '''CREATE TRIGGER recipes_recipe_fts_delete
+       AFTER DELETE ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts
+               (recipes_recipe_fts, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+       END''',
+    '''CREATE TRIGGER recipes_recipe_fts_update
+       AFTER UPDATE OF name, text ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts
+               (recipes_recipe_fts, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+           INSERT INTO recipes_recipe_fts (rowid, name, text)
+           VALUES (new.id, new.name, new.text);
+       END''',
+    "INSERT INTO recipes_recipe_fts (recipes_recipe_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARDS = [
+    'DROP TRIGGER recipes_recipe_fts_update',
+    'DROP TRIGGER recipes_recipe_fts_delete',
+    'DROP TRIGGER recipes_recipe_fts_insert',
+    'DROP TABLE recipes_recipe_fts',
+]
+
+
+def run_vendor_sql(postgresql, sqlite):
+    """Выполняет SQL для текущей базы данных: индексы и триггер
+    search_vector в PostgreSQL или таблицу FTS5 в SQLite."""
+    statements = {'postgresql': postgresql, 'sqlite': sqlite}
+
+    def run(apps, schema_editor):
+        for sql in statements.get(schema_editor.connection.vendor, ()):
+            schema_editor.execute(sql, params=None)
+
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_updated_at'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(
+            run_vendor_sql(POSTGRESQL_FORWARDS, SQLITE_FORWARDS),
+            run_vendor_sql(POSTGRESQL_BACKWARDS, SQLITE_BACKWARDS),
+        ),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 4.2.3 on 2026-10-18 03:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_of(model, field):
+    return Coalesce(Subquery(
+        model.objects.order_by().filter(**{field: OuterRef('pk')}).values(
+            field).annotate(total=Count('pk')).values('total')), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    Recipe.objects.update(
+        favorites_count=count_of(Favorite, 'recipe_id'),
+        carts_count=count_of(ShoppingList, 'recipe_id'),
+    )
+
+
+# AddField в SQLite пересоздает таблицу recipes_recipe и удаляет вместе
+# со старой таблицей триггеры FTS5 из 0005; их нужно создать заново.
+SQLITE_SEARCH_TRIGGERS = [
+    '''CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+       AFTER INSERT ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts (rowid, name, text)
+           VALUES (new.id, new.name, new.text);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+       AFTER DELETE ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts
+               (recipes_recipe_fts, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+       AFTER UPDATE OF name, text ON recipes_recipe
+       BEGIN
+           INSERT INTO recipes_recipe_fts
+               (recipes_recipe_fts, rowid, name, text)
+           VALUES ('delete', old.id, old.name, old.text);
+           INSERT INTO recipes_recipe_fts (rowid, name, text)
+           VALUES (new.id, new.name, new.text);
+       END''',
+    "INSERT INTO recipes_recipe_fts (recipes_recipe_fts) VALUES ('rebuild')",
+]
+
+
+def restore_search_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for sql in SQLITE_SEARCH_TRIGGERS:
+        schema_editor.execute(sql, params=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_tags_tag_recipe_index'),
+    ]
+
+    operations = [
+        # При откате RemoveField снова пересоздает таблицу.
+        migrations.RunPython(migrations.RunPython.noop,
+                             restore_search_triggers),
+        migrations.AddField(
+            model_name='recipe',
+            name='carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в корзину'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Добавлений в избранное'),
+        ),
+        migrations.RunPython(restore_search_triggers,
+                             migrations.RunPython.noop),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-favorites_count', '-id'], name='recipe_popularity_idx'),
+        ),
+    ]
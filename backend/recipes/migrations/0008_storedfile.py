@@ -0,0 +1,44 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:05
+
+from collections import Counter
+
+from django.db import migrations, models
+
+
+def fill_references(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    StoredFile = apps.get_model('recipes', 'StoredFile')
+    references = Counter()
+    for image, variants in Recipe.objects.values_list(
+            'image', 'image_variants').iterator():
+        names = set((variants or {}).values())
+        if image:
+            names.add(image)
+        references.update(names)
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name, references=count)
+         for name, count in references.items()], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_recipe_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoredFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True, verbose_name='Имя файла')),
+                ('references', models.PositiveIntegerField(default=0, verbose_name='Количество ссылок')),
+                ('updated_at', models.DateTimeField(auto_now=True, db_index=True, verbose_name='Дата изменения ссылок')),
+            ],
+            options={
+                'verbose_name': 'Файл',
+                'verbose_name_plural': 'Файлы',
+            },
+        ),
+        migrations.RunPython(fill_references, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.3 on 2026-10-18 04:08
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_aggregates(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingAggregate = apps.get_model('recipes', 'ShoppingAggregate')
+    rows = RecipeIngredient.objects.filter(
+        recipe__carts__isnull=False
+    ).values_list(
+        'recipe__carts__user_id', 'ingredient_id'
+    ).annotate(total=Sum('amount')).order_by()
+    ShoppingAggregate.objects.bulk_create(
+        [ShoppingAggregate(user_id=user_id, ingredient_id=ingredient_id,
+                           total_amount=total)
+         for user_id, ingredient_id, total in rows.iterator()],
+        batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0008_storedfile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingAggregate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(default=0, verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_aggregates', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_aggregates', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Сумма ингредиента в корзине',
+                'verbose_name_plural': 'Суммы ингредиентов в корзине',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingaggregate',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_user_ingredient_aggregate'),
+        ),
+        migrations.RunPython(fill_aggregates, migrations.RunPython.noop),
+    ]
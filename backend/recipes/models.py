@@ -1,5 +1,11 @@
+import re
+
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVectorField,
+                                            TrigramSimilarity)
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import F, Prefetch, Q
 
 from users.models import User
 
@@ -16,6 +22,8 @@ class Tag(models.Model):
     slug = models.SlugField('Slug',
                             max_length=200,
                             unique=True)
+    updated_at = models.DateTimeField('Дата изменения',
+                                      auto_now=True)
 
     class Meta:
         verbose_name = 'Тег'
@@ -31,15 +39,82 @@ class Ingredient(models.Model):
                             max_length=200,)
     measurement_unit = models.CharField('Единица измерения',
                                         max_length=200,)
+    updated_at = models.DateTimeField('Дата изменения',
+                                      auto_now=True,
+                                      db_index=True)
 
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient_name_unit')]
 
     def __str__(self):
         return self.name
 
 
+SEARCH_CONFIG = 'russian'
+SEARCH_FTS_TABLE = 'recipes_recipe_fts'
+
+
+class RecipeQuerySet(models.QuerySet):
+    """Выборки рецептов с подгрузкой связанных данных."""
+
+    def with_related(self):
+        """Подгружает автора и ингредиенты фиксированным числом
+        запросов независимо от размера выборки."""
+        return self.select_related('author').defer(
+            'search_vector'
+        ).prefetch_related(
+            Prefetch('recipe_ingredients',
+                     queryset=RecipeIngredient.objects.select_related(
+                         'ingredient')),
+        )
+
+    def search(self, query):
+        """Полнотекстовый поиск по названию и описанию рецепта.
+
+        В PostgreSQL используется индексированный search_vector с
+        ранжированием ts_rank и триграммное сходство названия для опечаток,
+        в SQLite - таблица FTS5 с ранжированием bm25, в остальных базах -
+        icontains. Результаты упорядочены по убыванию релевантности."""
+        vendor = connections[self.db].vendor
+        if vendor == 'postgresql':
+            return self._search_postgresql(query)
+        if vendor == 'sqlite':
+            return self._search_sqlite(query)
+        return self.filter(Q(name__icontains=query)
+                           | Q(text__icontains=query))
+
+    def _search_postgresql(self, query):
+        search_query = SearchQuery(query, search_type='websearch',
+                                   config=SEARCH_CONFIG)
+        return self.annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+            similarity=TrigramSimilarity('name', query),
+        ).filter(
+            Q(search_vector=search_query) | Q(name__trigram_similar=query)
+        ).order_by('-rank', '-similarity', '-id')
+
+    def _search_sqlite(self, query):
+        words = re.findall(r'\w+', query)
+        if not words:
+            return self.none()
+        match = ' '.join(f'"{word}"*' for word in words)
+        table = self.model._meta.db_table
+        # Соединение с FTS5, а не коррелированный подзапрос: SQLite
+        # выполняет MATCH один раз, а не для каждой строки рецептов.
+        return self.extra(
+            select={'rank': f'-bm25({SEARCH_FTS_TABLE}, 10.0, 1.0)'},
+            tables=[SEARCH_FTS_TABLE],
+            where=[f'{SEARCH_FTS_TABLE} MATCH %s',
+                   f'{SEARCH_FTS_TABLE}.rowid = {table}.id'],
+            params=[match],
+        ).order_by('-rank', '-id')
+
+
 class Recipe(models.Model):
     '''Модель рецепта'''
     name = models.CharField('Название рецепта',
@@ -47,6 +122,10 @@ class Recipe(models.Model):
     image = models.ImageField('Картинка',
                               upload_to='recipes/',
                               blank=True)
+    image_variants = models.JSONField('Варианты картинки',
+                                      default=dict,
+                                      blank=True,
+                                      editable=False)
     text = models.TextField('Описание рецепта',
                             max_length=1000)
     ingredients = models.ManyToManyField(
@@ -72,11 +151,36 @@ class Recipe(models.Model):
         'Дата и время публикации рецепта',
         auto_now_add=True
     )
+    updated_at = models.DateTimeField(
+        'Дата изменения рецепта',
+        auto_now=True,
+        db_index=True
+    )
+    search_vector = SearchVectorField(
+        'Поисковый вектор',
+        null=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'Добавлений в избранное',
+        default=0,
+        editable=False
+    )
+    carts_count = models.PositiveIntegerField(
+        'Добавлений в корзину',
+        default=0,
+        editable=False
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         ordering = ['-id']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
+        indexes = [
+            models.Index(fields=['-favorites_count', '-id'],
+                         name='recipe_popularity_idx')]
 
     def __str__(self):
         return self.name
@@ -174,3 +278,69 @@ class ShoppingList(models.Model):
     def __str__(self):
         return (f'{self.user.username} добавил'
                 f'{self.recipe.name} в корзину покупок')
+
+
+class StoredFile(models.Model):
+    """ Файл хранилища картинок и количество рецептов, ссылающихся
+    на него как на картинку или ее вариант."""
+    name = models.CharField('Имя файла',
+                            max_length=255,
+                            unique=True)
+    references = models.PositiveIntegerField('Количество ссылок',
+                                             default=0)
+    updated_at = models.DateTimeField('Дата изменения ссылок',
+                                      auto_now=True,
+                                      db_index=True)
+
+    class Meta:
+        verbose_name = 'Файл'
+        verbose_name_plural = 'Файлы'
+
+    def __str__(self):
+        return self.name
+
+
+class ShoppingAggregate(models.Model):
+    """ Суммарное количество ингредиента во всех рецептах корзины
+    пользователя. Поддерживается recipes.aggregates при изменении
+    корзины и ингредиентов рецептов."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_aggregates',
+        verbose_name='Пользователь'
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_aggregates',
+        verbose_name='Ингредиент'
+    )
+    total_amount = models.PositiveIntegerField('Количество',
+                                               default=0)
+
+    class Meta:
+        verbose_name = 'Сумма ингредиента в корзине'
+        verbose_name_plural = 'Суммы ингредиентов в корзине'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_user_ingredient_aggregate')]
+
+
+class Deletion(models.Model):
+    """ Время последнего удаления объектов модели.
+
+    Удаление не оставляет updated_at в таблице модели, поэтому версии
+    списков для ETag и Last-Modified учитывают его по этой таблице."""
+    model = models.CharField('Модель',
+                             max_length=100,
+                             unique=True)
+    deleted_at = models.DateTimeField('Дата удаления')
+
+    class Meta:
+        verbose_name = 'Удаление'
+        verbose_name_plural = 'Удаления'
+
+    def __str__(self):
+        return self.model
@@ -0,0 +1,82 @@
+from django.core.checks import Warning
+from django.db import connections
+
+from recipes.models import SEARCH_FTS_TABLE
+
+# Триггеры, которые поддерживают таблицу FTS5 в SQLite. Миграции,
+# пересоздающие recipes_recipe (AddField, AlterField и т.п.), удаляют их
+# вместе со старой таблицей, поэтому после migrate они проверяются
+# и при необходимости создаются заново.
+SQLITE_TRIGGERS = {
+    'recipes_recipe_fts_insert': f'''
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+        AFTER INSERT ON recipes_recipe
+        BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE} (rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END''',
+    'recipes_recipe_fts_delete': f'''
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+        AFTER DELETE ON recipes_recipe
+        BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE}
+                ({SEARCH_FTS_TABLE}, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+        END''',
+    'recipes_recipe_fts_update': f'''
+        CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+        AFTER UPDATE OF name, text ON recipes_recipe
+        BEGIN
+            INSERT INTO {SEARCH_FTS_TABLE}
+                ({SEARCH_FTS_TABLE}, rowid, name, text)
+            VALUES ('delete', old.id, old.name, old.text);
+            INSERT INTO {SEARCH_FTS_TABLE} (rowid, name, text)
+            VALUES (new.id, new.name, new.text);
+        END''',
+}
+
+
+def missing_triggers(connection):
+    """ Триггеры FTS5, которых нет в базе, или None, если поиск
+    в этой базе не использует FTS5 (не SQLite или таблица еще
+    не создана миграциями)."""
+    if connection.vendor != 'sqlite':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master "
+            "WHERE type IN ('table', 'trigger')")
+        existing = {name for _, name in cursor.fetchall()}
+    if SEARCH_FTS_TABLE not in existing:
+        return None
+    return sorted(set(SQLITE_TRIGGERS) - existing)
+
+
+def ensure_search_index(using='default', verbosity=1, **kwargs):
+    """ Обработчик post_migrate: создает недостающие триггеры и
+    перестраивает таблицу FTS5, пропустившую изменения рецептов."""
+    connection = connections[using]
+    missing = missing_triggers(connection)
+    if not missing:
+        return
+    with connection.cursor() as cursor:
+        for name in missing:
+            cursor.execute(SQLITE_TRIGGERS[name])
+        cursor.execute(f"INSERT INTO {SEARCH_FTS_TABLE} "
+                       f"({SEARCH_FTS_TABLE}) VALUES ('rebuild')")
+    if verbosity:
+        print(f'Восстановлены триггеры поиска: {", ".join(missing)}')
+
+
+def check_search_index(app_configs=None, databases=None, **kwargs):
+    errors = []
+    for alias in databases or ():
+        missing = missing_triggers(connections[alias])
+        if missing:
+            errors.append(Warning(
+                f'В базе {alias} нет триггеров поиска рецептов: '
+                f'{", ".join(missing)}.',
+                hint='Выполните manage.py migrate, чтобы создать их '
+                     'и перестроить индекс.',
+                id='recipes.W001'))
+    return errors
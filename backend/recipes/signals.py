@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+# Отправляется после массовой загрузки ингредиентов, которая
+# не вызывает post_save для отдельных объектов.
+ingredients_loaded = Signal()
+
+# Отправляется после пересчета сумм корзин пользователей user_ids
+# массовыми запросами, которые не вызывают сигналов моделей.
+shopping_totals_rebuilt = Signal()
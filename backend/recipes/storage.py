@@ -0,0 +1,76 @@
+import hashlib
+import os
+import posixpath
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db.models import F, Value
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from recipes.models import StoredFile
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """ Хранилище, которое называет файлы по SHA-256 содержимого.
+
+    Файл сохраняется как <каталог>/<2 символа хеша>/<хеш>.<расширение>;
+    если такой файл уже есть, запись пропускается, поэтому одинаковые
+    картинки хранятся один раз. Ссылки на файлы считает StoredFile,
+    неиспользуемые удаляет команда cleanup_media."""
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.content_name(name, content)
+        if self.exists(name):
+            # Время изменения защищает файл от cleanup_media, пока
+            # новая ссылка на него не сохранена.
+            os.utime(self.path(name))
+            return name
+        return super().save(name, content, max_length)
+
+    @staticmethod
+    def content_name(name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        digest = digest.hexdigest()
+        directory, filename = posixpath.split(name.replace('\\', '/'))
+        extension = os.path.splitext(filename)[1].lower()
+        return posixpath.join(directory, digest[:2], digest + extension)
+
+
+def image_files(image, variants):
+    """ Имена файлов хранилища картинки рецепта и ее вариантов."""
+    names = set((variants or {}).values())
+    if image:
+        names.add(image)
+    return names
+
+
+def recipe_files(recipe):
+    return image_files(recipe.image.name, recipe.image_variants)
+
+
+def add_references(names):
+    if not names:
+        return
+    StoredFile.objects.bulk_create(
+        [StoredFile(name=name) for name in names], ignore_conflicts=True)
+    StoredFile.objects.filter(name__in=names).update(
+        references=F('references') + 1, updated_at=timezone.now())
+
+
+def remove_references(names):
+    """ Уменьшает счетчики ссылок; файлы без ссылок остаются на диске
+    до запуска cleanup_media."""
+    if not names:
+        return
+    StoredFile.objects.filter(name__in=names).update(
+        references=Greatest(F('references') - 1, Value(0)),
+        updated_at=timezone.now())
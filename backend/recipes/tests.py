@@ -0,0 +1,204 @@
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import skipIf, skipUnless
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from recipes.models import (Favorite, Ingredient, Recipe, RecipeIngredient,
+                            ShoppingList, StoredFile, Tag)
+from recipes.search import (check_search_index, ensure_search_index,
+                            missing_triggers)
+from users.models import Follow, User
+
+
+@skipUnless(connection.vendor == 'sqlite', 'индекс FTS5 есть только в SQLite')
+class SQLiteSearchIndexTests(TestCase):
+    """ Триггеры FTS5 после всех миграций и их восстановление."""
+
+    def test_triggers_exist_after_migrate(self):
+        self.assertEqual(missing_triggers(connection), [])
+        self.assertEqual(check_search_index(databases=['default']), [])
+
+    def test_dropped_trigger_is_reported_and_restored(self):
+        author = User.objects.create_user(
+            username='author', email='author@example.com',
+            password='password')
+        with connection.cursor() as cursor:
+            cursor.execute('DROP TRIGGER recipes_recipe_fts_insert')
+        recipe = Recipe.objects.create(author=author, name='Курица',
+                                       text='Запечь.', cooking_time=40)
+        self.assertEqual(
+            [error.id for error in check_search_index(databases=['default'])],
+            ['recipes.W001'])
+        ensure_search_index(verbosity=0)
+        self.assertEqual(missing_triggers(connection), [])
+        self.assertEqual(list(Recipe.objects.search('курица')), [recipe])
+
+
+class MediaFileTests(TestCase):
+    """ Отдача файлов /media/ с X-Accel-Redirect и без него."""
+
+    def setUp(self):
+        cache.clear()
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        settings_override = override_settings(MEDIA_ROOT=media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.name = default_storage.save('recipes/images/photo.jpg',
+                                         ContentFile(b'jpeg'))
+        StoredFile.objects.create(name=self.name, references=1)
+
+    def test_file_is_served_by_django(self):
+        response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), b'jpeg')
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+
+    @override_settings(MEDIA_ACCEL_REDIRECT='/protected-media/')
+    def test_file_is_served_by_nginx(self):
+        response = self.client.get(f'/media/{self.name}')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'],
+                         f'/protected-media/{self.name}')
+
+    def test_reference_check_is_cached(self):
+        self.client.get(f'/media/{self.name}')
+        with self.assertNumQueries(0):
+            self.client.get(f'/media/{self.name}')
+
+    def test_unreferenced_file_is_not_found(self):
+        StoredFile.objects.filter(name=self.name).update(references=0)
+        self.assertEqual(self.client.get(f'/media/{self.name}').status_code,
+                         404)
+
+
+class LoadIngredientsTests(TestCase):
+    """ Загрузка справочника ингредиентов командой load_ingredients."""
+
+    ROWS = ('соль,г\n'
+            'сахар,г\n'
+            ' соль , г \n'
+            'мука,г\n'
+            'сахар,г\n')
+
+    def setUp(self):
+        cache.clear()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.path = os.path.join(directory, 'ingredients.csv')
+        with open(self.path, 'w', encoding='utf-8') as file:
+            file.write(self.ROWS)
+
+    def load(self, **options):
+        output = StringIO()
+        call_command('load_ingredients', path=self.path, stdout=output,
+                     **options)
+        return output.getvalue()
+
+    def test_duplicates_are_loaded_once(self):
+        output = self.load(batch_size=2)
+        self.assertIn('прочитано 5, добавлено 3', output)
+        self.assertEqual(
+            sorted(Ingredient.objects.values_list('name', flat=True)),
+            ['мука', 'сахар', 'соль'])
+
+    def test_existing_ingredients_are_skipped(self):
+        Ingredient.objects.create(name='соль', measurement_unit='г')
+        output = self.load(batch_size=2)
+        self.assertIn('прочитано 5, добавлено 2', output)
+        self.assertEqual(Ingredient.objects.count(), 3)
+        self.assertIn('прочитано 5, добавлено 0', self.load())
+
+    def test_dry_run_saves_nothing(self):
+        output = self.load(dry_run=True)
+        self.assertIn('прочитано 5, добавлено 3 (пробный запуск)', output)
+        self.assertFalse(Ingredient.objects.exists())
+
+    @skipIf(connection.vendor == 'postgresql',
+            'в PostgreSQL добавленные строки считает COPY')
+    def test_ingredients_are_counted_once_per_run(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.load(batch_size=1)
+        counts = [query['sql'] for query in queries
+                  if 'COUNT(' in query['sql'].upper()]
+        self.assertEqual(len(counts), 2)
+
+
+class AdminQueryCountTests(TestCase):
+    """ Количество запросов страниц админки не зависит от числа строк."""
+
+    CHANGELISTS = {
+        'recipes/recipe': 5,
+        'recipes/tag': 8,
+        'recipes/ingredient': 5,
+        'recipes/recipeingredient': 4,
+        'recipes/favorite': 4,
+        'recipes/shoppinglist': 4,
+        'users/user': 4,
+        'users/follow': 4,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser(
+            username='admin', email='admin@example.com', password='password')
+        cls.create_recipes(3)
+
+    @classmethod
+    def create_recipes(cls, amount):
+        start = Recipe.objects.count()
+        for number in range(start, start + amount):
+            author = User.objects.create_user(
+                username=f'author{number}',
+                email=f'author{number}@example.com', password='password')
+            tag = Tag.objects.create(name=f'Тег {number}',
+                                     color=f'#{number:06d}',
+                                     slug=f'tag-{number}')
+            ingredient = Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г')
+            recipe = Recipe.objects.create(
+                author=author, name=f'Рецепт {number}', text='Текст',
+                cooking_time=5)
+            recipe.tags.set([tag])
+            RecipeIngredient.objects.create(recipe=recipe,
+                                            ingredient=ingredient, amount=10)
+            Favorite.objects.create(user=cls.admin, recipe=recipe)
+            ShoppingList.objects.create(user=cls.admin, recipe=recipe)
+            Follow.objects.create(user=cls.admin, author=author)
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.admin)
+
+    def assert_page_queries(self, count, path):
+        self.assertEqual(self.client.get(path).status_code, 200)
+        with self.subTest(path=path), self.assertNumQueries(count):
+            self.assertEqual(self.client.get(path).status_code, 200)
+
+    def assert_changelists(self):
+        for model, count in self.CHANGELISTS.items():
+            self.assert_page_queries(count, f'/admin/{model}/')
+
+    def test_changelists(self):
+        self.assert_changelists()
+
+    def test_changelists_with_more_rows(self):
+        self.create_recipes(10)
+        self.assert_changelists()
+
+    def test_change_pages(self):
+        recipe = Recipe.objects.last()
+        self.assert_page_queries(
+            8, f'/admin/recipes/recipe/{recipe.id}/change/')
+        self.assert_page_queries(
+            7, '/admin/recipes/recipeingredient/'
+               f'{recipe.recipe_ingredients.get().id}/change/')
@@ -0,0 +1,56 @@
+import mimetypes
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponse
+from django.views.decorators.http import require_safe
+
+from recipes.models import StoredFile
+
+
+MEDIA_REFERENCED_KEY = 'media:referenced:{name}'
+# Сколько секунд помнить, что на файл ссылается рецепт. Файл без ссылок
+# удаляет только cleanup_media спустя --min-age минут (по умолчанию 60),
+# поэтому устаревшая запись не отдает удаленный файл.
+MEDIA_REFERENCED_TIMEOUT = 60
+
+
+def is_referenced(name):
+    """ Ссылается ли на файл хотя бы один рецепт. Положительный ответ
+    кешируется, чтобы не обращаться к базе на каждую картинку страницы;
+    отрицательный - нет, чтобы новая картинка была доступна сразу."""
+    key = MEDIA_REFERENCED_KEY.format(name=name)
+    if cache.get(key):
+        return True
+    referenced = StoredFile.objects.filter(
+        name=name, references__gt=0).exists()
+    if referenced:
+        cache.set(key, True, MEDIA_REFERENCED_TIMEOUT)
+    return referenced
+
+
+@require_safe
+def media_file(request, name):
+    """ Отдает файл хранилища, на который ссылается рецепт.
+
+    С MEDIA_ACCEL_REDIRECT содержимое отправляет nginx по
+    X-Accel-Redirect, без него - Django."""
+    if not is_referenced(name):
+        raise Http404
+    content_type, _ = mimetypes.guess_type(name)
+    content_type = content_type or 'application/octet-stream'
+    if settings.MEDIA_ACCEL_REDIRECT:
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = (settings.MEDIA_ACCEL_REDIRECT
+                                        + quote(name))
+    else:
+        try:
+            file = default_storage.open(name)
+        except FileNotFoundError:
+            raise Http404
+        response = FileResponse(file, content_type=content_type)
+    # Имена файлов не переиспользуются: при новом содержимом меняется хеш.
+    response['Cache-Control'] = 'public, max-age=31536000, immutable'
+    return response
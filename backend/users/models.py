@@ -25,6 +25,12 @@ class User(AbstractUser):
                                 max_length=150,
                                 blank=False,
                                 null=False)
+    recipes_count = models.PositiveIntegerField('Количество рецептов',
+                                                default=0,
+                                                editable=False)
+    followers_count = models.PositiveIntegerField('Количество подписчиков',
+                                                  default=0,
+                                                  editable=False)
 
     class Meta:
         verbose_name = 'Пользователь'